@@ -0,0 +1,59 @@
+from fastapi import HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from auth import TTLCache
+from config import settings
+from queries import document_owner, document_with_access
+from tables import Document
+
+
+# document_id -> set of user_ids known to own it. Only positive answers are cached;
+# share, unshare and delete drop the document's entry.
+acl_cache = TTLCache(settings.ACL_CACHE_TTL_SECONDS, settings.AUTH_CACHE_MAX_ENTRIES)
+
+
+def _remember_owner(document_id: int, user_id: int):
+    owners = acl_cache.get(document_id)
+    if owners is None:
+        acl_cache.put(document_id, {user_id})
+    else:
+        owners.add(user_id)
+
+
+def invalidate_access(document_id: int):
+    """Forget cached owners of a document after its owner list changed."""
+    acl_cache.invalidate(document_id)
+
+
+async def load_document(db: AsyncSession, document_id: int, user_id: int) -> tuple[Document, str | None]:
+    """
+    Load a document for a user in one query: the document, whether the user owns it and
+    the head version's mongo_id. Raises 403 if the user doesn't own it.
+    """
+    result = await db.execute(document_with_access(document_id, user_id))
+    row = result.one_or_none()
+
+    if row is None or row[1] is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied"
+        )
+
+    _remember_owner(document_id, user_id)
+    return row[0], row[2]
+
+
+async def require_access(db: AsyncSession, document_id: int, user_id: int):
+    """Raise 403 unless the user owns the document; answered from the ACL cache when possible."""
+    owners = acl_cache.get(document_id)
+    if owners is not None and user_id in owners:
+        return
+
+    result = await db.execute(document_owner(document_id, user_id))
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied"
+        )
+
+    _remember_owner(document_id, user_id)
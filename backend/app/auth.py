@@ -1,22 +1,106 @@
+import asyncio
 import secrets
 import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from jose import JWTError, jwt
-from typing import Optional
+from functools import cache
+from jose import JWTError, jwk, jwt
+from jose.backends.base import Key
+from typing import Any, Optional
 from passlib.context import CryptContext
 from config import settings
 
 
 logger = logging.getLogger(__name__)
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
 
+# bcrypt releases the GIL, so a thread pool scales with cores. It is kept apart from the
+# patch executor so a login burst and heavy commits cannot starve each other.
+_password_pool = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
 
+async def hash_password(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_password_pool, pwd_context.hash, password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+
+async def verify_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """
+    Check a password off the event loop. Returns (valid, new_hash); new_hash is set when
+    the stored hash was made with a different cost than BCRYPT_ROUNDS and should be replaced.
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        _password_pool, pwd_context.verify_and_update, plain_password, hashed_password
+    )
+
+
+def shutdown_password_pool():
+    _password_pool.shutdown(wait=False, cancel_futures=True)
+
+
+class TTLCache:
+    """
+    Small in-process cache whose entries expire after ttl seconds, or earlier if an
+    expiry is given on put. Once max_entries is reached the oldest entry is dropped.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Any, tuple[Any, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value, expires_at: float | None = None):
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+
+        self._entries[key] = (value, deadline)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+token_cache = TTLCache(settings.TOKEN_CACHE_TTL_SECONDS, settings.AUTH_CACHE_MAX_ENTRIES)
+user_cache = TTLCache(settings.USER_CACHE_TTL_SECONDS, settings.AUTH_CACHE_MAX_ENTRIES)
+
+
+@cache
+def _signing_key() -> Key:
+    return jwk.construct(settings.JWT_PRIVATE_KEY, settings.JWT_ALGORITHM)
+
+
+@cache
+def _verification_key() -> Key:
+    return jwk.construct(settings.JWT_PUBLIC_KEY, settings.JWT_ALGORITHM)
+
+
+def load_keys():
+    """Read and parse the JWT keys now rather than on the first request (raises if they are missing)."""
+    _signing_key()
+    _verification_key()
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -28,16 +112,24 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         expire = datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
 
     to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, settings.JWT_PRIVATE_KEY, algorithm=settings.JWT_ALGORITHM)
+    return jwt.encode(to_encode, _signing_key(), algorithm=settings.JWT_ALGORITHM)
 
 
 def decode_access_token(token: str) -> dict | None:
+    # Fast path: a token verified recently is trusted until the TTL or its own exp runs out
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+
     try:
-        return jwt.decode(token, settings.JWT_PUBLIC_KEY, algorithms=[settings.JWT_ALGORITHM])
+        payload = jwt.decode(token, _verification_key(), algorithms=[settings.JWT_ALGORITHM])
     except JWTError as e:
         logger.warning(f"JWT decode error: {e}")
         return None
 
+    token_cache.put(token, payload, expires_at=payload.get("exp"))
+    return payload
+
 
 def generate_refresh_token() -> str:
     return secrets.token_hex(32)  # 32 bytes = 64 hex characters
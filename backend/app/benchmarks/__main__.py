@@ -0,0 +1,313 @@
+"""
+In-process benchmarks for the version-history workloads, without PostgreSQL or MongoDB:
+
+    python -m benchmarks [--sizes 4,64] [--depths 10,100,1000] [--iterations 50]
+                         [--output results.json] [--thresholds benchmarks/thresholds.json]
+                         [--baseline previous.json --max-regression 0.25]
+
+The FastAPI app runs in-process behind httpx, with SQLite (aiosqlite) in place of
+PostgreSQL and benchmarks.mongo_stub in place of MongoDB; every other setting comes from
+config.py as usual, so e.g. KEYFRAME_INTERVAL=10 python -m benchmarks measures that.
+
+Each scenario reports throughput (sequential requests per second) and p50/p95/p99
+latency. The exit status is 1 if a threshold or the allowed regression against a
+baseline run is exceeded.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import platform
+import random
+import re
+import sys
+import time
+
+import jsonpatch
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import database
+from benchmarks.generator import evolve, make_document, make_vocabulary, random_patch
+from benchmarks.mongo_stub import InMemoryMongoClient
+from config import settings
+from profiling import instrument_engine
+
+
+logger = logging.getLogger("benchmarks")
+
+PASSWORD = "benchmark-password"
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "mean_ms", "max_ms")
+
+
+def install_standins():
+    """Point database.py at SQLite and the in-memory store before the app imports them."""
+    try:
+        import aiosqlite  # noqa: F401
+    except ImportError:
+        sys.exit("The benchmarks need aiosqlite (pip install aiosqlite)")
+
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+    from sqlalchemy.pool import StaticPool
+
+    database.engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    instrument_engine(database.engine)  # Keep the profiling overhead in the numbers
+    database.AsyncSessionLocal = async_sessionmaker(database.engine, class_=AsyncSession, expire_on_commit=False)
+    database.mongo_client = InMemoryMongoClient()
+    database.mongo_db = database.mongo_client["izanagi_warehouse"]
+    database.document_contents = database.mongo_db["document_contents"]
+
+    # Outside the container there are usually no key files; a throwaway pair will do
+    if not Path("/app/private_key.pem").exists():
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        settings.__dict__["JWT_PRIVATE_KEY"] = key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ).decode()
+        settings.__dict__["JWT_PUBLIC_KEY"] = key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+        ).decode()
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Nearest-rank percentile."""
+    rank = max(1, round(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def result_key(name: str, params: dict) -> str:
+    return f"{name}[{','.join(f'{k}={v}' for k, v in params.items())}]"
+
+
+class Bench:
+    def __init__(self, client, warmup: int):
+        self.client = client
+        self.warmup = warmup
+        self.results: list[dict] = []
+
+    async def request(self, method: str, url: str, expect: int = 200, **kwargs):
+        response = await self.client.request(method, url, **kwargs)
+        if response.status_code != expect:
+            raise RuntimeError(f"{method} {url} returned {response.status_code}: {response.text[:200]}")
+        return response
+
+    async def measure(self, name: str, params: dict, iterations: int, call: Callable[[int], Awaitable]):
+        """Time iterations calls of call(i), after self.warmup untimed ones."""
+        for i in range(self.warmup):
+            await call(-1 - i)
+
+        latencies = []
+        started = time.perf_counter()
+        for i in range(iterations):
+            t0 = time.perf_counter()
+            await call(i)
+            latencies.append((time.perf_counter() - t0) * 1000)
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        result = {
+            "key": result_key(name, params),
+            "name": name,
+            "params": params,
+            "count": iterations,
+            "ops_per_sec": round(iterations / elapsed, 2),
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "mean_ms": round(sum(latencies) / len(latencies), 3),
+            "max_ms": round(latencies[-1], 3)
+        }
+        self.results.append(result)
+        logger.info(f"{result['key']:<50} {result['ops_per_sec']:>9.1f}/s  p50 {result['p50_ms']:>8.2f}ms  p95 {result['p95_ms']:>8.2f}ms  p99 {result['p99_ms']:>8.2f}ms")
+
+
+async def run_benchmarks(args) -> tuple[list[dict], dict]:
+    import httpx
+
+    # Imported only now so every module binds the stand-ins
+    app = importlib.import_module("main").app
+    from offload import shutdown_executor
+    from auth import shutdown_password_pool
+    from versioning import version_cache
+    from workers import run_delta_worker
+
+    async with database.engine.begin() as conn:
+        await conn.run_sync(database.Base.metadata.create_all)
+    delta_worker = asyncio.create_task(run_delta_worker()) if settings.WRITE_BEHIND_DELTAS else None
+
+    rng = random.Random(args.seed)
+    vocabulary = make_vocabulary(rng)
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark")
+
+    try:
+        bench = Bench(client, args.warmup)
+        await bench.request("POST", "/auth/register", expect=201, json={"username": "bench", "email": "bench@example.com", "password": PASSWORD})
+        login = await bench.request("POST", "/auth/login", json={"username": "bench", "password": PASSWORD})
+        client.headers["Authorization"] = f"Bearer {login.json()['access_token']}"
+
+        for size_kb in args.sizes:
+            base = make_document(rng, vocabulary, size_kb * 1024)
+
+            async def create(i):
+                await bench.request("POST", "/documents", expect=201, json={"title": f"doc {i}", "content": base})
+            await bench.measure("create", {"size_kb": size_kb}, args.iterations, create)
+
+            for depth in args.depths:
+                # Build a document with depth versions behind its head (not timed)
+                content = base
+                response = await bench.request("POST", "/documents", expect=201, json={"title": f"history {size_kb}KB x {depth}", "content": content})
+                document_id = response.json()["document_id"]
+                for _ in range(depth):
+                    content = evolve(rng, vocabulary, content)
+                    await bench.request("POST", f"/documents/{document_id}/commit", json={"content": content})
+                head = depth
+                params = {"size_kb": size_kb, "depth": depth}
+
+                async def get_document(i):
+                    await bench.request("GET", f"/documents/{document_id}")
+                await bench.measure("get_document", params, args.iterations, get_document)
+
+                async def get_version_cold(i):
+                    version_cache.invalidate(document_id)
+                    await bench.request("GET", f"/documents/{document_id}/versions/0")
+                await bench.measure("get_version", params, args.iterations, get_version_cold)
+
+                async def get_version_cached(i):
+                    await bench.request("GET", f"/documents/{document_id}/versions/0")
+                await bench.measure("get_version_cached", params, args.iterations, get_version_cached)
+
+                async def list_versions(i):
+                    await bench.request("GET", f"/documents/{document_id}/versions", params={"limit": 100})
+                await bench.measure("list_versions", params, args.iterations, list_versions)
+
+                # Commits last: they move the head
+                async def commit(i):
+                    nonlocal content, head
+                    content = evolve(rng, vocabulary, content)
+                    await bench.request("POST", f"/documents/{document_id}/commit", json={"content": content})
+                    head += 1
+                await bench.measure("commit", params, args.iterations, commit)
+
+                async def commit_patch(i):
+                    nonlocal content, head
+                    patch = random_patch(rng, vocabulary, content)
+                    content = jsonpatch.apply_patch(content, patch)
+                    await bench.request("POST", f"/documents/{document_id}/commit", json={"patch": patch}, headers={"If-Match": str(head)})
+                    head += 1
+                await bench.measure("commit_patch", params, args.iterations, commit_patch)
+
+        documents = len((await bench.request("GET", "/documents", params={"limit": settings.LIST_PAGE_SIZE_MAX})).json())
+
+        async def list_documents(i):
+            await bench.request("GET", "/documents", params={"limit": 100})
+        await bench.measure("list_documents", {"documents": documents}, args.iterations, list_documents)
+    finally:
+        await client.aclose()
+        if delta_worker:
+            delta_worker.cancel()
+        shutdown_executor()
+        shutdown_password_pool()
+        await database.engine.dispose()
+
+    meta = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "args": {"sizes": args.sizes, "depths": args.depths, "iterations": args.iterations, "warmup": args.warmup, "seed": args.seed},
+        "settings": {
+            name: getattr(settings, name)
+            for name in ("KEYFRAME_INTERVAL", "KEYFRAME_MAX_DELTA_BYTES", "VERSION_CACHE_MAX_BYTES", "WRITE_BEHIND_DELTAS", "PATCH_EXECUTOR", "PATCH_OFFLOAD_MIN_BYTES", "STORAGE_CODEC")
+        },
+        "version_cache": version_cache.stats(),
+        "mongo_stored_bytes": database.document_contents.stored_bytes()
+    }
+    return bench.results, meta
+
+
+def key_pattern(glob: str) -> re.Pattern:
+    """Compile a result key glob; only * and ? are wildcards, brackets match themselves."""
+    return re.compile(re.escape(glob).replace(r"\*", ".*").replace(r"\?", "."))
+
+
+def check_thresholds(results: list[dict], thresholds: dict) -> list[str]:
+    """
+    thresholds maps a glob over result keys (e.g. "get_version[size_kb=64,*]") to limits:
+    a maximum for p50_ms/p95_ms/p99_ms/mean_ms/max_ms, a minimum for ops_per_sec.
+    """
+    failures = []
+    for glob, limits in thresholds.items():
+        pattern = key_pattern(glob)
+        matched = [result for result in results if pattern.fullmatch(result["key"])]
+        if not matched:
+            failures.append(f"{glob}: no result matches")
+        for result in matched:
+            for metric, limit in limits.items():
+                value = result[metric]
+                if value > limit if metric in LOWER_IS_BETTER else value < limit:
+                    failures.append(f"{result['key']}: {metric} {value} (limit {limit})")
+    return failures
+
+
+def check_regressions(results: list[dict], baseline: list[dict], metric: str, max_regression: float) -> list[str]:
+    """Results whose metric got worse than the baseline run's by more than max_regression (a fraction)."""
+    previous = {result["key"]: result[metric] for result in baseline}
+    failures = []
+    for result in results:
+        if result["key"] not in previous or not previous[result["key"]]:
+            continue
+        change = result[metric] / previous[result["key"]] - 1
+        if metric not in LOWER_IS_BETTER:
+            change = -change
+        if change > max_regression:
+            failures.append(f"{result['key']}: {metric} {previous[result['key']]} -> {result[metric]} ({change:+.0%})")
+    return failures
+
+
+def int_list(value: str) -> list[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process benchmarks for the version-history workloads")
+    parser.add_argument("--sizes", type=int_list, default=[4, 64], help="document sizes in KB (default: 4,64)")
+    parser.add_argument("--depths", type=int_list, default=[10, 100, 1000], help="history depths (default: 10,100,1000)")
+    parser.add_argument("--iterations", type=int, default=50, help="timed calls per scenario")
+    parser.add_argument("--warmup", type=int, default=3, help="untimed calls before each scenario")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", type=Path, help="write the JSON report here instead of stdout")
+    parser.add_argument("--thresholds", type=Path, help="JSON file of limits per result key glob")
+    parser.add_argument("--baseline", type=Path, help="JSON report of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="allowed slowdown against --baseline (default: 0.25)")
+    parser.add_argument("--regression-metric", default="p95_ms", help="metric compared against --baseline (default: p95_ms)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    for name in ("alembic", "httpx", "offload", "routes.auth", "routes.documents", "workers", "versioning"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    install_standins()
+    results, meta = asyncio.run(run_benchmarks(args))
+
+    failures = []
+    if args.thresholds:
+        failures += check_thresholds(results, json.loads(args.thresholds.read_text()))
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())["results"]
+        failures += check_regressions(results, baseline, args.regression_metric, args.max_regression)
+
+    report = json.dumps({"meta": meta, "results": results, "failures": failures}, indent=2)
+    if args.output:
+        args.output.write_text(report + "\n")
+    else:
+        print(report)
+
+    for failure in failures:
+        logger.error(f"FAILED {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Synthetic documents and histories. Everything is drawn from a seeded random.Random, so
+the same seed produces the same workload on every run.
+"""
+import copy
+import json
+import random
+
+SYLLABLES = ["ka", "ze", "mi", "ro", "tan", "shi", "no", "ve", "lu", "dar", "qui", "po", "sen", "ya", "gor", "fi"]
+PARAGRAPH_WORDS = (20, 60)
+PARAGRAPHS_PER_SECTION = 8
+
+
+def make_vocabulary(rng: random.Random, size: int = 2000) -> list[str]:
+    return ["".join(rng.choices(SYLLABLES, k=rng.randint(1, 4))) for _ in range(size)]
+
+
+def paragraph(rng: random.Random, vocabulary: list[str]) -> str:
+    return " ".join(rng.choices(vocabulary, k=rng.randint(*PARAGRAPH_WORDS))).capitalize() + "."
+
+
+def make_document(rng: random.Random, vocabulary: list[str], size_bytes: int) -> dict:
+    """A nested document (sections of paragraphs, tags, metadata) of about size_bytes of JSON."""
+    content = {
+        "title": paragraph(rng, vocabulary)[:80],
+        "meta": {"revision": 0, "tags": rng.sample(vocabulary, 5)},
+        "sections": []
+    }
+    size = len(json.dumps(content))
+    while size < size_bytes:
+        section = {"heading": " ".join(rng.choices(vocabulary, k=4)), "paragraphs": []}
+        content["sections"].append(section)
+        while size < size_bytes and len(section["paragraphs"]) < PARAGRAPHS_PER_SECTION:
+            text = paragraph(rng, vocabulary)
+            section["paragraphs"].append(text)
+            size += len(text) + 4
+    return content
+
+
+def evolve(rng: random.Random, vocabulary: list[str], content: dict, edits: int = 3) -> dict:
+    """
+    The next version of a document: a few paragraphs rewritten, inserted or removed and
+    the revision bumped, like an editor saving a small change to a large document.
+    """
+    content = copy.deepcopy(content)
+    content["meta"]["revision"] += 1
+    for _ in range(edits):
+        section = rng.choice(content["sections"])
+        paragraphs = section["paragraphs"]
+        action = rng.random()
+        if action < 0.6 and paragraphs:
+            paragraphs[rng.randrange(len(paragraphs))] = paragraph(rng, vocabulary)
+        elif action < 0.8 or len(paragraphs) < 2:
+            paragraphs.insert(rng.randint(0, len(paragraphs)), paragraph(rng, vocabulary))
+        else:
+            paragraphs.pop(rng.randrange(len(paragraphs)))
+    return content
+
+
+def random_patch(rng: random.Random, vocabulary: list[str], content: dict) -> list[dict]:
+    """A JSON Patch that rewrites one paragraph and bumps the revision."""
+    candidates = [(i, j) for i, section in enumerate(content["sections"]) for j in range(len(section["paragraphs"]))]
+    i, j = rng.choice(candidates)
+    return [
+        {"op": "replace", "path": f"/sections/{i}/paragraphs/{j}", "value": paragraph(rng, vocabulary)},
+        {"op": "replace", "path": "/meta/revision", "value": content["meta"]["revision"] + 1}
+    ]
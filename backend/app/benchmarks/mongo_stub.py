@@ -0,0 +1,259 @@
+"""
+In-memory stand-in for the Motor collection API the app uses: find/find_one with
+projections, sort and limit; insert_one; update_one and find_one_and_update with
+$set/$unset; delete_one and delete_many; bulk_write with InsertOne/UpdateOne/DeleteOne;
+create_indexes (a no-op).
+
+Records are kept as BSON and decoded on every read, so reads and writes pay roughly
+the serialization cost the real driver would, just without the network.
+"""
+import bson
+
+from bson import ObjectId
+from pymongo import DeleteOne, InsertOne, ReturnDocument, UpdateOne
+from pymongo.results import BulkWriteResult, DeleteResult, InsertOneResult, UpdateResult
+from typing import Any, Iterator
+
+_MISSING = object()
+
+
+def _get(record: dict, path: str) -> Any:
+    value = record
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _matches(record: dict, query: dict) -> bool:
+    for path, condition in query.items():
+        if path == "$or":
+            if not any(_matches(record, alternative) for alternative in condition):
+                return False
+            continue
+        value = _get(record, path)
+        if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+            for op, operand in condition.items():
+                if op == "$exists":
+                    if (value is not _MISSING) != bool(operand):
+                        return False
+                elif op == "$in":
+                    if value is _MISSING or value not in operand:
+                        return False
+                elif op == "$nin":
+                    if value is not _MISSING and value in operand:
+                        return False
+                elif op == "$ne":
+                    if value == operand:
+                        return False
+                elif op in ("$gt", "$gte", "$lt", "$lte"):
+                    if value is _MISSING or value is None:
+                        return False
+                    if op == "$gt" and not value > operand or op == "$gte" and not value >= operand:
+                        return False
+                    if op == "$lt" and not value < operand or op == "$lte" and not value <= operand:
+                        return False
+                else:
+                    raise NotImplementedError(f"Query operator {op} is not supported by the benchmark store")
+        elif value is _MISSING or value != condition:
+            return False
+    return True
+
+
+def _project(record: dict, projection: dict | None) -> dict:
+    if not projection:
+        return record
+
+    projected = {"_id": record["_id"]} if projection.get("_id", 1) else {}
+    for path, include in projection.items():
+        if path == "_id" or not include:
+            continue
+        value = _get(record, path)
+        if value is _MISSING:
+            continue
+        *parents, leaf = path.split(".")
+        target = projected
+        for part in parents:
+            target = target.setdefault(part, {})
+        target[leaf] = value
+    return projected
+
+
+def _apply_update(record: dict, update: dict):
+    for op, fields in update.items():
+        for path, value in fields.items():
+            *parents, leaf = path.split(".")
+            target = record
+            if op == "$set":
+                for part in parents:
+                    target = target.setdefault(part, {})
+                target[leaf] = value
+            elif op == "$unset":
+                for part in parents:
+                    target = target.get(part)
+                    if not isinstance(target, dict):
+                        break
+                else:
+                    target.pop(leaf, None)
+            else:
+                raise NotImplementedError(f"Update operator {op} is not supported by the benchmark store")
+
+
+class InMemoryCursor:
+    def __init__(self, collection: "InMemoryCollection", query: dict, projection: dict | None):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort: list[tuple[str, int]] = []
+        self._limit = 0
+
+    def sort(self, key: str, direction: int = 1) -> "InMemoryCursor":
+        self._sort.append((key, direction))
+        return self
+
+    def limit(self, limit: int) -> "InMemoryCursor":
+        self._limit = limit
+        return self
+
+    def _records(self) -> Iterator[dict]:
+        records = list(self._collection._scan(self._query))
+        for key, direction in reversed(self._sort):
+            records.sort(key=lambda record: _get(record, key), reverse=direction < 0)
+        if self._limit:
+            records = records[:self._limit]
+        return (_project(record, self._projection) for record in records)
+
+    async def to_list(self, length: int | None = None) -> list[dict]:
+        records = list(self._records())
+        return records[:length] if length else records
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for record in self._records():
+            yield record
+
+
+class InMemoryCollection:
+    def __init__(self, name: str):
+        self.name = name
+        self._records: dict[Any, bytes] = {}  # _id -> BSON, in insertion order
+
+    def _ids(self, query: dict) -> list | None:
+        """The _ids a query can only match, if it pins them down (None: scan everything)."""
+        condition = query.get("_id", _MISSING)
+        if condition is _MISSING:
+            return None
+        if isinstance(condition, dict) and "$in" in condition:
+            return list(dict.fromkeys(condition["$in"]))
+        if not isinstance(condition, dict):
+            return [condition]
+        return None
+
+    def _scan(self, query: dict) -> Iterator[dict]:
+        ids = self._ids(query)
+        candidates = (self._records.get(_id) for _id in ids) if ids is not None else iter(self._records.values())
+        for raw in candidates:
+            if raw is not None:
+                record = bson.decode(raw)
+                if _matches(record, query):
+                    yield record
+
+    def find(self, query: dict | None = None, projection: dict | None = None) -> InMemoryCursor:
+        return InMemoryCursor(self, query or {}, projection)
+
+    async def find_one(self, query: dict | None = None, projection: dict | None = None) -> dict | None:
+        record = next(self._scan(query or {}), None)
+        return _project(record, projection) if record is not None else None
+
+    async def count_documents(self, query: dict) -> int:
+        return sum(1 for _ in self._scan(query))
+
+    def _insert(self, document: dict) -> Any:
+        document.setdefault("_id", ObjectId())
+        if document["_id"] in self._records:
+            raise ValueError(f"Duplicate _id {document['_id']}")
+        self._records[document["_id"]] = bson.encode(document)
+        return document["_id"]
+
+    def _update(self, query: dict, update: dict) -> dict | None:
+        """Update the first match; returns it as it was before, or None."""
+        record = next(self._scan(query), None)
+        if record is None:
+            return None
+        before = bson.decode(self._records[record["_id"]])
+        _apply_update(record, update)
+        self._records[record["_id"]] = bson.encode(record)
+        return before
+
+    def _delete(self, query: dict, many: bool) -> int:
+        matched = [record["_id"] for record in self._scan(query)]
+        if not many:
+            matched = matched[:1]
+        for _id in matched:
+            del self._records[_id]
+        return len(matched)
+
+    async def insert_one(self, document: dict) -> InsertOneResult:
+        return InsertOneResult(self._insert(document), acknowledged=True)
+
+    async def update_one(self, query: dict, update: dict) -> UpdateResult:
+        modified = int(self._update(query, update) is not None)
+        return UpdateResult({"n": modified, "nModified": modified}, acknowledged=True)
+
+    async def find_one_and_update(self, query: dict, update: dict, projection: dict | None = None,
+                                  return_document: bool = ReturnDocument.BEFORE) -> dict | None:
+        before = self._update(query, update)
+        if before is None:
+            return None
+        record = before if return_document == ReturnDocument.BEFORE else bson.decode(self._records[before["_id"]])
+        return _project(record, projection)
+
+    async def delete_one(self, query: dict) -> DeleteResult:
+        return DeleteResult({"n": self._delete(query, many=False)}, acknowledged=True)
+
+    async def delete_many(self, query: dict) -> DeleteResult:
+        return DeleteResult({"n": self._delete(query, many=True)}, acknowledged=True)
+
+    async def bulk_write(self, requests: list, ordered: bool = True) -> BulkWriteResult:
+        counts = {"nInserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "nUpserted": 0, "upserted": []}
+        for request in requests:
+            if isinstance(request, InsertOne):
+                self._insert(request._doc)
+                counts["nInserted"] += 1
+            elif isinstance(request, UpdateOne):
+                modified = int(self._update(request._filter, request._doc) is not None)
+                counts["nMatched"] += modified
+                counts["nModified"] += modified
+            elif isinstance(request, DeleteOne):
+                counts["nRemoved"] += self._delete(request._filter, many=False)
+            else:
+                raise NotImplementedError(f"{type(request).__name__} is not supported by the benchmark store")
+        return BulkWriteResult(counts, acknowledged=True)
+
+    async def create_indexes(self, indexes: list) -> list[str]:
+        return [index.document["name"] for index in indexes]
+
+    def stored_bytes(self) -> int:
+        return sum(len(raw) for raw in self._records.values())
+
+
+class InMemoryDatabase:
+    def __init__(self):
+        self._collections: dict[str, InMemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> InMemoryCollection:
+        return self._collections.setdefault(name, InMemoryCollection(name))
+
+
+class InMemoryMongoClient:
+    def __init__(self):
+        self._databases: dict[str, InMemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> InMemoryDatabase:
+        return self._databases.setdefault(name, InMemoryDatabase())
+
+    def close(self):
+        pass
@@ -0,0 +1,133 @@
+"""
+Fail if a hot query can no longer be served from an index.
+
+    python check_query_plans.py
+
+Asks PostgreSQL and MongoDB for the plan of every query in HOT_QUERIES and MONGO_HOT_QUERIES
+and exits with status 1 if any plan reads a whole table (Seq Scan), a whole index (an index
+scan with no condition on its leading column) or a whole collection (COLLSCAN).
+Sequential scans are priced out first, so the verdict doesn't depend on how much data the
+database holds: on a near-empty test database the planner would rather scan otherwise.
+Run it against a migrated database, e.g. from cli_tests.sh after the stack is up.
+"""
+import asyncio
+import logging
+import re
+import sys
+
+from bson import ObjectId
+from datetime import datetime, timezone
+from sqlalchemy import text
+from sqlalchemy.sql import Select
+
+import queries
+from database import document_contents, engine, mongo_client
+from tables import Document, Version
+
+
+logger = logging.getLogger(__name__)
+
+OBJECT_IDS = [ObjectId("0" * 24), ObjectId("1" * 24)]
+
+# Built by the same functions as the queries the code runs; literal values don't matter
+HOT_QUERIES: dict[str, Select] = {
+    "list documents (routes/documents.list_documents)": queries.document_page(
+        1, [Document.document_id, Document.title, Document.last_modified_at], 101, after=(datetime.now(timezone.utc), 1)
+    ),
+    "list versions (routes/documents.list_versions)": queries.version_page(1, [Version.version_number, Version.modified_at], 101, before=1000),
+    "document with access (access.load_document)": queries.document_with_access(1, 1),
+    "document access (access.require_access)": queries.document_owner(1, 1),
+    "shared keyframes (versioning.shared_keyframes)": queries.keyframes_with_content([(1, "0" * 64), (2, "1" * 64)]),
+    "versions by number (versioning.lock_heads)": queries.versions_by_number([(1, 0), (2, 3)]),
+    "refresh token lookup (routes/auth.refresh_access_token)": queries.refresh_token_by_hex("0" * 64),
+    "expired refresh tokens (refresh_tokens.purge_expired_refresh_tokens)": queries.expired_refresh_tokens(datetime.now(timezone.utc), 1000),
+    "refresh tokens over the cap (refresh_tokens.trim_refresh_tokens)": queries.refresh_tokens_over_cap(1, 10),
+    "user search by prefix (routes/auth.search_users)": queries.users_by_prefix("ali", 10),
+    "user search by a 2-character prefix (routes/auth.search_users)": queries.users_by_prefix("al", 10),
+    "user search by substring (routes/auth.search_users)": queries.users_by_substring("lic", [1, 2], 10),
+    "head terms of documents (search.index_versions)": queries.head_terms([1, 2]),
+    "full-text search (search.find_documents)": queries.documents_with_terms(1, ["fox", "quick"], 20),
+    "versions pointing at contents (content_gc, workers)": queries.versions_pointing_at([str(_id) for _id in OBJECT_IDS]),
+}
+
+MONGO_HOT_QUERIES: dict[str, dict] = {
+    "pending write-behind deltas (workers.settle_pending_deltas)": queries.pending_deltas(0.0),
+    "keyframes sharing content (content_gc._unreferenced)": queries.sharing_content(OBJECT_IDS),
+}
+
+
+INDEX_SCANS = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+
+
+def _nodes(plan: dict, children_keys: tuple[str, ...]) -> list[dict]:
+    """Every node of a plan tree."""
+    nodes = [plan]
+    for key in children_keys:
+        children = plan.get(key, [])
+        for child in children if isinstance(children, list) else [children]:
+            nodes += _nodes(child, children_keys)
+    return nodes
+
+
+def _full_scans(plan: dict, leading_columns: dict[str, str]) -> list[str]:
+    """Tables and indexes a PostgreSQL plan reads from end to end."""
+    scans = []
+    for node in _nodes(plan, ("Plans",)):
+        if node["Node Type"] == "Seq Scan":
+            scans.append(f"sequential scan on {node['Relation Name']}")
+        elif node["Node Type"] in INDEX_SCANS:
+            # Expression indexes have no leading column; any condition on them is usable
+            leading = leading_columns.get(node["Index Name"])
+            condition = node.get("Index Cond", "")
+            if not condition or (leading and not re.search(rf"\b{leading}\b", condition)):
+                scans.append(f"full scan of index {node['Index Name']}")
+    return scans
+
+
+async def check_postgres() -> list[str]:
+    failures = []
+    async with engine.connect() as conn:
+        await conn.execute(text("SET enable_seqscan = off"))
+        result = await conn.execute(text(
+            "SELECT i.indexrelid::regclass::text, a.attname FROM pg_index i "
+            "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]"
+        ))
+        leading_columns = dict(result.tuples().all())
+
+        for name, query in HOT_QUERIES.items():
+            sql = query.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+            plan = (await conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))).scalar()[0]["Plan"]
+            scans = _full_scans(plan, leading_columns)
+            if scans:
+                failures.append(f"{name}: {', '.join(scans)}")
+            else:
+                logger.info(f"OK {name}")
+    return failures
+
+
+async def check_mongo() -> list[str]:
+    failures = []
+    for name, query in MONGO_HOT_QUERIES.items():
+        plan = (await document_contents.find(query).explain())["queryPlanner"]["winningPlan"]
+        if any(node.get("stage") == "COLLSCAN" for node in _nodes(plan, ("inputStage", "inputStages", "queryPlan"))):
+            failures.append(f"{name}: collection scan on document_contents")
+        else:
+            logger.info(f"OK {name}")
+    return failures
+
+
+async def main() -> int:
+    try:
+        failures = await check_postgres() + await check_mongo()
+    finally:
+        await engine.dispose()
+        mongo_client.close()
+
+    for failure in failures:
+        logger.error(f"Regressed: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(main()))
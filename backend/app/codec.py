@@ -0,0 +1,101 @@
+import json
+import logging
+import zlib
+
+from bson import Binary
+from types import SimpleNamespace
+from typing import Any
+
+from config import settings
+
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:
+    try:
+        import zstandard
+    except ImportError:
+        zstd = None
+    else:
+        # Same interface as compression.zstd for the two calls used here
+        zstd = SimpleNamespace(
+            compress=lambda data, level: zstandard.ZstdCompressor(level=level).compress(data),
+            decompress=lambda data: zstandard.ZstdDecompressor().decompress(data)
+        )
+
+
+logger = logging.getLogger(__name__)
+
+PAYLOAD_FIELDS = ("content", "patch")
+
+if settings.STORAGE_CODEC == "zstd" and zstd is None:
+    logger.warning("STORAGE_CODEC is zstd but zstd is unavailable (needs Python 3.14 or the zstandard package), using zlib")
+    write_codec = "zlib"
+else:
+    write_codec = settings.STORAGE_CODEC
+
+
+def _compress(codec: str, data: bytes) -> bytes:
+    if codec == "zlib":
+        return zlib.compress(data, settings.STORAGE_CODEC_LEVEL if settings.STORAGE_CODEC_LEVEL is not None else -1)
+    if codec == "zstd":
+        return zstd.compress(data, level=settings.STORAGE_CODEC_LEVEL if settings.STORAGE_CODEC_LEVEL is not None else 3)
+    raise ValueError(f"Unknown storage codec: {codec}")
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        if zstd is None:
+            raise RuntimeError("Record is zstd-compressed but zstd is unavailable (needs Python 3.14 or the zstandard package)")
+        return zstd.decompress(data)
+    raise ValueError(f"Unknown storage codec: {codec}")
+
+
+def encode_payload(value: Any, codec: str | None = None) -> tuple[Any, str | None]:
+    """
+    Encode a content or patch value for storage. Returns the value to store and the codec
+    used, or the value itself and None when it is below STORAGE_CODEC_MIN_BYTES.
+    """
+    codec = write_codec if codec is None else codec
+    if codec == "none":
+        return value, None
+
+    data = json.dumps(value, separators=(",", ":")).encode()
+    if len(data) < settings.STORAGE_CODEC_MIN_BYTES:
+        return value, None
+    return Binary(_compress(codec, data)), codec
+
+
+def encode_record(record: dict, codec: str | None = None) -> dict:
+    """Storable copy of a plain record; compressed payload fields are listed in its "codec" map."""
+    stored = {key: value for key, value in record.items() if key != "codec"}
+    codecs = {}
+    for field in PAYLOAD_FIELDS:
+        if field in record:
+            stored[field], used = encode_payload(record[field], codec)
+            if used:
+                codecs[field] = used
+    if codecs:
+        stored["codec"] = codecs
+    return stored
+
+
+def encode_set(field: str, value: Any) -> tuple[dict, dict]:
+    """$set and $unset parts that store one payload field of an existing record."""
+    stored, used = encode_payload(value)
+    if used:
+        return {field: stored, f"codec.{field}": used}, {}
+    return {field: stored}, {f"codec.{field}": ""}
+
+
+def decode_record(record: dict | None) -> dict | None:
+    """Stored record with its compressed payload fields decoded (the record itself if it has none)."""
+    if record is None or not record.get("codec"):
+        return record
+
+    decoded = {key: value for key, value in record.items() if key != "codec"}
+    for field, codec in record["codec"].items():
+        if field in decoded:
+            decoded[field] = json.loads(_decompress(codec, decoded[field]))
+    return decoded
@@ -1,4 +1,6 @@
+from functools import cached_property
 from pathlib import Path
+from typing import Literal
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -9,29 +11,91 @@ class Settings(BaseSettings):
     POSTGRES_USER: str = "izanagi_user"
     POSTGRES_PASSWORD: str = "izanagi_pass"
     POSTGRES_DB: str = "izanagi_db"
+    POSTGRES_POOL_SIZE: int = 5  # Connections kept open
+    POSTGRES_MAX_OVERFLOW: int = 10  # Extra connections opened under load, closed once returned
+    POSTGRES_POOL_TIMEOUT_SECONDS: float = 30.0  # Wait for a free connection before failing the request
+    POSTGRES_POOL_PRE_PING: bool = False  # Test each connection on checkout (one extra round trip), e.g. behind a failover proxy
+    POSTGRES_CONNECT_TIMEOUT_SECONDS: int = 5
 
     # MongoDB
     MONGO_HOST: str = "mongo"
     MONGO_PORT: int = 27017
+    MONGO_MAX_POOL_SIZE: int = 100  # Connections per server
+    MONGO_MIN_POOL_SIZE: int = 0  # Connections the driver keeps open in the background
+    MONGO_POOL_TIMEOUT_SECONDS: float = 30.0  # Wait for a free connection before failing the request
+    MONGO_CONNECT_TIMEOUT_SECONDS: float = 5.0  # Also how long to wait for a usable server (the driver checks liveness itself)
+
+    # Startup and readiness
+    STARTUP_TIMEOUT_SECONDS: float = 120.0  # Give up (and exit) if the databases aren't reachable by then
+    STARTUP_RETRY_INITIAL_SECONDS: float = 0.25  # First retry delay; doubles on every failed attempt
+    STARTUP_RETRY_MAX_SECONDS: float = 8.0
+    POOL_WARMUP_CONNECTIONS: int = 4  # Connections opened per store before the instance reports ready (capped at the pool size)
+    READINESS_TIMEOUT_SECONDS: float = 2.0  # /readyz reports unready if a database doesn't answer within this
 
     # JWT
     JWT_ALGORITHM: str = "RS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRE_DAYS: int = 30
+    REFRESH_TOKENS_PER_USER_MAX: int = 0  # Sessions kept per user; a login beyond it drops the oldest (0 disables)
+    REFRESH_TOKEN_PURGE_INTERVAL_SECONDS: float = 3600.0  # How often expired refresh tokens are deleted (0 disables)
+    REFRESH_TOKEN_PURGE_BATCH_SIZE: int = 1000  # Rows deleted per transaction
+    TOKEN_CACHE_TTL_SECONDS: float = 60.0  # How long a verified access token is trusted without checking its signature again (0 disables)
+    USER_CACHE_TTL_SECONDS: float = 60.0  # How long get_current_user serves a user without querying PostgreSQL (0 disables)
+    ACL_CACHE_TTL_SECONDS: float = 2.0  # How long document ownership is trusted without a query (0 disables); so also how long other API processes may still grant access after an unshare
+    AUTH_CACHE_MAX_ENTRIES: int = 10_000  # Per cache; the oldest entries are dropped first
+
+    # Passwords
+    BCRYPT_ROUNDS: int = 12  # Existing hashes with another cost are rehashed on the next login
+    PASSWORD_HASH_WORKERS: int = 4  # Threads for bcrypt; also the limit on concurrent hash/verify calls
+
+    # Storage codec for MongoDB content and patches (records state the codec they were written with)
+    STORAGE_CODEC: Literal["none", "zlib", "zstd"] = "none"  # zstd needs Python 3.14 or the zstandard package, else zlib is used
+    STORAGE_CODEC_MIN_BYTES: int = 4096  # Smaller payloads are stored as plain BSON
+    STORAGE_CODEC_LEVEL: int | None = None  # Codec default if unset
+
+    # Version history
+    KEYFRAME_INTERVAL: int = 50  # Keep full content every N versions (0 disables)
+    KEYFRAME_MAX_DELTA_BYTES: int = 1_048_576  # ...or once the deltas since the last keyframe grow past this (0 disables)
+    VERSION_CACHE_MAX_BYTES: int = 64 * 1_048_576  # In-process budget for reconstructed versions (0 disables)
+    HISTORY_STREAM_BATCH_SIZE: int = 100  # Versions fetched per round trip when streaming a full history
+    BATCH_COMMIT_MAX_ITEMS: int = 1000  # Documents accepted by one bulk commit request
+    WRITE_BEHIND_DELTAS: bool = False  # Commits return once the new snapshot is stored; a worker writes the reverse delta
+    WRITE_BEHIND_POLL_SECONDS: float = 5.0  # How often the delta worker rescans for pending records when idle
+    WRITE_BEHIND_BATCH_SIZE: int = 100  # Pending records settled per scan
+    WRITE_BEHIND_CLAIM_SECONDS: float = 60.0  # A worker's claim on a pending record lapses after this, should its process die
+    CONTENT_GC_INTERVAL_SECONDS: float = 3600.0  # How often MongoDB records no version points at are deleted (0 disables)
+    CONTENT_GC_GRACE_SECONDS: float = 3600.0  # Younger records are left alone, their commit may still be in flight
+    CONTENT_GC_BATCH_SIZE: int = 1000  # Records checked per round trip
+
+    # Listings (keyset pagination)
+    LIST_PAGE_SIZE_DEFAULT: int = 100
+    LIST_PAGE_SIZE_MAX: int = 1000
+
+    # Patch work (diffing and patch application)
+    PATCH_EXECUTOR: Literal["inline", "thread", "process"] = "thread"
+    PATCH_EXECUTOR_WORKERS: int = 4
+    PATCH_OFFLOAD_MIN_BYTES: int = 65_536  # Smaller payloads are handled inline on the event loop
+
+    # Profiling
+    DEBUG: bool = False  # Responses carry a Server-Timing header with their database round trips
+    SLOW_QUERY_SECONDS: float = 0.5  # Log PostgreSQL statements and MongoDB commands slower than this (0 disables)
+    SLOW_QUERY_LOG_PARAMETERS: bool = False  # Debugging only: log their values too, i.e. password hashes, tokens and document contents
+    SLOW_REQUEST_OPERATIONS: int = 50  # Log requests making more database round trips than this (0 disables)
 
     model_config = SettingsConfigDict(
         env_file="../.env",
         case_sensitive=True
     )
 
-    @property
+    # Read once per process; restart to rotate keys
+    @cached_property
     def JWT_PRIVATE_KEY(self) -> str:
         path = Path("/app/private_key.pem")
         if not path.exists():
             raise RuntimeError("JWT private key not found at /app/private_key.pem")
         return path.read_text()
 
-    @property
+    @cached_property
     def JWT_PUBLIC_KEY(self) -> str:
         path = Path("/app/public_key.pem")
         if not path.exists():
@@ -0,0 +1,102 @@
+import asyncio
+import bson
+import logging
+import time
+
+from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+
+from config import settings
+from database import AsyncSessionLocal, document_contents
+from queries import sharing_content, versions_pointing_at
+
+
+logger = logging.getLogger(__name__)
+
+_stats = {
+    "runs": 0,
+    "scanned": 0,
+    "deleted": 0,
+    "reclaimed_bytes": 0,
+    "last_run_at": None,  # Unix time the last collection finished
+    "last_run_seconds": 0.0
+}
+
+
+async def _unreferenced(ids: list[ObjectId]) -> list[ObjectId]:
+    """The ids no version row points at and no keyframe shares content with."""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(versions_pointing_at([str(_id) for _id in ids]))
+        referenced = set(result.scalars().all())
+
+    orphans = [_id for _id in ids if str(_id) not in referenced]
+    if not orphans:
+        return []
+
+    # Keyframes that share content (content_ref) keep the record holding it alive
+    cursor = document_contents.find(sharing_content(orphans), {"content_ref": 1})
+    shared = {record["content_ref"] async for record in cursor}
+    return [_id for _id in orphans if _id not in shared]
+
+
+async def collect_orphaned_contents() -> tuple[int, int]:
+    """
+    Delete document_contents records that no version points at, e.g. left by a commit
+    that crashed between storing its snapshot and committing to PostgreSQL, or by a
+    document deletion interrupted halfway.
+
+    Records younger than CONTENT_GC_GRACE_SECONDS are left alone: their commit may still
+    be in flight. Scans CONTENT_GC_BATCH_SIZE records per round trip, in _id order.
+    Returns how many records were deleted and their size in bytes.
+    """
+    started = time.monotonic()
+    cutoff = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=settings.CONTENT_GC_GRACE_SECONDS))
+    query = {"_id": {"$lt": cutoff}}
+    scanned = deleted = reclaimed = 0
+
+    while True:
+        cursor = document_contents.find(query, {"_id": 1}).sort("_id", 1).limit(settings.CONTENT_GC_BATCH_SIZE)
+        ids = [record["_id"] async for record in cursor]
+        if not ids:
+            break
+        scanned += len(ids)
+
+        orphans = await _unreferenced(ids)
+        if orphans:
+            # Orphans are few: measure them as fetched, which the benchmark stand-in store can do too ($bsonSize it can't)
+            cursor = document_contents.find({"_id": {"$in": orphans}})
+            reclaimed += sum([len(bson.encode(record)) async for record in cursor])
+            result = await document_contents.delete_many({"_id": {"$in": orphans}})
+            deleted += result.deleted_count
+
+        if len(ids) < settings.CONTENT_GC_BATCH_SIZE:
+            break
+        query = {"_id": {"$gt": ids[-1], "$lt": cutoff}}
+        await asyncio.sleep(0)  # Let requests in between batches
+
+    _stats["runs"] += 1
+    _stats["scanned"] += scanned
+    _stats["deleted"] += deleted
+    _stats["reclaimed_bytes"] += reclaimed
+    _stats["last_run_at"] = time.time()
+    _stats["last_run_seconds"] = time.monotonic() - started
+    return deleted, reclaimed
+
+
+async def run_content_gc():
+    """Background task: collect orphaned contents every CONTENT_GC_INTERVAL_SECONDS."""
+    logger.info("Orphaned content collector started")
+
+    while True:
+        try:
+            deleted, reclaimed = await collect_orphaned_contents()
+            if deleted:
+                logger.info(f"Deleted {deleted} orphaned content records, reclaiming {reclaimed} bytes")
+        except Exception as e:
+            logger.error(f"Orphaned content collection failed: {e}")
+
+        await asyncio.sleep(settings.CONTENT_GC_INTERVAL_SECONDS)
+
+
+def content_gc_stats() -> dict:
+    return dict(_stats)
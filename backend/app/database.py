@@ -1,5 +1,7 @@
 from config import settings
+from metrics import mongo_pool
 from motor.motor_asyncio import AsyncIOMotorClient
+from profiling import instrument_engine, mongo_commands
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 
@@ -7,10 +9,26 @@ from sqlalchemy.orm import DeclarativeBase
 POSTGRESQL_URL = f"postgresql+psycopg://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}@{settings.POSTGRES_HOST}:{settings.POSTGRES_PORT}/{settings.POSTGRES_DB}"
 MONGODB_URL = f"mongodb://{settings.MONGO_HOST}:{settings.MONGO_PORT}"
 
-engine = create_async_engine(POSTGRESQL_URL, echo=True)
+engine = create_async_engine(
+    POSTGRESQL_URL,
+    pool_size=settings.POSTGRES_POOL_SIZE,
+    max_overflow=settings.POSTGRES_MAX_OVERFLOW,
+    pool_timeout=settings.POSTGRES_POOL_TIMEOUT_SECONDS,
+    pool_pre_ping=settings.POSTGRES_POOL_PRE_PING,
+    connect_args={"connect_timeout": settings.POSTGRES_CONNECT_TIMEOUT_SECONDS}
+)
+instrument_engine(engine)
 AsyncSessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
-mongo_client = AsyncIOMotorClient(MONGODB_URL)
+mongo_client = AsyncIOMotorClient(
+    MONGODB_URL,
+    maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+    minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+    waitQueueTimeoutMS=int(settings.MONGO_POOL_TIMEOUT_SECONDS * 1000),
+    connectTimeoutMS=int(settings.MONGO_CONNECT_TIMEOUT_SECONDS * 1000),
+    serverSelectionTimeoutMS=int(settings.MONGO_CONNECT_TIMEOUT_SECONDS * 1000),
+    event_listeners=[mongo_commands, mongo_pool]
+)
 mongo_db = mongo_client["izanagi_warehouse"]
 document_contents = mongo_db["document_contents"]
 
@@ -1,10 +1,11 @@
 import logging
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from typing import Optional
 
-from auth import decode_access_token
+from auth import decode_access_token, user_cache
 from database import get_db
 from tables import User
 
@@ -37,6 +38,11 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Served from the user cache when possible; writes to a user invalidate its entry
+    user = user_cache.get(int(user_id))
+    if user is not None:
+        return user
+    
     # Fetch user from database
     result = await db.execute(select(User).where(User.user_id == int(user_id)))
     user = result.scalar_one_or_none()
@@ -48,4 +54,31 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Detach it so the cached copy is not tied to (or expired by) this request's session
+    db.expunge(user)
+    user_cache.put(user.user_id, user)
     return user
+
+
+async def get_base_version(if_match: Optional[str] = Header(None)) -> int | None:
+    """
+    Extract the version a commit is based on from the If-Match header.
+    Accepts 3 and "3"; a missing header or * means "whatever the head is". Weak tags
+    (W/"3") never match under If-Match's strong comparison, so they fail with 412.
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    
+    if if_match.strip().startswith("W/"):
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="If-Match needs a strong entity tag, not a weak W/ one"
+        )
+    
+    try:
+        return int(if_match.strip().strip('"'))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="If-Match must be a version number"
+        )
@@ -1,11 +1,21 @@
 import asyncio
 import logging
+from auth import shutdown_password_pool
+from config import settings
+from content_gc import run_content_gc
 from contextlib import asynccontextmanager
-from database import Base, document_contents, engine, mongo_client
+from database import engine, mongo_client
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from offload import shutdown_executor
+from profiling import ProfilingMiddleware
+from refresh_tokens import run_token_purger
 from routes.auth import router as auth_router
 from routes.documents import router as documents_router
+from routes.health import router as health_router
+from routes.metrics import router as metrics_router
+from startup import prepare, stop_accepting
+from workers import run_delta_worker
 
 
 logger = logging.getLogger(__name__)
@@ -14,22 +24,28 @@ logging.basicConfig(level=logging.INFO)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Wait for PostgreSQL to be ready
-    max_retries = 5
-    for attempt in range(max_retries):
-        try:
-            async with engine.begin() as conn:
-                await conn.run_sync(Base.metadata.create_all)
-            logger.info("Database tables created successfully")
-            break
-        except Exception as e:
-            if attempt < max_retries - 1:
-                logger.warning(f"Database connection failed, retrying... ({attempt + 1}/{max_retries}): {e}")
-                await asyncio.sleep(2)
-            else:
-                logger.error("Failed to connect to database after all retries")
-                raise
+    # Migrate as soon as the databases are up, then load the keys and warm both pools
+    await prepare()
+    
+    # Settle write-behind commits in the background (also picks up work left over from a restart)
+    delta_worker = asyncio.create_task(run_delta_worker())
+    
+    # Keep refresh_tokens proportional to live sessions
+    token_purger = asyncio.create_task(run_token_purger()) if settings.REFRESH_TOKEN_PURGE_INTERVAL_SECONDS > 0 else None
+    
+    # Delete MongoDB records left behind by interrupted commits and deletions
+    content_gc = asyncio.create_task(run_content_gc()) if settings.CONTENT_GC_INTERVAL_SECONDS > 0 else None
+    
     yield
+    
+    stop_accepting()
+    delta_worker.cancel()
+    if token_purger:
+        token_purger.cancel()
+    if content_gc:
+        content_gc.cancel()
+    shutdown_executor()
+    shutdown_password_pool()
     await engine.dispose()
     mongo_client.close()
 
@@ -43,7 +59,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["*"]
+    expose_headers=["ETag", "X-Next-Cursor"]  # A "*" wildcard is ignored on credentialed requests
 )
+app.add_middleware(ProfilingMiddleware)  # Outermost, so it times everything else too
 app.include_router(auth_router)
 app.include_router(documents_router)
+app.include_router(metrics_router)
+app.include_router(health_router)
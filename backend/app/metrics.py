@@ -0,0 +1,139 @@
+"""
+In-process metrics, exposed in the Prometheus text format by routes/metrics.py and
+recorded mostly by the hooks in profiling.py.
+
+Recording a sample costs a bisect and a few additions under an uncontended lock, so
+collection stays on in production. Samples are labelled with the route template of the
+request being served (e.g. /documents/{document_id}); work outside a request, like the
+delta worker, is labelled "background".
+"""
+import threading
+
+from bisect import bisect_left
+from pymongo import monitoring
+from typing import Iterable
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEPTH_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Iterable[str], values: Iterable[str]) -> str:
+    return ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+
+
+class Histogram:
+    """Fixed-bucket histogram with one series per combination of label values."""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...], buckets: tuple[float, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series: dict[tuple[str, ...], list] = {}  # label values -> [count per bucket..., count above, sum]
+        self._lock = threading.Lock()  # MongoDB listeners run on Motor's executor threads
+
+    def observe(self, value: float, *label_values: str):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(values, list(series)) for values, series in self._series.items()]
+
+        for values, series in snapshot:
+            labels = _labels(self.labels, values)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                le = bound if isinstance(bound, str) else f"{bound:g}"
+                lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+def family(name: str, kind: str, documentation: str, samples: list[tuple[dict, float]]) -> list[str]:
+    """A gauge or counter family from values read at scrape time."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{{{_labels(labels, labels.values())}}} {value}" if labels else f"{name} {value}")
+    return lines
+
+
+request_duration = Histogram(
+    "izanagi_http_request_duration_seconds", "HTTP request latency by route.",
+    ("method", "route", "status"), LATENCY_BUCKETS
+)
+db_operation_duration = Histogram(
+    "izanagi_db_operation_duration_seconds", "PostgreSQL statement and MongoDB command latency by route.",
+    ("store", "route", "operation"), LATENCY_BUCKETS
+)
+reconstruction_depth = Histogram(
+    "izanagi_version_reconstruction_depth", "Reverse patches applied to serve a historical version (0: cached).",
+    ("route",), DEPTH_BUCKETS
+)
+patch_bytes = Histogram(
+    "izanagi_commit_patch_bytes", "Size of the reverse patches commits store, in bytes of JSON.",
+    ("route",), SIZE_BUCKETS
+)
+HISTOGRAMS = [request_duration, db_operation_duration, reconstruction_depth, patch_bytes]
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Counts open and checked-out MongoDB connections across all servers."""
+
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self._lock = threading.Lock()
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+
+mongo_pool = MongoPoolMetrics()
@@ -0,0 +1,69 @@
+"""
+Bring both stores up to date: PostgreSQL through the Alembic migrations in migrations/,
+MongoDB by creating its indexes. Runs on every startup; also usable as
+
+    python migrate.py
+"""
+import asyncio
+import logging
+
+from alembic import command
+from alembic.config import Config
+from pathlib import Path
+from pymongo import ASCENDING, IndexModel
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+from database import document_contents, engine, mongo_client
+
+
+logger = logging.getLogger(__name__)
+
+ALEMBIC_INI = Path(__file__).with_name("alembic.ini")
+BASELINE_REVISION = "0001"  # The schema create_all made before there were migrations
+MIGRATION_LOCK_ID = 0x1A2A6141  # Serializes concurrent startups (pg_advisory_xact_lock key)
+
+MONGO_INDEXES = [
+    # Write-behind markers the delta worker scans for (see workers.py); absent on settled records
+    IndexModel([("pending", ASCENDING)], name="pending", sparse=True),
+    # Keyframes that share another keyframe's content (see versioning.shared_keyframe)
+    IndexModel([("content_ref", ASCENDING)], name="content_ref", sparse=True),
+]
+
+
+def _upgrade(connection: Connection):
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+
+    config = Config(str(ALEMBIC_INI))
+    config.attributes["connection"] = connection
+
+    # A database made by create_all has tables but no revision: adopt it at the baseline
+    existing = inspect(connection).get_table_names()
+    if "users" in existing and "alembic_version" not in existing:
+        logger.info(f"Existing database without migration history, stamping revision {BASELINE_REVISION}")
+        command.stamp(config, BASELINE_REVISION)
+
+    command.upgrade(config, "head")
+
+
+async def upgrade_database():
+    """Run pending PostgreSQL migrations and create missing MongoDB indexes."""
+    async with engine.begin() as conn:
+        await conn.run_sync(_upgrade)
+    logger.info("Database schema is up to date")
+
+    await document_contents.create_indexes(MONGO_INDEXES)
+
+
+async def main():
+    try:
+        await upgrade_database()
+    finally:
+        await engine.dispose()
+        mongo_client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,42 @@
+import asyncio
+
+from alembic import context
+from logging.config import fileConfig
+from sqlalchemy.engine import Connection
+
+import tables  # Registers every table on Base.metadata
+from database import Base, engine
+
+
+config = context.config
+target_metadata = Base.metadata
+
+
+def do_run_migrations(connection: Connection):
+    context.configure(connection=connection, target_metadata=target_metadata, compare_server_default=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_async_migrations():
+    async with engine.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+    await engine.dispose()
+
+
+def run_migrations_offline():
+    """Emit SQL to stdout instead of running it (alembic upgrade head --sql)."""
+    context.configure(url=engine.url.render_as_string(hide_password=False), target_metadata=target_metadata, literal_binds=True, dialect_opts={"paramstyle": "named"})
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+elif (connection := config.attributes.get("connection")) is not None:
+    # Called from migrate.py at startup, on a connection it already holds
+    do_run_migrations(connection)
+else:
+    # Called from the alembic command line
+    fileConfig(config.config_file_name)
+    asyncio.run(run_async_migrations())
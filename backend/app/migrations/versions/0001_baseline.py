@@ -0,0 +1,73 @@
+"""Baseline: the schema as create_all made it before migrations
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("user_id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("username", sa.String(50), nullable=False),
+        sa.Column("email", sa.String(255), nullable=False),
+        sa.Column("password_hash", sa.String(255), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.PrimaryKeyConstraint("user_id"),
+        sa.UniqueConstraint("username"),
+        sa.UniqueConstraint("email")
+    )
+    op.create_table(
+        "documents",
+        sa.Column("document_id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("title", sa.String(255), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column("last_modified_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column("created_by", sa.Integer(), sa.ForeignKey("users.user_id", ondelete="SET NULL")),
+        sa.Column("last_modified_by", sa.Integer(), sa.ForeignKey("users.user_id", ondelete="SET NULL")),
+        sa.Column("current_version_number", sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint("document_id")
+    )
+    op.create_table(
+        "document_owners",
+        sa.Column("document_id", sa.Integer(), sa.ForeignKey("documents.document_id", ondelete="CASCADE"), nullable=False),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False),
+        sa.PrimaryKeyConstraint("document_id", "user_id")
+    )
+    op.create_table(
+        "versions",
+        sa.Column("document_id", sa.Integer(), sa.ForeignKey("documents.document_id", ondelete="CASCADE"), nullable=False),
+        sa.Column("version_number", sa.Integer(), nullable=False),
+        sa.Column("mongo_id", sa.String(24), nullable=False),
+        sa.Column("modified_by", sa.Integer(), sa.ForeignKey("users.user_id", ondelete="SET NULL")),
+        sa.Column("modified_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.PrimaryKeyConstraint("document_id", "version_number"),
+        sa.CheckConstraint("version_number >= 0", name="check_version_nonnegative")
+    )
+    op.create_table(
+        "refresh_tokens",
+        sa.Column("token_id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False),
+        sa.Column("token_hex", sa.String(64), nullable=False),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.PrimaryKeyConstraint("token_id"),
+        sa.UniqueConstraint("token_hex")
+    )
+
+
+def downgrade():
+    op.drop_table("refresh_tokens")
+    op.drop_table("versions")
+    op.drop_table("document_owners")
+    op.drop_table("documents")
+    op.drop_table("users")
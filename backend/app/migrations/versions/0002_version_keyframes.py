@@ -0,0 +1,26 @@
+"""Keyframe flag on versions
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+# Databases created by create_all before migrations existed may already have any of
+# the objects added from here to 0004, hence if_not_exists.
+
+
+def upgrade():
+    op.add_column("versions", sa.Column("is_keyframe", sa.Boolean(), nullable=False, server_default=sa.false()), if_not_exists=True)
+
+
+def downgrade():
+    op.drop_column("versions", "is_keyframe")
@@ -0,0 +1,25 @@
+"""Content hash on versions
+
+Revision ID: 0002a
+Revises: 0002
+Create Date: 2026-10-17
+
+Split from 0002, which used to add this column together with the keyframe flag: databases
+migrated before the split already have it, hence if_not_exists.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002a"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("versions", sa.Column("content_hash", sa.String(64)), if_not_exists=True)
+
+
+def downgrade():
+    op.drop_column("versions", "content_hash")
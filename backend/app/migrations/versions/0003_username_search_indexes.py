@@ -0,0 +1,29 @@
+"""Prefix and trigram indexes for user search
+
+Revision ID: 0003
+Revises: 0002a
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002a"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index("ix_users_username_prefix", "users", [sa.text("lower(username) text_pattern_ops")], if_not_exists=True)
+    op.create_index("ix_users_username_trgm", "users", ["username"], postgresql_using="gin", postgresql_ops={"username": "gin_trgm_ops"}, if_not_exists=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.drop_index("ix_users_username_trgm", table_name="users")
+    op.drop_index("ix_users_username_prefix", table_name="users")
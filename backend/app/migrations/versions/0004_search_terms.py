@@ -0,0 +1,33 @@
+"""Full-text search index
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-16
+
+Fill it for existing documents with: python rebuild_search_index.py
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "search_terms",
+        sa.Column("term", sa.String(64), nullable=False),
+        sa.Column("document_id", sa.Integer(), sa.ForeignKey("documents.document_id", ondelete="CASCADE"), nullable=False),
+        sa.Column("first_version", sa.Integer(), nullable=False),
+        sa.Column("last_version", sa.Integer()),
+        sa.PrimaryKeyConstraint("term", "document_id", "first_version"),
+        if_not_exists=True
+    )
+    op.create_index("ix_search_terms_document_open", "search_terms", ["document_id", "last_version"], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_table("search_terms")
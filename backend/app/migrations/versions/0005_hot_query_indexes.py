@@ -0,0 +1,28 @@
+"""Indexes for document listings, refresh token expiry, version time lookups and head search
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_document_owners_user_document", "document_owners", ["user_id", "document_id"])
+    op.create_index("ix_refresh_tokens_expires_at", "refresh_tokens", ["expires_at"])
+    op.create_index("ix_versions_document_modified_at", "versions", ["document_id", "modified_at"])
+    op.create_index("ix_search_terms_open_term", "search_terms", ["term"], postgresql_where=sa.text("last_version IS NULL"))
+
+
+def downgrade():
+    op.drop_index("ix_search_terms_open_term", table_name="search_terms")
+    op.drop_index("ix_versions_document_modified_at", table_name="versions")
+    op.drop_index("ix_refresh_tokens_expires_at", table_name="refresh_tokens")
+    op.drop_index("ix_document_owners_user_document", table_name="document_owners")
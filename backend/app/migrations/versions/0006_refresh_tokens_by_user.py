@@ -0,0 +1,21 @@
+"""Index refresh tokens by user for the per-user session cap
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-16
+"""
+from alembic import op
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_refresh_tokens_user_token", "refresh_tokens", ["user_id", "token_id"])
+
+
+def downgrade():
+    op.drop_index("ix_refresh_tokens_user_token", table_name="refresh_tokens")
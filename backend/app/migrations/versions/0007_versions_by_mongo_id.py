@@ -0,0 +1,21 @@
+"""Index versions by mongo_id for the orphaned content collector
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-16
+"""
+from alembic import op
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_versions_mongo_id", "versions", ["mongo_id"])
+
+
+def downgrade():
+    op.drop_index("ix_versions_mongo_id", table_name="versions")
@@ -0,0 +1,21 @@
+"""Index documents by last modification for keyset-paginated listings
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_documents_last_modified_at_id", "documents", ["last_modified_at", "document_id"])
+
+
+def downgrade():
+    op.drop_index("ix_documents_last_modified_at_id", table_name="documents")
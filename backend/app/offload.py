@@ -0,0 +1,86 @@
+import asyncio
+import logging
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain
+from typing import Any, Callable
+
+from config import settings
+
+
+logger = logging.getLogger(__name__)
+
+_executor: Executor | None = None
+_queued = 0  # Jobs handed to the executor that have not finished yet
+_stats = {"inline": 0, "offloaded": 0, "max_queue_depth": 0}
+_END = object()
+
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if settings.PATCH_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=settings.PATCH_EXECUTOR_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=settings.PATCH_EXECUTOR_WORKERS, thread_name_prefix="patch")
+        logger.info(f"Patch executor started: {settings.PATCH_EXECUTOR} x {settings.PATCH_EXECUTOR_WORKERS}")
+    return _executor
+
+
+def payload_size(*values: Any) -> int:
+    """
+    Rough JSON size of the values in bytes, for run_cpu's size. Counting stops once it
+    reaches PATCH_OFFLOAD_MIN_BYTES, so sizing an 8 MB document costs no more than sizing
+    a 64 KB one, and nothing is serialized on the event loop.
+    """
+    size, limit = 0, settings.PATCH_OFFLOAD_MIN_BYTES
+    iterators = [iter(values)]
+    while iterators and size < limit:
+        value = next(iterators[-1], _END)
+        if value is _END:
+            iterators.pop()
+        elif isinstance(value, str):
+            size += len(value) + 3  # Quotes and a separator
+        elif isinstance(value, dict):
+            size += 2
+            iterators.append(chain.from_iterable(value.items()))
+        elif isinstance(value, (list, tuple)):
+            size += 2
+            iterators.append(iter(value))
+        else:
+            size += 8  # Numbers, booleans, null, ObjectIds
+    return size
+
+
+async def run_cpu(func: Callable, *args: Any, size: int) -> Any:
+    """
+    Run CPU-bound patch work (diffing, patch application) off the event loop once the
+    payload reaches PATCH_OFFLOAD_MIN_BYTES; smaller payloads stay on the inline fast path.
+
+    With the process executor, func and its arguments must be picklable and in-place
+    changes to the arguments are not seen by the caller.
+    """
+    global _queued
+
+    if settings.PATCH_EXECUTOR == "inline" or size < settings.PATCH_OFFLOAD_MIN_BYTES:
+        _stats["inline"] += 1
+        return func(*args)
+
+    _stats["offloaded"] += 1
+    _queued += 1
+    _stats["max_queue_depth"] = max(_stats["max_queue_depth"], _queued)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), func, *args)
+    finally:
+        _queued -= 1
+
+
+def executor_stats() -> dict:
+    return {"executor": settings.PATCH_EXECUTOR, "workers": settings.PATCH_EXECUTOR_WORKERS, "queue_depth": _queued, **_stats}
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
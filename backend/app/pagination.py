@@ -0,0 +1,45 @@
+import base64
+import json
+
+from datetime import datetime
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+
+
+def encode_cursor(*values) -> str:
+    """Pack the sort key of the last row on a page into an opaque cursor."""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types: type) -> tuple:
+    """Unpack a cursor made by encode_cursor, checking it holds one value of each type."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError("wrong number of values")
+        return tuple(datetime.fromisoformat(v) if t is datetime else t(v) for t, v in zip(types, values))
+    except (ValueError, TypeError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid cursor: {e}"
+        )
+
+
+def parse_fields(fields: str | None, model: type[BaseModel], selectable: set[str]) -> list[str]:
+    """
+    Turn a fields=a,b,c query parameter into the list of response fields to select.
+    No parameter means every selectable field, in the order the model declares them.
+    """
+    allowed = [name for name in model.model_fields if name in selectable]
+    if fields is None:
+        return allowed
+
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in selectable]
+    if unknown or not requested:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown)}. Choose from: {', '.join(allowed)}"
+        )
+    return [name for name in allowed if name in requested]
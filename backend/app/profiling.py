@@ -0,0 +1,203 @@
+"""
+Database round-trip profiling: SQLAlchemy cursor events and a pymongo command listener
+time every PostgreSQL statement and MongoDB command, feed metrics.py, and tally them on
+the profile of the request being served.
+
+- Operations slower than SLOW_QUERY_SECONDS are logged with the route. Only the statement
+  and parameter names, or the shape of the MongoDB command, are logged: values include
+  password hashes, tokens and document contents. SLOW_QUERY_LOG_PARAMETERS logs them too.
+- Requests making more than SLOW_REQUEST_OPERATIONS round trips are logged, which is
+  what an N+1 query pattern looks like from here.
+- With DEBUG set, responses carry a Server-Timing header with the request's round trips
+  (up to the moment the response starts, for streamed responses).
+"""
+import logging
+import reprlib
+import threading
+import time
+
+from contextvars import ContextVar
+from pymongo import monitoring
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from config import settings
+from metrics import db_operation_duration, request_duration
+
+
+logger = logging.getLogger(__name__)
+
+SQL_OPERATIONS = {"select", "insert", "update", "delete", "with", "begin", "commit", "rollback", "savepoint", "release"}
+STATEMENT_LOG_MAX_CHARS = 2000
+
+MONGO_COMMAND_FIELDS = {"lsid", "txnNumber", "$db", "$clusterTime", "$readPreference"}  # Added by the driver
+MONGO_SHAPE_MAX_DEPTH = 3
+
+# With SLOW_QUERY_LOG_PARAMETERS: parameters can hold whole documents, so only the start of each value is logged
+_parameters_repr = reprlib.Repr()
+_parameters_repr.maxlevel = 4
+_parameters_repr.maxstring = _parameters_repr.maxother = 100
+_parameters_repr.maxlist = _parameters_repr.maxtuple = _parameters_repr.maxdict = 10
+
+
+def _parameter_names(parameters) -> str:
+    """The bound parameter names, e.g. "(token_hex, user_id)", without their values."""
+    if isinstance(parameters, (list, tuple)) and parameters and isinstance(parameters[0], (dict, list, tuple)):
+        return f"{_parameter_names(parameters[0])} x {len(parameters)}"  # executemany
+    if isinstance(parameters, dict):
+        return f"({', '.join(map(str, parameters))})"
+    return f"({len(parameters or ())} positional)"
+
+
+def _shape(value, depth: int = 0):
+    """
+    The value with every leaf replaced by "?", keeping the operators and field names down
+    to MONGO_SHAPE_MAX_DEPTH (below that, field names come from the stored documents).
+    """
+    if isinstance(value, dict):
+        return {key: _shape(item, depth + 1) for key, item in value.items()} if depth < MONGO_SHAPE_MAX_DEPTH else "{...}"
+    if isinstance(value, (list, tuple)):
+        return [_shape(value[0], depth), f"... {len(value)} items"] if len(value) > 1 else [_shape(item, depth) for item in value]
+    return "?"
+
+
+def _command_shape(command: dict) -> dict:
+    """A MongoDB command as logged: its name and collection, then the shape of its arguments."""
+    (name, collection), *arguments = command.items()
+    shape = {name: collection, **{key: _shape(value) for key, value in arguments if key not in MONGO_COMMAND_FIELDS}}
+    if "documents" in shape:  # Inserted records are document contents through and through
+        shape["documents"] = f"{len(command['documents'])} documents"
+    return shape
+
+
+class RequestProfile:
+    """Round trips of one request, per store."""
+
+    def __init__(self, scope: dict):
+        self.scope = scope  # The router fills in scope["route"] once it has matched
+        self.operations = {"postgres": 0, "mongo": 0}
+        self.seconds = {"postgres": 0.0, "mongo": 0.0}
+        self._lock = threading.Lock()  # MongoDB commands run on Motor's executor threads
+
+    def record(self, store: str, seconds: float):
+        with self._lock:
+            self.operations[store] += 1
+            self.seconds[store] += seconds
+
+    def server_timing(self) -> str:
+        return ", ".join(
+            f'{store};desc="{self.operations[store]} round trips";dur={self.seconds[store] * 1000:.2f}'
+            for store in self.operations
+        )
+
+
+_profile: ContextVar[RequestProfile | None] = ContextVar("request_profile", default=None)
+
+
+def _route(profile: RequestProfile | None) -> str:
+    if profile is None:
+        return "background"
+    route = profile.scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+
+def current_route() -> str:
+    """Route template of the request being served, e.g. /documents/{document_id}."""
+    return _route(_profile.get())
+
+
+def record_operation(store: str, operation: str, seconds: float, detail):
+    profile = _profile.get()
+    route = _route(profile)
+    db_operation_duration.observe(seconds, store, route, operation)
+    if profile is not None:
+        profile.record(store, seconds)
+
+    if settings.SLOW_QUERY_SECONDS and seconds >= settings.SLOW_QUERY_SECONDS:
+        logger.warning(f"Slow {store} {operation} on {route} ({seconds * 1000:.1f} ms): {detail()}")
+
+
+class ProfilingMiddleware:
+    """Times every HTTP request and gives the database hooks its profile."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        profile = RequestProfile(scope)
+        status_code = 500
+
+        async def send_profiled(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if settings.DEBUG:
+                    message["headers"] = [*message.get("headers", []), (b"server-timing", profile.server_timing().encode())]
+            await send(message)
+
+        token = _profile.set(profile)
+        try:
+            await self.app(scope, receive, send_profiled)
+        finally:
+            _profile.reset(token)
+            route = _route(profile)
+            request_duration.observe(time.perf_counter() - started, scope["method"], route, str(status_code))
+
+            round_trips = sum(profile.operations.values())
+            if settings.SLOW_REQUEST_OPERATIONS and round_trips > settings.SLOW_REQUEST_OPERATIONS:
+                logger.warning(
+                    f"{scope['method']} {route} made {round_trips} database round trips "
+                    f"({profile.operations['postgres']} PostgreSQL, {profile.operations['mongo']} MongoDB)"
+                )
+
+
+def instrument_engine(engine: AsyncEngine):
+    """Profile every statement the engine sends to the database."""
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["profile_started"] = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        operation = statement.split(None, 1)[0].lower() if statement else ""
+        record_operation(
+            "postgres", operation if operation in SQL_OPERATIONS else "other",
+            time.perf_counter() - conn.info["profile_started"],
+            lambda: f"{' '.join(statement.split())[:STATEMENT_LOG_MAX_CHARS]} "
+                    f"{_parameters_repr.repr(parameters) if settings.SLOW_QUERY_LOG_PARAMETERS else _parameter_names(parameters)}"
+        )
+
+
+class MongoCommandProfiler(monitoring.CommandListener):
+    """Profiles every command Motor sends; Motor runs them in a copy of the caller's context."""
+
+    def __init__(self):
+        self._commands: dict[tuple, dict] = {}  # In flight, kept only while slow commands are logged
+
+    def started(self, event):
+        if settings.SLOW_QUERY_SECONDS:
+            self._commands[(event.connection_id, event.request_id)] = event.command
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+    def _finished(self, event):
+        command = self._commands.pop((event.connection_id, event.request_id), None)
+        record_operation(
+            "mongo", event.command_name, event.duration_micros / 1e6,
+            lambda: event.command_name if command is None else (
+                _parameters_repr.repr(command) if settings.SLOW_QUERY_LOG_PARAMETERS
+                else str(_command_shape(command))[:STATEMENT_LOG_MAX_CHARS]
+            )
+        )
+
+
+mongo_commands = MongoCommandProfiler()
@@ -0,0 +1,181 @@
+"""
+The hot queries, built in one place: the code that runs them and check_query_plans.py,
+which asks the databases for their plans, share these builders, so the check always
+explains the statements the routes actually send.
+"""
+from datetime import datetime
+from sqlalchemy import and_, func, select, tuple_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import ColumnElement, Select
+from sqlalchemy.sql.visitors import InternalTraversal
+
+from tables import Document, DocumentOwner, RefreshToken, SearchTerm, User, Version
+
+
+def _like_pattern(q: str) -> str:
+    """Lower-cased q for LIKE, its wildcards matching literally (escape character: backslash)."""
+    return q.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class PatternOrder(ColumnElement):
+    """
+    ORDER BY expression USING ~<~ on PostgreSQL: byte order, the order a text_pattern_ops
+    index keeps, which a plain ORDER BY can't read from it. Other databases order plainly.
+    """
+    inherit_cache = True
+    _traverse_internals = [("ordered", InternalTraversal.dp_clauseelement)]
+
+    def __init__(self, ordered: ColumnElement):
+        self.ordered = ordered
+
+
+@compiles(PatternOrder)
+def _compile_pattern_order(element, compiler, **kw):
+    return compiler.process(element.ordered, **kw)
+
+
+@compiles(PatternOrder, "postgresql")
+def _compile_pattern_order_postgresql(element, compiler, **kw):
+    return f"{compiler.process(element.ordered, **kw)} USING ~<~"
+
+
+# PostgreSQL
+
+def document_page(user_id: int, columns: list, limit: int, after: tuple[datetime, int] | None = None) -> Select:
+    """Documents the user owns, most recently modified first, with the sort key as sort_at and sort_id."""
+    query = (
+        select(*columns, Document.last_modified_at.label("sort_at"), Document.document_id.label("sort_id"))
+        .join(DocumentOwner)
+        .where(DocumentOwner.user_id == user_id)
+        .order_by(Document.last_modified_at.desc(), Document.document_id.desc())
+        .limit(limit)
+    )
+    if after is not None:
+        query = query.where(tuple_(Document.last_modified_at, Document.document_id) < after)
+    return query
+
+
+def version_page(document_id: int, columns: list, limit: int, before: int | None = None) -> Select:
+    """Versions of a document, newest first, with the sort key as sort_number."""
+    query = (
+        select(*columns, Version.version_number.label("sort_number"))
+        .where(Version.document_id == document_id)
+        .order_by(Version.version_number.desc())
+        .limit(limit)
+    )
+    if before is not None:
+        query = query.where(Version.version_number < before)
+    return query
+
+
+def document_with_access(document_id: int, user_id: int) -> Select:
+    """The document, the user's id if they own it (else NULL) and the head version's mongo_id."""
+    return (
+        select(Document, DocumentOwner.user_id, Version.mongo_id)
+        .outerjoin(DocumentOwner, and_(DocumentOwner.document_id == Document.document_id, DocumentOwner.user_id == user_id))
+        .outerjoin(Version, and_(Version.document_id == Document.document_id, Version.version_number == Document.current_version_number))
+        .where(Document.document_id == document_id)
+    )
+
+
+def document_owner(document_id: int, user_id: int) -> Select:
+    return select(DocumentOwner.user_id).where(DocumentOwner.document_id == document_id, DocumentOwner.user_id == user_id)
+
+
+def keyframes_with_content(contents: list[tuple[int, str]]) -> Select:
+    """Keyframes holding these contents, given as (document_id, content_hash)."""
+    return (
+        select(Version.document_id, Version.content_hash, Version.mongo_id)
+        .where(Version.is_keyframe, tuple_(Version.document_id, Version.content_hash).in_(contents))
+    )
+
+
+def versions_by_number(versions: list[tuple[int, int]]) -> Select:
+    """Rows of the given (document_id, version_number) versions."""
+    return (
+        select(Version.document_id, Version.version_number, Version.mongo_id, Version.content_hash)
+        .where(tuple_(Version.document_id, Version.version_number).in_(versions))
+    )
+
+
+def versions_pointing_at(mongo_ids: list[str]) -> Select:
+    """Which of these document_contents records a version row points at."""
+    return select(Version.mongo_id).where(Version.mongo_id.in_(mongo_ids))
+
+
+def refresh_token_by_hex(token_hex: str) -> Select:
+    return select(RefreshToken).where(RefreshToken.token_hex == token_hex)
+
+
+def expired_refresh_tokens(now: datetime, limit: int) -> Select:
+    return select(RefreshToken.token_id).where(RefreshToken.expires_at < now).limit(limit)
+
+
+def refresh_tokens_over_cap(user_id: int, keep: int) -> Select:
+    """The user's refresh tokens beyond the newest keep."""
+    return (
+        select(RefreshToken.token_id)
+        .where(RefreshToken.user_id == user_id)
+        .order_by(RefreshToken.token_id.desc())
+        .offset(keep)
+    )
+
+
+def users_by_prefix(q: str, limit: int) -> Select:
+    """
+    The first users by lower(username) whose name starts with q, case-insensitively: a
+    range scan of ix_users_username_prefix that stops after limit rows, with no sort.
+    """
+    return (
+        select(User)
+        .where(func.lower(User.username).like(f"{_like_pattern(q)}%", escape="\\"))
+        .order_by(PatternOrder(func.lower(User.username)))
+        .limit(limit)
+    )
+
+
+def users_by_substring(q: str, exclude: list[int], limit: int) -> Select:
+    """
+    Any limit users whose name contains q, case-insensitively, unordered so PostgreSQL
+    stops at the first limit matches. Needs at least 3 characters (one full trigram):
+    for shorter ones the trigram index would be read whole.
+    """
+    return (
+        select(User)
+        .where(User.username.ilike(f"%{_like_pattern(q)}%", escape="\\"), User.user_id.not_in(exclude))
+        .limit(limit)
+    )
+
+
+def head_terms(document_ids: list[int]) -> Select:
+    """Search terms of the head versions of the documents."""
+    return select(SearchTerm.document_id, SearchTerm.term).where(SearchTerm.document_id.in_(document_ids), SearchTerm.last_version.is_(None))
+
+
+def documents_with_terms(user_id: int, terms: list[str], limit: int) -> Select:
+    """Documents the user owns whose head contains every term, most recently modified first."""
+    return (
+        select(Document.document_id, Document.title, Document.current_version_number)
+        .join(SearchTerm, SearchTerm.document_id == Document.document_id)
+        .join(DocumentOwner, and_(DocumentOwner.document_id == Document.document_id, DocumentOwner.user_id == user_id))
+        .where(SearchTerm.term.in_(terms), SearchTerm.last_version.is_(None))
+        .group_by(Document.document_id)
+        .having(func.count() == len(terms))
+        .order_by(Document.last_modified_at.desc(), Document.document_id.desc())
+        .limit(limit)
+    )
+
+
+# MongoDB (document_contents filters)
+
+def pending_deltas(now: float) -> dict:
+    """Snapshots whose write-behind delta is not settled yet and that no delta worker holds a live claim on."""
+    return {
+        "pending": {"$exists": True},
+        "$or": [{"pending.claimed_until": {"$exists": False}}, {"pending.claimed_until": {"$lt": now}}]
+    }
+
+
+def sharing_content(mongo_ids: list) -> dict:
+    """Keyframes that share the content of one of these records (content_ref)."""
+    return {"content_ref": {"$in": mongo_ids}}
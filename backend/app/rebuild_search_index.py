@@ -0,0 +1,58 @@
+"""
+Rebuild the full-text search index from document history.
+
+    python rebuild_search_index.py [--document-id N ...]
+
+Each document is rebuilt and committed on its own, so the command can be stopped and
+rerun. Commits that land on a document while it is being rebuilt may be missed; rerun
+it for that document afterwards.
+"""
+import argparse
+import asyncio
+import logging
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal, engine, mongo_client
+from search import rebuild_document_index
+from tables import Document
+
+
+logger = logging.getLogger(__name__)
+
+
+async def rebuild(document_ids: list[int] | None = None) -> dict:
+    stats = {"documents": 0, "rows": 0}
+
+    async with AsyncSessionLocal() as db:
+        query = select(Document.document_id, Document.current_version_number).where(Document.current_version_number.is_not(None))
+        if document_ids:
+            query = query.where(Document.document_id.in_(document_ids))
+        documents = (await db.execute(query.order_by(Document.document_id))).all()
+
+        for document_id, head_number in documents:
+            stats["rows"] += await rebuild_document_index(db, document_id, head_number)
+            stats["documents"] += 1
+            if stats["documents"] % 100 == 0:
+                logger.info(f"Rebuilt {stats['documents']} of {len(documents)} documents")
+
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Rebuild the full-text search index")
+    parser.add_argument("--document-id", type=int, action="append", help="only rebuild these documents")
+    args = parser.parse_args()
+
+    try:
+        stats = await rebuild(args.document_id)
+    finally:
+        await engine.dispose()
+        mongo_client.close()
+
+    logger.info(f"Done: {stats}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
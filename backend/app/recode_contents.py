@@ -0,0 +1,98 @@
+"""
+Re-encode existing document_contents records with the current (or a given) storage codec.
+
+    python recode_contents.py [--codec none|zlib|zstd] [--batch-size 500] [--dry-run]
+
+Safe to run while the API is serving: a record that changes between being read and
+rewritten (an old head turning into a delta, a write-behind marker being settled) is
+left alone and picked up by the next run.
+"""
+import argparse
+import asyncio
+import bson
+import logging
+
+from pymongo import UpdateOne
+
+import codec
+from codec import decode_record, encode_record
+from database import document_contents, mongo_client
+
+
+logger = logging.getLogger(__name__)
+
+
+def recode_update(record: dict, target_codec: str) -> tuple[dict, UpdateOne | None]:
+    """
+    The record as target_codec would store it, and the update that rewrites it that way
+    (None if it already is).
+    """
+    stored = encode_record(decode_record(record), target_codec)
+    if stored.get("codec", {}) == record.get("codec", {}):
+        return record, None
+
+    update = {"$set": {field: stored[field] for field in codec.PAYLOAD_FIELDS if field in stored}}
+    if "codec" in stored:
+        update["$set"]["codec"] = stored["codec"]
+    else:
+        update["$unset"] = {"codec": ""}
+
+    # Only rewrite the record if it is still in the state it was read in
+    unchanged = {"_id": record["_id"], "type": record.get("type"), "pending": {"$exists": "pending" in record}}
+    return stored, UpdateOne(unchanged, update)
+
+
+async def recode_contents(target_codec: str, batch_size: int, dry_run: bool = False) -> dict:
+    """Walk every record in _id order, batch_size at a time. Returns counts and BSON sizes before/after."""
+    stats = {"scanned": 0, "rewritten": 0, "skipped_changed": 0, "bytes_before": 0, "bytes_after": 0}
+    last_id = None
+
+    while True:
+        cursor = document_contents.find({"_id": {"$gt": last_id}} if last_id else {}).sort("_id", 1).limit(batch_size)
+        records = await cursor.to_list(batch_size)
+        if not records:
+            break
+        last_id = records[-1]["_id"]
+
+        updates = []
+        for record in records:
+            stats["scanned"] += 1
+            stored, update = recode_update(record, target_codec)
+            stats["bytes_before"] += len(bson.encode(record))
+            stats["bytes_after"] += len(bson.encode(stored))
+            if update is not None:
+                updates.append(update)
+
+        if updates and not dry_run:
+            result = await document_contents.bulk_write(updates, ordered=False)
+            stats["rewritten"] += result.modified_count
+            stats["skipped_changed"] += len(updates) - result.matched_count
+        elif dry_run:
+            stats["rewritten"] += len(updates)
+
+        logger.info(f"Recoded up to {last_id}: {stats}")
+
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Re-encode document contents with a storage codec")
+    parser.add_argument("--codec", choices=["none", "zlib", "zstd"], default=codec.write_codec, help="target codec (default: STORAGE_CODEC)")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="only report what would change")
+    args = parser.parse_args()
+
+    if args.codec == "zstd" and codec.zstd is None:
+        parser.error("zstd is unavailable (needs Python 3.14 or the zstandard package)")
+
+    try:
+        stats = await recode_contents(args.codec, args.batch_size, args.dry_run)
+    finally:
+        mongo_client.close()
+
+    logger.info(f"Done{' (dry run)' if args.dry_run else ''}: {stats}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
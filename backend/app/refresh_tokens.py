@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import time
+
+from datetime import datetime, timezone
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import AsyncSessionLocal
+from queries import expired_refresh_tokens, refresh_tokens_over_cap
+from tables import RefreshToken
+
+
+logger = logging.getLogger(__name__)
+
+_stats = {
+    "purge_runs": 0,
+    "purged_expired": 0,
+    "purged_over_cap": 0,
+    "last_purge_at": None,  # Unix time the last purge finished
+    "last_purge_seconds": 0.0
+}
+
+
+async def trim_refresh_tokens(db: AsyncSession, user_id: int) -> int:
+    """
+    Delete the user's oldest refresh tokens beyond REFRESH_TOKENS_PER_USER_MAX (if set),
+    in the caller's transaction. Returns how many were deleted.
+    """
+    if not settings.REFRESH_TOKENS_PER_USER_MAX:
+        return 0
+
+    over_cap = refresh_tokens_over_cap(user_id, settings.REFRESH_TOKENS_PER_USER_MAX)
+    result = await db.execute(delete(RefreshToken).where(RefreshToken.token_id.in_(over_cap)))
+    _stats["purged_over_cap"] += result.rowcount
+    return result.rowcount
+
+
+async def purge_expired_refresh_tokens() -> int:
+    """
+    Delete expired refresh tokens, REFRESH_TOKEN_PURGE_BATCH_SIZE per transaction so a
+    large backlog never holds locks for long. Returns how many were deleted.
+    """
+    started = time.monotonic()
+    now = datetime.now(timezone.utc)
+    purged = 0
+
+    while True:
+        async with AsyncSessionLocal() as db:
+            expired = expired_refresh_tokens(now, settings.REFRESH_TOKEN_PURGE_BATCH_SIZE)
+            result = await db.execute(delete(RefreshToken).where(RefreshToken.token_id.in_(expired)))
+            await db.commit()
+
+        purged += result.rowcount
+        if result.rowcount < settings.REFRESH_TOKEN_PURGE_BATCH_SIZE:
+            break
+        await asyncio.sleep(0)  # Let requests in between batches
+
+    _stats["purge_runs"] += 1
+    _stats["purged_expired"] += purged
+    _stats["last_purge_at"] = time.time()
+    _stats["last_purge_seconds"] = time.monotonic() - started
+    return purged
+
+
+async def run_token_purger():
+    """Background task: purge expired refresh tokens every REFRESH_TOKEN_PURGE_INTERVAL_SECONDS."""
+    logger.info("Refresh token purger started")
+
+    while True:
+        try:
+            purged = await purge_expired_refresh_tokens()
+            if purged:
+                logger.info(f"Purged {purged} expired refresh tokens")
+        except Exception as e:
+            logger.error(f"Refresh token purge failed: {e}")
+
+        await asyncio.sleep(settings.REFRESH_TOKEN_PURGE_INTERVAL_SECONDS)
+
+
+def refresh_token_stats() -> dict:
+    return dict(_stats)
@@ -7,9 +7,12 @@ from typing import Optional
 
 from database import get_db
 from dependencies import get_current_user
+from queries import refresh_token_by_hex, users_by_prefix, users_by_substring
 from schemas import UserCreate, UserLogin, UserResponse, TokenResponse, UserSearchResult
+from refresh_tokens import trim_refresh_tokens
 from tables import User, RefreshToken
 from auth import (
+    user_cache,
     hash_password,
     verify_password,
     create_access_token,
@@ -20,6 +23,8 @@ from auth import (
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
+SEARCH_LIMIT = 10
+
 
 # Dependency to extract refresh token from cookie
 async def get_refresh_token_from_cookie(refresh_token: Optional[str] = Cookie(None)) -> str:
@@ -56,7 +61,7 @@ async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
     new_user = User(
         username=user_data.username,
         email=user_data.email,
-        password_hash=hash_password(user_data.password)
+        password_hash=await hash_password(user_data.password)
     )
     
     db.add(new_user)
@@ -75,13 +80,18 @@ async def login(user_credentials: UserLogin, response: Response, db: AsyncSessio
     result = await db.execute(select(User).where(User.username == user_credentials.username))
     user = result.scalar_one_or_none()
     
-    if not user or not verify_password(user_credentials.password, user.password_hash):
+    valid, new_hash = await verify_password(user_credentials.password, user.password_hash) if user else (False, None)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Rehash if BCRYPT_ROUNDS changed since this password was stored; saved with the refresh token below
+    if new_hash:
+        user.password_hash = new_hash
+    
     # Create access token
     access_token = create_access_token(data={"sub": str(user.user_id), "username": user.username})
     
@@ -96,8 +106,13 @@ async def login(user_credentials: UserLogin, response: Response, db: AsyncSessio
         expires_at=refresh_token_expiry
     )
     db.add(new_refresh_token)
+    await db.flush()
+    await trim_refresh_tokens(db, user.user_id)
     await db.commit()
     
+    if new_hash:
+        user_cache.invalidate(user.user_id)
+    
     # Set refresh token as httpOnly cookie
     response.set_cookie(
         key="refresh_token",
@@ -117,9 +132,7 @@ async def refresh_access_token(response: Response, refresh_token: str = Depends(
     """Refresh access token using refresh token from cookie."""
     
     # Find refresh token in database
-    result = await db.execute(
-        select(RefreshToken).where(RefreshToken.token_hex == refresh_token)
-    )
+    result = await db.execute(refresh_token_by_hex(refresh_token))
     db_token = result.scalar_one_or_none()
     
     if not db_token:
@@ -160,9 +173,7 @@ async def logout(response: Response, db: AsyncSession = Depends(get_db), refresh
     
     if refresh_token:
         # Delete refresh token from database
-        result = await db.execute(
-            select(RefreshToken).where(RefreshToken.token_hex == refresh_token)
-        )
+        result = await db.execute(refresh_token_by_hex(refresh_token))
         db_token = result.scalar_one_or_none()
         
         if db_token:
@@ -176,6 +187,11 @@ async def logout(response: Response, db: AsyncSession = Depends(get_db), refresh
     return {"message": "Successfully logged out"}
 
 
+def search_rank(user: User) -> tuple[int, str]:
+    """Shortest names first: the closest matches to the query. Sorts the few rows returned."""
+    return len(user.username), user.username.lower()
+
+
 @router.get("/users/search", response_model=list[UserSearchResult])
 async def search_users(q: str, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     if len(q) < 2:
@@ -184,10 +200,13 @@ async def search_users(q: str, current_user: User = Depends(get_current_user), d
             detail="Search query must be at least 2 characters"
         )
     
-    # Search for users matching the query
-    result = await db.execute(
-        select(User).where(User.username.ilike(f"%{q}%")).limit(10)
-    )
-    users = result.scalars().all()
+    # Prefix matches first, in index order
+    result = await db.execute(users_by_prefix(q, SEARCH_LIMIT))
+    users = sorted(result.scalars().all(), key=search_rank)
+    
+    # Then substring matches, from 3 characters on
+    if len(users) < SEARCH_LIMIT and len(q) >= 3:
+        result = await db.execute(users_by_substring(q, [u.user_id for u in users], SEARCH_LIMIT - len(users)))
+        users += sorted(result.scalars().all(), key=search_rank)
     
     return [UserSearchResult.model_validate(u) for u in users]
@@ -1,21 +1,59 @@
+import asyncio
+import json
 import jsonpatch
 import logging
 
 from bson import ObjectId
 from datetime import datetime, timezone
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from jsonpointer import JsonPointerException
+from pymongo import InsertOne, UpdateOne
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import and_, insert, select, tuple_, update
 
-from database import get_db, document_contents
-from dependencies import get_current_user
-from schemas import DocumentCreate, DocumentCommit, DocumentResponse, VersionResponse, DocumentUpdate, DocumentShare
+from access import invalidate_access, load_document, require_access
+from codec import decode_record, encode_record
+from config import settings
+from database import AsyncSessionLocal, get_db, document_contents
+from dependencies import get_base_version, get_current_user
+from offload import payload_size, run_cpu
+from pagination import decode_cursor, encode_cursor, parse_fields
+from queries import document_page, version_page
+from schemas import BatchCommit, BatchCommitResult, CommitResponse, DocumentCreate, DocumentCommit, DocumentResponse, SearchResult, VersionResponse, DocumentUpdate, DocumentShare
+from search import content_terms, find_documents, index_versions
 from tables import User, Document, DocumentOwner, Version
+from versioning import (
+    build_commit,
+    claim_next_version,
+    content_hash,
+    delta_update,
+    diff_in_chain,
+    iter_history,
+    keyframe_policy,
+    load_delta_chain,
+    load_reverse_patches,
+    load_version,
+    lock_heads,
+    pending_delta,
+    shared_keyframe,
+    shared_keyframes,
+    version_cache
+)
+from workers import wake_delta_worker
 
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/documents", tags=["Documents"])
 
+# Ids per delete_many when deleting a document (about 2 MB of BSON, well under MongoDB's 16 MB limit)
+CONTENT_DELETE_CHUNK = 100_000
+
+# Response fields that are plain columns and can be picked with fields=
+DOCUMENT_LIST_FIELDS = {"document_id", "title", "created_at", "last_modified_at", "current_version_number"}
+VERSION_LIST_FIELDS = {"document_id", "version_number", "modified_by", "modified_at", "content_hash"}
+
 
 @router.post("", response_model=DocumentResponse, status_code=status.HTTP_201_CREATED)
 async def create_document(doc_data: DocumentCreate, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
@@ -26,12 +64,17 @@ async def create_document(doc_data: DocumentCreate, current_user: User = Depends
         "type": "snapshot",
         "content": doc_data.content
     }
-    result = await document_contents.insert_one(mongo_doc)
+    result = await document_contents.insert_one(encode_record(mongo_doc))
     mongo_id = str(result.inserted_id)
     
+    size = payload_size(doc_data.content)
+    
     # Create document metadata in PostgreSQL
+    now = datetime.now(timezone.utc)  # Set here like on commit, so list cursors compare stored and bound timestamps alike
     new_doc = Document(
         title=doc_data.title,
+        created_at=now,
+        last_modified_at=now,
         created_by=current_user.user_id,
         last_modified_by=current_user.user_id,
         current_version_number=0
@@ -44,7 +87,9 @@ async def create_document(doc_data: DocumentCreate, current_user: User = Depends
         document_id=new_doc.document_id,
         version_number=0,
         mongo_id=mongo_id,
-        modified_by=current_user.user_id
+        content_hash=await run_cpu(content_hash, doc_data.content, size=size),
+        modified_by=current_user.user_id,
+        modified_at=now
     )
     db.add(version)
     
@@ -55,6 +100,10 @@ async def create_document(doc_data: DocumentCreate, current_user: User = Depends
     )
     db.add(owner)
     
+    # Index the initial content for search
+    terms = await run_cpu(content_terms, doc_data.content, size=size)
+    await index_versions(db, [(new_doc.document_id, 0, terms)])
+    
     await db.commit()
     await db.refresh(new_doc)
     
@@ -66,218 +115,484 @@ async def create_document(doc_data: DocumentCreate, current_user: User = Depends
     return response
 
 
-@router.get("", response_model=list[DocumentResponse])
-async def list_documents(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    """List all documents owned by current user."""
+@router.post("/commits", response_model=list[BatchCommitResult])
+async def commit_batch(batch: BatchCommit, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Commit new versions of many documents at once, with one result per item."""
     
-    # Get documents where user is owner
-    result = await db.execute(
-        select(Document)
-        .join(DocumentOwner)
-        .where(DocumentOwner.user_id == current_user.user_id)
-    )
-    documents = result.scalars().all()
+    if len(batch.items) > settings.BATCH_COMMIT_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.BATCH_COMMIT_MAX_ITEMS} items per batch"
+        )
+    
+    results: dict[int, BatchCommitResult] = {}
+    
+    # Reject what can be rejected without touching the databases
+    pending = []
+    seen = set()
+    for i, item in enumerate(batch.items):
+        if item.patch is not None and item.base_version is None:
+            results[i] = BatchCommitResult(document_id=item.document_id, status=status.HTTP_428_PRECONDITION_REQUIRED, detail="Patch commits need a base version")
+        elif item.document_id in seen:
+            results[i] = BatchCommitResult(document_id=item.document_id, status=status.HTTP_400_BAD_REQUEST, detail="Document appears more than once in the batch")
+        else:
+            seen.add(item.document_id)
+            pending.append(i)
+    
+    # Hash full contents before taking any lock, so unchanged ones can be skipped
+    sizes = {i: payload_size(batch.items[i].content or batch.items[i].patch) for i in pending}
+    content_items = [i for i in pending if batch.items[i].content is not None]
+    hashes = dict(zip(content_items, await asyncio.gather(*[
+        run_cpu(content_hash, batch.items[i].content, size=sizes[i])
+        for i in content_items
+    ])))
+    
+    # Check ownership and lock every head in one query
+    heads = await lock_heads(db, [batch.items[i].document_id for i in pending], current_user.user_id) if pending else {}
+    
+    ready = []
+    for i in pending:
+        item = batch.items[i]
+        current_number, _, head_hash = heads.get(item.document_id, (None, None, None))
+        
+        if item.document_id not in heads:
+            results[i] = BatchCommitResult(document_id=item.document_id, status=status.HTTP_403_FORBIDDEN, detail="Access denied")
+        elif current_number is None:
+            results[i] = BatchCommitResult(document_id=item.document_id, status=status.HTTP_400_BAD_REQUEST, detail="Document has no versions")
+        elif item.base_version is not None and item.base_version != current_number:
+            results[i] = BatchCommitResult(document_id=item.document_id, status=status.HTTP_409_CONFLICT, detail=f"Version conflict: document is at version {current_number}")
+        elif i in hashes and hashes[i] == head_hash:
+            results[i] = BatchCommitResult(document_id=item.document_id, status=status.HTTP_200_OK, version_number=current_number, unchanged=True)
+        else:
+            ready.append(i)
+    
+    # Fetch all current contents that have to be diffed now from MongoDB in one query
+    write_behind = {i for i in ready if settings.WRITE_BEHIND_DELTAS and batch.items[i].patch is None}
+    old_records = {}
+    if len(write_behind) < len(ready):
+        cursor = document_contents.find({"_id": {"$in": [ObjectId(heads[batch.items[i].document_id][1]) for i in ready if i not in write_behind]}})
+        old_records = {str(record["_id"]): decode_record(record) async for record in cursor}
+    
+    # Diff or patch every document, spreading the large ones over the patch executor
+    diffed = [i for i in ready if i not in write_behind]
+    built_commits = await asyncio.gather(*[
+        run_cpu(
+            build_commit, old_records[heads[batch.items[i].document_id][1]].get("content"), batch.items[i].content, batch.items[i].patch,
+            size=sizes[i] + payload_size(old_records[heads[batch.items[i].document_id][1]].get("content"))
+        )
+        for i in diffed
+    ], return_exceptions=True)
+    commits = dict(zip(diffed, built_commits))
+    
+    now = datetime.now(timezone.utc)
+    snapshots, new_versions, new_contents, keyframes, deltas = [], [], [], [], []
+    for i in ready:
+        item = batch.items[i]
+        current_number, old_mongo_id, old_hash = heads[item.document_id]
+        new_mongo_id = ObjectId()
+        new_version = {
+            "document_id": item.document_id,
+            "version_number": current_number + 1,
+            "mongo_id": str(new_mongo_id),
+            "content_hash": hashes.get(i),
+            "modified_by": current_user.user_id,
+            "modified_at": now
+        }
+        
+        if i in write_behind:
+            snapshots.append(InsertOne(encode_record({"_id": new_mongo_id, "type": "snapshot", "content": item.content, "pending": pending_delta(old_mongo_id, item.document_id, current_number)})))
+            new_versions.append(new_version)
+            new_contents.append(item.content)
+            results[i] = BatchCommitResult(document_id=item.document_id, status=status.HTTP_200_OK, version_number=current_number + 1)
+            continue
+        
+        old_mongo_doc = old_records[old_mongo_id]
+        built = commits[i]
+        if isinstance(built, (jsonpatch.JsonPatchException, JsonPointerException)):
+            results[i] = BatchCommitResult(document_id=item.document_id, status=status.HTTP_400_BAD_REQUEST, detail=f"Patch does not apply: {built}")
+            continue
+        elif isinstance(built, BaseException):
+            raise built
+        new_content, reverse_patch, patched_hash = built
+        
+        if patched_hash is not None:
+            if patched_hash == old_hash:
+                results[i] = BatchCommitResult(document_id=item.document_id, status=status.HTTP_200_OK, version_number=current_number, unchanged=True)
+                continue
+            new_version["content_hash"] = patched_hash
+        
+        keyframe, keyframe_counters = keyframe_policy(old_mongo_doc, reverse_patch)
+        share = (item.document_id, old_hash) if keyframe and old_hash is not None and "pending" not in old_mongo_doc else None
+        
+        snapshots.append(InsertOne(encode_record({"_id": new_mongo_id, "type": "snapshot", "content": new_content, **keyframe_counters})))
+        new_versions.append(new_version)
+        new_contents.append(new_content)
+        if keyframe:
+            keyframes.append((item.document_id, current_number))
+        deltas.append((old_mongo_id, reverse_patch, keyframe, share))
+        results[i] = BatchCommitResult(document_id=item.document_id, status=status.HTTP_200_OK, version_number=current_number + 1)
+    
+    # New keyframes whose content an older keyframe already stores share it, looked up for all at once
+    shared = await shared_keyframes(db, [share for *_, share in deltas if share is not None])
+    deltas = [
+        UpdateOne({"_id": ObjectId(old_mongo_id)}, delta_update(reverse_patch, keyframe, shared.get(share)))
+        for old_mongo_id, reverse_patch, keyframe, share in deltas
+    ]
+    
+    if new_versions:
+        # Store every new snapshot in one round trip
+        await document_contents.bulk_write(snapshots, ordered=False)
+        
+        # Bump every head and insert every version row in one transaction
+        await db.execute(
+            update(Document)
+            .where(Document.document_id.in_([v["document_id"] for v in new_versions]))
+            .values(
+                current_version_number=Document.current_version_number + 1,
+                last_modified_by=current_user.user_id,
+                last_modified_at=now
+            )
+            .execution_options(synchronize_session=False)
+        )
+        await db.execute(insert(Version), new_versions)
+        
+        if keyframes:
+            await db.execute(
+                update(Version)
+                .where(tuple_(Version.document_id, Version.version_number).in_(keyframes))
+                .values(is_keyframe=True)
+                .execution_options(synchronize_session=False)
+            )
+        
+        # Move the search index of every document to its new head
+        terms = await asyncio.gather(*[run_cpu(content_terms, content, size=payload_size(content)) for content in new_contents])
+        await index_versions(db, [(v["document_id"], v["version_number"], t) for v, t in zip(new_versions, terms)])
+    
+    await db.commit()  # Also releases the row locks when nothing was committed
+    
+    if deltas:
+        # Only now turn the old heads into reverse deltas; until then they stay readable as snapshots
+        await document_contents.bulk_write(deltas, ordered=False)
+    if write_behind and new_versions:
+        wake_delta_worker()
     
-    return [DocumentResponse.model_validate(doc) for doc in documents]
+    for v in new_versions:
+        version_cache.invalidate(v["document_id"], from_version=v["version_number"])
+    
+    logger.info(f"Batch commit by user {current_user.user_id}: {len(new_versions)} of {len(batch.items)} documents committed")
+    return [results[i] for i in range(len(batch.items))]
+
+
+@router.get("", response_model=list[DocumentResponse])
+async def list_documents(
+    response: Response,
+    limit: int = Query(settings.LIST_PAGE_SIZE_DEFAULT, ge=1, le=settings.LIST_PAGE_SIZE_MAX),
+    cursor: str | None = None,
+    fields: str | None = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    List documents owned by current user, most recently modified first, one page at a time.
+    Pass the X-Next-Cursor header of a response as cursor to get the next page; fields=a,b selects columns.
+    """
+    
+    columns = parse_fields(fields, DocumentResponse, DOCUMENT_LIST_FIELDS)
+    
+    # Get documents where user is owner; the sort key is always selected to build the next cursor
+    query = document_page(
+        current_user.user_id, [getattr(Document, name) for name in columns], limit + 1,
+        after=decode_cursor(cursor, datetime, int) if cursor else None
+    )
+    rows = (await db.execute(query)).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1].sort_at, rows[-1].sort_id)
+    
+    if fields is None:
+        return [DocumentResponse.model_validate(row) for row in rows]
+    return JSONResponse(
+        jsonable_encoder([{name: getattr(row, name) for name in columns} for row in rows]),
+        headers={"X-Next-Cursor": response.headers["X-Next-Cursor"]} if "X-Next-Cursor" in response.headers else None
+    )
+
+
+@router.get("/search", response_model=list[SearchResult])
+async def search_documents(
+    q: str = Query(..., min_length=1),
+    history: bool = False,
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Find documents owned by current user that contain every word of q, most recently modified first.
+    With history=true older versions match too; each result names the newest matching version.
+    """
+    return await find_documents(db, current_user.user_id, q, history, limit)
 
 
 @router.get("/{document_id}", response_model=DocumentResponse)
 async def get_document(document_id: int, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     """Get a document with its latest content."""
     
-    # Check if user owns the document
-    result = await db.execute(
-        select(DocumentOwner)
-        .where(
-            DocumentOwner.document_id == document_id,
-            DocumentOwner.user_id == current_user.user_id
-        )
-    )
-    if not result.scalar_one_or_none():
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Access denied"
-        )
+    # Check ownership, get document metadata and the head's mongo_id in one query
+    doc, head_mongo_id = await load_document(db, document_id, current_user.user_id)
     
-    # Get document metadata
-    result = await db.execute(select(Document).where(Document.document_id == document_id))
-    doc = result.scalar_one_or_none()
-    
-    if not doc:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Document not found"
-        )
-    
-    # Get latest version
-    if doc.current_version_number is not None:
-        result = await db.execute(
-            select(Version).where(
-                Version.document_id == document_id,
-                Version.version_number == doc.current_version_number
-            )
-        )
-        version = result.scalar_one_or_none()
-        
-        if version:
-            # Fetch content from MongoDB
-            mongo_doc = await document_contents.find_one({"_id": ObjectId(version.mongo_id)})
-            content = mongo_doc.get("content") if mongo_doc else None
-        else:
-            content = None
-    else:
-        content = None
+    # Fetch content from MongoDB
+    content = None
+    if head_mongo_id:
+        mongo_doc = decode_record(await document_contents.find_one({"_id": ObjectId(head_mongo_id)}))
+        content = mongo_doc.get("content") if mongo_doc else None
     
     response = DocumentResponse.model_validate(doc)
     response.content = content
     return response
 
 
-@router.post("/{document_id}/commit", response_model=VersionResponse)
-async def commit_version(document_id: int, commit_data: DocumentCommit, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    """Create a new version by committing changes."""
-    
-    # Check ownership
+async def _commit_rejection(db: AsyncSession, document_id: int, user_id: int) -> HTTPException:
+    """Work out why a conditional version bump matched no row."""
     result = await db.execute(
-        select(DocumentOwner)
+        select(Document)
+        .join(DocumentOwner)
         .where(
-            DocumentOwner.document_id == document_id,
-            DocumentOwner.user_id == current_user.user_id
+            Document.document_id == document_id,
+            DocumentOwner.user_id == user_id
         )
     )
-    if not result.scalar_one_or_none():
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Access denied"
-        )
-    
-    # Get document
-    result = await db.execute(select(Document).where(Document.document_id == document_id))
     doc = result.scalar_one_or_none()
     
     if not doc:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Document not found"
+        return HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied"
         )
-    
-    # Get current version
     if doc.current_version_number is None:
-        raise HTTPException(
+        return HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Document has no versions"
         )
-    
-    result = await db.execute(
-        select(Version).where(
-            Version.document_id == document_id,
-            Version.version_number == doc.current_version_number
-        )
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=f"Version conflict: document is at version {doc.current_version_number}",
+        headers={"ETag": f'"{doc.current_version_number}"'}
     )
-    current_version = result.scalar_one_or_none()
-    
-    # Fetch current content from MongoDB
-    old_mongo_doc = await document_contents.find_one({"_id": ObjectId(current_version.mongo_id)})
-    old_content = old_mongo_doc.get("content")
-    
-    # Calculate REVERSE patch (new → old) for reconstruction
-    reverse_patch = jsonpatch.make_patch(commit_data.content, old_content)
-    
-    # Update old version to store reverse delta
-    await document_contents.update_one(
-        {"_id": ObjectId(current_version.mongo_id)},
-        {"$set": {
-            "type": "delta",
-            "patch": reverse_patch.patch  # Reverse patch: can reconstruct old from new
-        }}
+
+
+async def _unchanged_head(db: AsyncSession, document_id: int, user_id: int, base_version: int | None, content_hash: str) -> Version | None:
+    """The head version if it already has this content hash (and is the base version, if one was given)."""
+    query = (
+        select(Version)
+        .join(Document, and_(Document.document_id == Version.document_id, Document.current_version_number == Version.version_number))
+        .join(DocumentOwner, and_(DocumentOwner.document_id == Document.document_id, DocumentOwner.user_id == user_id))
+        .where(Version.document_id == document_id, Version.content_hash == content_hash)
     )
+    if base_version is not None:
+        query = query.where(Version.version_number == base_version)
     
-    # Store new version as snapshot
-    new_mongo_doc = {
-        "type": "snapshot",
-        "content": commit_data.content
-    }
-    result = await document_contents.insert_one(new_mongo_doc)
+    result = await db.execute(query)
+    return result.scalar_one_or_none()
+
+
+def _unchanged_commit(response: Response, head: Version) -> CommitResponse:
+    """Answer a commit whose content equals the head's: nothing is written and the head is returned."""
+    response.headers["ETag"] = f'"{head.version_number}"'
+    logger.info(f"Unchanged commit for document {head.document_id} skipped at version {head.version_number}")
+    return CommitResponse.model_validate(head).model_copy(update={"unchanged": True})
+
+
+@router.post("/{document_id}/commit", response_model=CommitResponse)
+async def commit_version(document_id: int, commit_data: DocumentCommit, response: Response, base_version: int | None = Depends(get_base_version), current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """
+    Create a new version by committing changes (If-Match: base version makes it conditional).
+    Content equal to the head's creates nothing; the head is returned with unchanged set.
+    """
+    
+    if commit_data.patch is not None and base_version is None:
+        raise HTTPException(
+            status_code=status.HTTP_428_PRECONDITION_REQUIRED,
+            detail="Patch commits need an If-Match base version"
+        )
+    
+    # Full content can be compared with the head before anything is claimed
+    size = payload_size(commit_data.content or commit_data.patch)
+    new_hash = None
+    if commit_data.content is not None:
+        new_hash = await run_cpu(content_hash, commit_data.content, size=size)
+    
+    # Check ownership, look up the head and bump it in one conditional statement
+    claim = await claim_next_version(db, document_id, current_user.user_id, base_version, unless_hash=new_hash)
+    if not claim:
+        head = await _unchanged_head(db, document_id, current_user.user_id, base_version, new_hash) if new_hash else None
+        if head:
+            return _unchanged_commit(response, head)
+        raise await _commit_rejection(db, document_id, current_user.user_id)
+    new_version_number, old_mongo_id, old_hash = claim
+    
+    # Write-behind leaves the reverse delta to the worker, so the old head isn't even read
+    write_behind = settings.WRITE_BEHIND_DELTAS and commit_data.patch is None
+    
+    if write_behind:
+        keyframe = False
+        new_mongo_doc = {
+            "type": "snapshot",
+            "content": commit_data.content,
+            "pending": pending_delta(old_mongo_id, document_id, new_version_number - 1)
+        }
+    else:
+        # Fetch current content from MongoDB
+        old_mongo_doc = decode_record(await document_contents.find_one({"_id": ObjectId(old_mongo_id)}))
+        old_content = old_mongo_doc.get("content")
+        
+        # Calculate REVERSE patch (new → old) for reconstruction
+        try:
+            new_content, reverse_patch, patched_hash = await run_cpu(
+                build_commit, old_content, commit_data.content, commit_data.patch,
+                size=size + payload_size(old_content)
+            )
+        except (jsonpatch.JsonPatchException, JsonPointerException) as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Patch does not apply: {e}"
+            )
+        
+        new_hash = new_hash or patched_hash
+        
+        # A patch that changes nothing releases the claim without writing anything
+        if new_hash == old_hash:
+            await db.rollback()
+            result = await db.execute(select(Version).where(Version.document_id == document_id, Version.version_number == new_version_number - 1))
+            return _unchanged_commit(response, result.scalar_one())
+        
+        keyframe, keyframe_counters = keyframe_policy(old_mongo_doc, reverse_patch)
+        
+        # A keyframe whose content another keyframe already stores (a revert) shares it by reference
+        content_ref = await shared_keyframe(db, document_id, old_hash) if keyframe and "pending" not in old_mongo_doc else None
+        
+        # Store new version as snapshot
+        new_mongo_doc = {
+            "type": "snapshot",
+            "content": new_content,
+            **keyframe_counters
+        }
+    result = await document_contents.insert_one(encode_record(new_mongo_doc))
     new_mongo_id = str(result.inserted_id)
     
     # Create new version in PostgreSQL
-    new_version_number = doc.current_version_number + 1
     new_version = Version(
         document_id=document_id,
         version_number=new_version_number,
         mongo_id=new_mongo_id,
-        modified_by=current_user.user_id
+        content_hash=new_hash,
+        modified_by=current_user.user_id,
+        modified_at=datetime.now(timezone.utc)
     )
     db.add(new_version)
     
-    # Update document metadata
-    doc.current_version_number = new_version_number
-    doc.last_modified_by = current_user.user_id
-    doc.last_modified_at = datetime.now(timezone.utc)
+    # Move the search index to the new head in the same transaction
+    new_head_content = commit_data.content if write_behind else new_content
+    terms = await run_cpu(content_terms, new_head_content, size=size if new_head_content is commit_data.content else payload_size(new_head_content))
+    await index_versions(db, [(document_id, new_version_number, terms)])
+    
+    if keyframe:
+        await db.execute(
+            update(Version)
+            .where(Version.document_id == document_id, Version.version_number == new_version_number - 1)
+            .values(is_keyframe=True)
+        )
     
     await db.commit()
-    await db.refresh(new_version)
     
+    if write_behind:
+        wake_delta_worker()
+    else:
+        # Only now turn the old head into a reverse delta; until then it stays readable as a snapshot
+        await document_contents.update_one({"_id": ObjectId(old_mongo_id)}, delta_update(reverse_patch, keyframe, content_ref))
+    
+    # Version numbers from the new head up must never serve stale cached content
+    version_cache.invalidate(document_id, from_version=new_version_number)
+    
+    response.headers["ETag"] = f'"{new_version_number}"'
     logger.info(f"New version {new_version_number} committed for document {document_id}")
-    return VersionResponse.model_validate(new_version)
+    return CommitResponse.model_validate(new_version)
 
 
 @router.get("/{document_id}/versions", response_model=list[VersionResponse])
-async def list_versions(document_id: int, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    """Get version history for a document."""
+async def list_versions(
+    document_id: int,
+    response: Response,
+    limit: int = Query(settings.LIST_PAGE_SIZE_DEFAULT, ge=1, le=settings.LIST_PAGE_SIZE_MAX),
+    cursor: str | None = None,
+    fields: str | None = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get version history for a document, newest first, one page at a time.
+    Pass the X-Next-Cursor header of a response as cursor to get the next page; fields=a,b selects columns.
+    """
+    
+    columns = parse_fields(fields, VersionResponse, VERSION_LIST_FIELDS)
     
     # Check ownership
-    result = await db.execute(
-        select(DocumentOwner)
-        .where(
-            DocumentOwner.document_id == document_id,
-            DocumentOwner.user_id == current_user.user_id
-        )
+    await require_access(db, document_id, current_user.user_id)
+    
+    # Get one page of versions; the sort key is always selected to build the next cursor
+    query = version_page(
+        document_id, [getattr(Version, name) for name in columns], limit + 1,
+        before=decode_cursor(cursor, int)[0] if cursor else None
+    )
+    rows = (await db.execute(query)).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1].sort_number)
+    
+    if fields is None:
+        return [VersionResponse.model_validate(row) for row in rows]
+    return JSONResponse(
+        jsonable_encoder([{name: getattr(row, name) for name in columns} for row in rows]),
+        headers={"X-Next-Cursor": response.headers["X-Next-Cursor"]} if "X-Next-Cursor" in response.headers else None
     )
-    if not result.scalar_one_or_none():
+
+
+@router.get("/{document_id}/history/stream")
+async def stream_history(document_id: int, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Stream every version with its content, newest first, as NDJSON."""
+    
+    # Check ownership and get document
+    doc, _ = await load_document(db, document_id, current_user.user_id)
+    
+    if doc.current_version_number is None:
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Access denied"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Document has no versions"
         )
     
-    # Get all versions
-    result = await db.execute(
-        select(Version)
-        .where(Version.document_id == document_id)
-        .order_by(Version.version_number.desc())
-    )
-    versions = result.scalars().all()
-    
-    return [VersionResponse.model_validate(v) for v in versions]
+    async def generate_history():
+        # The request's session may be closed before the body is sent, so the stream uses its
+        # own, and starts from the head as of now: commits may have landed since the check
+        async with AsyncSessionLocal() as session:
+            head_number = (await session.execute(select(Document.current_version_number).where(Document.document_id == document_id))).scalar()
+            if head_number is None:
+                return
+            async for version, content in iter_history(session, document_id, head_number):
+                yield json.dumps({
+                    "document_id": document_id,
+                    "version_number": version.version_number,
+                    "modified_by": version.modified_by,
+                    "modified_at": version.modified_at.isoformat(),
+                    "content": content
+                }) + "\n"
+    
+    return StreamingResponse(generate_history(), media_type="application/x-ndjson")
 
 
 @router.patch("/{document_id}", response_model=DocumentResponse)
 async def update_document(document_id: int, update_data: DocumentUpdate, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     """Update document title."""
     
-    # Check ownership
-    result = await db.execute(
-        select(DocumentOwner)
-        .where(
-            DocumentOwner.document_id == document_id,
-            DocumentOwner.user_id == current_user.user_id
-        )
-    )
-    if not result.scalar_one_or_none():
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Access denied"
-        )
-    
-    # Get document
-    result = await db.execute(select(Document).where(Document.document_id == document_id))
-    doc = result.scalar_one_or_none()
-    
-    if not doc:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Document not found"
-        )
+    # Check ownership and get document
+    doc, _ = await load_document(db, document_id, current_user.user_id)
     
     # Update title if provided
     if update_data.title:
@@ -297,18 +612,7 @@ async def share_document(document_id: int, share_data: DocumentShare, current_us
     """Share document with another user."""
     
     # Check ownership
-    result = await db.execute(
-        select(DocumentOwner)
-        .where(
-            DocumentOwner.document_id == document_id,
-            DocumentOwner.user_id == current_user.user_id
-        )
-    )
-    if not result.scalar_one_or_none():
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Access denied"
-        )
+    await require_access(db, document_id, current_user.user_id)
     
     # Find user to share with
     result = await db.execute(
@@ -340,6 +644,7 @@ async def share_document(document_id: int, share_data: DocumentShare, current_us
     new_owner = DocumentOwner(document_id=document_id, user_id=target_user.user_id)
     db.add(new_owner)
     await db.commit()
+    invalidate_access(document_id)
     
     logger.info(f"Document {document_id} shared with user {target_user.user_id}")
     return {"message": f"Document shared with {share_data.username}"}
@@ -350,18 +655,7 @@ async def unshare_document(document_id: int, user_id: int, current_user: User =
     """Remove user from document owners."""
     
     # Check ownership
-    result = await db.execute(
-        select(DocumentOwner)
-        .where(
-            DocumentOwner.document_id == document_id,
-            DocumentOwner.user_id == current_user.user_id
-        )
-    )
-    if not result.scalar_one_or_none():
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Access denied"
-        )
+    await require_access(db, document_id, current_user.user_id)
     
     # Can't remove yourself if you're the only owner
     result = await db.execute(
@@ -377,14 +671,7 @@ async def unshare_document(document_id: int, user_id: int, current_user: User =
         )
     
     # Remove owner
-    result = await db.execute(
-        select(DocumentOwner)
-        .where(
-            DocumentOwner.document_id == document_id,
-            DocumentOwner.user_id == user_id
-        )
-    )
-    owner = result.scalar_one_or_none()
+    owner = next((o for o in owners if o.user_id == user_id), None)
     
     if not owner:
         raise HTTPException(
@@ -394,6 +681,7 @@ async def unshare_document(document_id: int, user_id: int, current_user: User =
     
     await db.delete(owner)
     await db.commit()
+    invalidate_access(document_id)
     
     logger.info(f"User {user_id} removed from document {document_id}")
     return {"message": "User removed from document"}
@@ -403,44 +691,28 @@ async def unshare_document(document_id: int, user_id: int, current_user: User =
 async def delete_document(document_id: int, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     """Delete a document and all its versions."""
     
-    # Check ownership
-    result = await db.execute(
-        select(DocumentOwner)
-        .where(
-            DocumentOwner.document_id == document_id,
-            DocumentOwner.user_id == current_user.user_id
-        )
-    )
-    if not result.scalar_one_or_none():
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Access denied"
-        )
-    
-    result = await db.execute(select(Document).where(Document.document_id == document_id))
-    doc = result.scalar_one_or_none()
-    
-    if not doc:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Document not found"
-        )
+    # Check ownership and get document
+    doc, _ = await load_document(db, document_id, current_user.user_id)
     
     # Get all versions to delete from MongoDB
     result = await db.execute(
-        select(Version).where(Version.document_id == document_id)
+        select(Version.mongo_id).where(Version.document_id == document_id)
     )
-    versions = result.scalars().all()
-    
-    for version in versions:
-        try:
-            await document_contents.delete_one({"_id": ObjectId(version.mongo_id)})
-        except Exception as e:
-            logger.warning(f"Failed to delete MongoDB doc {version.mongo_id}: {e}")
+    mongo_ids = [ObjectId(mongo_id) for mongo_id in result.scalars().all()]
     
-    # Delete from PostgreSQL (cascade will handle versions and owners)
+    # Delete from PostgreSQL first (cascade will handle versions and owners), so no version is left without content
     await db.delete(doc)
     await db.commit()
+    version_cache.invalidate(document_id)
+    invalidate_access(document_id)
+    
+    # Then the contents, in one round trip per CONTENT_DELETE_CHUNK versions
+    for i in range(0, len(mongo_ids), CONTENT_DELETE_CHUNK):
+        try:
+            await document_contents.delete_many({"_id": {"$in": mongo_ids[i:i + CONTENT_DELETE_CHUNK]}})
+        except Exception as e:
+            logger.warning(f"Failed to delete MongoDB contents of document {document_id}, leaving them to the orphan collector: {e}")
+            break
     
     logger.info(f"Document {document_id} deleted by user {current_user.user_id}")
     return {"message": "Document deleted"}
@@ -451,78 +723,56 @@ async def get_version(document_id: int, version_number: int, current_user: User
     """Get specific version content (reconstructs from deltas if needed)."""
      
     # Check ownership
-    result = await db.execute(
-        select(DocumentOwner)
-        .where(
-            DocumentOwner.document_id == document_id,
-            DocumentOwner.user_id == current_user.user_id
-        )
-    )
-    if not result.scalar_one_or_none():
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Access denied"
-        )
-    
-    # Get requested version
-    result = await db.execute(
-        select(Version).where(
-            Version.document_id == document_id,
-            Version.version_number == version_number
-        )
-    )
-    version = result.scalar_one_or_none()
+    await require_access(db, document_id, current_user.user_id)
     
-    if not version:
+    # Serve from the version cache, or reconstruct from the nearest keyframe or cached version
+    loaded = await load_version(db, document_id, version_number)
+    if loaded is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Version not found"
         )
+    modified_at, content = loaded
+    
+    return {
+        "document_id": document_id,
+        "version_number": version_number,
+        "content": content,
+        "modified_at": modified_at
+    }
+
+
+@router.get("/{document_id}/diff")
+async def diff_versions(document_id: int, from_version: int = Query(..., alias="from", ge=0), to_version: int = Query(..., alias="to", ge=0), current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Get an RFC 6902 patch that turns one version into another."""
     
-    # Fetch from MongoDB
-    mongo_doc = await document_contents.find_one({"_id": ObjectId(version.mongo_id)})
+    # Check ownership
+    await require_access(db, document_id, current_user.user_id)
     
-    if mongo_doc.get("type") == "snapshot":
-        # Latest version - return directly
-        content = mongo_doc.get("content")
-    else:
-        # Old version with reverse delta - need to apply all patches from current to this version
-        result = await db.execute(
-            select(Document).where(Document.document_id == document_id)
-        )
-        doc = result.scalar_one_or_none()
+    patch = None
+    if from_version > to_version:
+        # Going back in time: the stored reverse patches already are the diff
+        patch = await load_reverse_patches(db, document_id, to_version, from_version)
+    
+    if patch is None:
+        # Reverse patches can't be inverted without content (or are still pending), so diff both ends of one chain
+        older_number, newer_number = min(from_version, to_version), max(from_version, to_version)
+        chain = await load_delta_chain(db, document_id, older_number, through=newer_number)
         
-        result = await db.execute(
-            select(Version).where(
-                Version.document_id == document_id,
-                Version.version_number == doc.current_version_number
-            )
+        if chain and chain[-1][0].version_number == older_number and chain[0][0].version_number >= newer_number:
+            records = [record for _, record in chain]
+            newer_index = next(i for i, (version, _) in enumerate(chain) if version.version_number == newer_number)
+            patch = await run_cpu(diff_in_chain, records, newer_index, from_version <= to_version, size=payload_size(records))
+    
+    if patch is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Version not found"
         )
-        current_version = result.scalar_one_or_none()
-        
-        # Get current snapshot
-        current_mongo = await document_contents.find_one({"_id": ObjectId(current_version.mongo_id)})
-        content = current_mongo.get("content")
-       
-        # Apply all reverse patches from current down to requested version
-        for v in range(doc.current_version_number - 1, version_number - 1, -1):
-            result = await db.execute(
-                select(Version).where(
-                    Version.document_id == document_id,
-                    Version.version_number == v
-                )
-            )
-            old_version = result.scalar_one_or_none()
-            
-            if old_version:
-                old_mongo = await document_contents.find_one({"_id": ObjectId(old_version.mongo_id)})
-                if old_mongo.get("type") == "delta":
-                    reverse_patch = jsonpatch.JsonPatch(old_mongo.get("patch"))
-                    content = reverse_patch.apply(content)
     
     return {
         "document_id": document_id,
-        "version_number": version_number,
-        "content": content,
-        "modified_at": version.modified_at
+        "from_version": from_version,
+        "to_version": to_version,
+        "patch": patch
     }
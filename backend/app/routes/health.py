@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Response, status
+
+from startup import check_databases, is_ready
+
+router = APIRouter(tags=["Health"])
+
+
+@router.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and its event loop responds. Never touches the databases."""
+    return {"status": "ok"}
+
+
+@router.get("/readyz")
+async def readyz(response: Response):
+    """Readiness: startup (migrations, keys, pool warm-up) is done and both databases answer."""
+    
+    if not is_ready():
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "starting"}
+    
+    checks = await check_databases()
+    if any(result != "ok" for result in checks.values()):
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "unavailable", **checks}
+    
+    return {"status": "ready", **checks}
@@ -0,0 +1,85 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from access import acl_cache
+from auth import token_cache, user_cache
+from content_gc import content_gc_stats
+from database import engine, mongo_client
+from metrics import HISTOGRAMS, family, mongo_pool
+from offload import executor_stats
+from refresh_tokens import refresh_token_stats
+from versioning import version_cache
+
+router = APIRouter(tags=["Metrics"])
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def pool_metrics() -> list[str]:
+    in_use, idle, size = [], [], []
+
+    pool = engine.pool
+    if hasattr(pool, "checkedout"):  # Queue pools; e.g. SQLite's StaticPool keeps no counts
+        in_use.append(({"store": "postgres"}, pool.checkedout()))
+        idle.append(({"store": "postgres"}, pool.checkedin()))
+        size.append(({"store": "postgres"}, pool.size()))
+
+    in_use.append(({"store": "mongo"}, mongo_pool.checked_out))
+    idle.append(({"store": "mongo"}, mongo_pool.open - mongo_pool.checked_out))
+    size.append(({"store": "mongo"}, mongo_client.options.pool_options.max_pool_size))
+
+    return (
+        family("izanagi_db_pool_connections_in_use", "gauge", "Connections checked out of the pool.", in_use)
+        + family("izanagi_db_pool_connections_idle", "gauge", "Open connections waiting in the pool.", idle)
+        + family("izanagi_db_pool_size", "gauge", "Connections the pool keeps (PostgreSQL may overflow it).", size)
+    )
+
+
+def cache_metrics() -> list[str]:
+    caches = {"token": token_cache.stats(), "user": user_cache.stats(), "acl": acl_cache.stats(), "version": version_cache.stats()}
+    version = caches["version"]
+
+    return (
+        family("izanagi_cache_hits_total", "counter", "Cache lookups served from the cache.", [({"cache": name}, s["hits"]) for name, s in caches.items()])
+        + family("izanagi_cache_misses_total", "counter", "Cache lookups that missed.", [({"cache": name}, s["misses"]) for name, s in caches.items()])
+        + family("izanagi_cache_entries", "gauge", "Entries currently cached.", [({"cache": name}, s["entries"]) for name, s in caches.items()])
+        + family("izanagi_version_cache_partial_hits_total", "counter", "Reconstructions that started from a cached newer version.", [({}, version["partial_hits"])])
+        + family("izanagi_version_cache_evictions_total", "counter", "Versions evicted to stay within the byte budget.", [({}, version["evictions"])])
+        + family("izanagi_version_cache_bytes", "gauge", "Approximate size of the cached versions.", [({}, version["bytes"])])
+        + family("izanagi_version_cache_max_bytes", "gauge", "Byte budget of the version cache.", [({}, version["max_bytes"])])
+    )
+
+
+def background_metrics() -> list[str]:
+    executor = executor_stats()
+    tokens = refresh_token_stats()
+    gc = content_gc_stats()
+
+    return (
+        family("izanagi_patch_jobs_total", "counter", "Patch jobs run inline on the event loop or offloaded to the executor.", [
+            ({"mode": "inline"}, executor["inline"]),
+            ({"mode": "offloaded"}, executor["offloaded"])
+        ])
+        + family("izanagi_patch_executor_queue_depth", "gauge", "Offloaded patch jobs not finished yet.", [({}, executor["queue_depth"])])
+        + family("izanagi_patch_executor_max_queue_depth", "gauge", "Highest patch executor queue depth seen.", [({}, executor["max_queue_depth"])])
+        + family("izanagi_refresh_tokens_purged_total", "counter", "Refresh tokens deleted by the purger or the per-user cap.", [
+            ({"reason": "expired"}, tokens["purged_expired"]),
+            ({"reason": "over_cap"}, tokens["purged_over_cap"])
+        ])
+        + family("izanagi_refresh_token_purge_runs_total", "counter", "Expired refresh token purges run.", [({}, tokens["purge_runs"])])
+        + family("izanagi_refresh_token_last_purge_timestamp_seconds", "gauge", "Unix time the last purge finished (0: never).", [({}, tokens["last_purge_at"] or 0)])
+        + family("izanagi_refresh_token_last_purge_duration_seconds", "gauge", "How long the last purge took.", [({}, tokens["last_purge_seconds"])])
+        + family("izanagi_content_gc_runs_total", "counter", "Orphaned content collections run.", [({}, gc["runs"])])
+        + family("izanagi_content_gc_scanned_total", "counter", "MongoDB records checked for a version pointing at them.", [({}, gc["scanned"])])
+        + family("izanagi_content_gc_deleted_total", "counter", "Orphaned MongoDB records deleted.", [({}, gc["deleted"])])
+        + family("izanagi_content_gc_reclaimed_bytes_total", "counter", "BSON size of the orphaned records deleted.", [({}, gc["reclaimed_bytes"])])
+        + family("izanagi_content_gc_last_run_timestamp_seconds", "gauge", "Unix time the last collection finished (0: never).", [({}, gc["last_run_at"] or 0)])
+    )
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint."""
+    lines = [line for histogram in HISTOGRAMS for line in histogram.render()]
+    lines += pool_metrics() + cache_metrics() + background_metrics()
+    return PlainTextResponse("\n".join(lines) + "\n", media_type=CONTENT_TYPE)
@@ -1,5 +1,5 @@
 from datetime import datetime
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, model_validator
 
 
 # User Schemas
@@ -60,7 +60,31 @@ class DocumentShare(BaseModel):
 
 
 class DocumentCommit(BaseModel):
-    content: dict  # New version content
+    content: dict | None = None  # New version content
+    patch: list[dict] | None = None  # ...or an RFC 6902 patch against the If-Match base version
+
+    @model_validator(mode="after")
+    def check_content_or_patch(self):
+        if (self.content is None) == (self.patch is None):
+            raise ValueError("Provide either content or patch")
+        return self
+
+
+class BatchCommitItem(DocumentCommit):
+    document_id: int
+    base_version: int | None = None  # Required with patch, optional compare-and-swap with content
+
+
+class BatchCommit(BaseModel):
+    items: list[BatchCommitItem] = Field(..., min_length=1)
+
+
+class BatchCommitResult(BaseModel):
+    document_id: int
+    status: int  # HTTP status the single-document commit would have returned
+    version_number: int | None = None
+    unchanged: bool = False  # Content equals the head's, so nothing was written
+    detail: str | None = None
 
 
 class DocumentResponse(BaseModel):
@@ -80,6 +104,18 @@ class VersionResponse(BaseModel):
     version_number: int
     modified_by: int | None
     modified_at: datetime
+    content_hash: str | None = None
     
     class Config:
         from_attributes = True
+
+
+class SearchResult(BaseModel):
+    document_id: int
+    title: str
+    version_number: int  # Newest version that matches (the head unless searching history)
+    snippet: str | None = None
+
+
+class CommitResponse(VersionResponse):
+    unchanged: bool = False  # Content equals the head's, so no version was created and this is the head
@@ -0,0 +1,183 @@
+import re
+
+from bson import ObjectId
+from collections import defaultdict
+from typing import Any, Iterator
+from sqlalchemy import and_, bindparam, delete, insert, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from codec import decode_record
+from database import document_contents
+from queries import documents_with_terms, head_terms
+from tables import Document, DocumentOwner, SearchTerm, Version
+from versioning import iter_history, load_version
+
+
+TOKEN_PATTERN = re.compile(r"\w+")
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 64  # Matches the term column
+SNIPPET_WIDTH = 160
+
+
+def iter_strings(value: Any) -> Iterator[str]:
+    """Every string value in a JSON document (keys are structure, not content)."""
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from iter_strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from iter_strings(item)
+
+
+def tokenize(text: str) -> list[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if MIN_TERM_LENGTH <= len(token) <= MAX_TERM_LENGTH]
+
+
+def content_terms(content: dict) -> set[str]:
+    """The distinct terms of a content, as stored in the index."""
+    return {term for text in iter_strings(content) for term in tokenize(text)}
+
+
+def make_snippet(content: dict, terms: list[str]) -> str | None:
+    """About SNIPPET_WIDTH characters of the first string in content that contains one of the terms."""
+    pattern = re.compile(r"\b(?:" + "|".join(re.escape(term) for term in terms) + r")\b", re.IGNORECASE)
+    for text in iter_strings(content):
+        match = pattern.search(text)
+        if match:
+            start = max(0, match.start() - SNIPPET_WIDTH // 3)
+            end = min(len(text), start + SNIPPET_WIDTH)
+            snippet = " ".join(text[start:end].split())
+            return ("…" if start > 0 else "") + snippet + ("…" if end < len(text) else "")
+    return None
+
+
+async def index_versions(db: AsyncSession, versions: list[tuple[int, int, set[str]]]):
+    """
+    Move the index of each document to a new head version, given as (document_id,
+    version_number, terms). Only terms that appeared or disappeared are written, in
+    three round trips however many documents; the caller commits.
+    """
+    if not versions:
+        return
+
+    result = await db.execute(head_terms([document_id for document_id, _, _ in versions]))
+    current_terms = defaultdict(set)
+    for row in result:
+        current_terms[row.document_id].add(row.term)
+
+    closed, opened = [], []
+    for document_id, version_number, terms in versions:
+        current = current_terms[document_id]
+        closed += [{"doc": document_id, "old_term": term, "last": version_number - 1} for term in current - terms]
+        opened += [{"term": term, "document_id": document_id, "first_version": version_number} for term in terms - current]
+
+    if closed:
+        table = SearchTerm.__table__
+        await db.execute(
+            update(table)
+            .where(table.c.document_id == bindparam("doc"), table.c.term == bindparam("old_term"), table.c.last_version.is_(None))
+            .values(last_version=bindparam("last")),
+            closed
+        )
+    if opened:
+        await db.execute(insert(SearchTerm), opened)
+
+
+def _newest_common_version(spans_by_term: dict[str, list[tuple[int, int]]]) -> int | None:
+    """Newest version inside a span of every term. It is always the end of one of the spans."""
+    ends = sorted({end for spans in spans_by_term.values() for _, end in spans}, reverse=True)
+    return next((v for v in ends if all(any(first <= v <= last for first, last in spans) for spans in spans_by_term.values())), None)
+
+
+async def find_documents(db: AsyncSession, user_id: int, q: str, history: bool = False, limit: int = 20) -> list[dict]:
+    """
+    Documents the user owns whose head (or, with history, any version) contains every
+    term of q, most recently modified first, each with its best-matching version (the
+    newest one that matches) and a snippet of it.
+    """
+    terms = sorted(set(tokenize(q)))
+    if not terms:
+        return []
+
+    owned = and_(DocumentOwner.document_id == Document.document_id, DocumentOwner.user_id == user_id)
+
+    if not history:
+        result = await db.execute(documents_with_terms(user_id, terms, limit))
+        hits = [{"document_id": row.document_id, "title": row.title, "version_number": row.current_version_number} for row in result]
+    else:
+        result = await db.execute(
+            select(SearchTerm.document_id, SearchTerm.term, SearchTerm.first_version, SearchTerm.last_version, Document.title, Document.current_version_number, Document.last_modified_at)
+            .join(Document, Document.document_id == SearchTerm.document_id)
+            .join(DocumentOwner, owned)
+            .where(SearchTerm.term.in_(terms))
+        )
+        spans = defaultdict(lambda: defaultdict(list))
+        documents = {}
+        for row in result:
+            spans[row.document_id][row.term].append((row.first_version, row.current_version_number if row.last_version is None else row.last_version))
+            documents[row.document_id] = row
+
+        hits = []
+        for document_id, spans_by_term in spans.items():
+            best = _newest_common_version(spans_by_term) if len(spans_by_term) == len(terms) else None
+            if best is not None:
+                hits.append({"document_id": document_id, "title": documents[document_id].title, "version_number": best})
+        hits.sort(key=lambda hit: (documents[hit["document_id"]].last_modified_at, hit["document_id"]), reverse=True)
+        hits = hits[:limit]
+
+    await _attach_snippets(db, hits, terms)
+    return hits
+
+
+async def _attach_snippets(db: AsyncSession, hits: list[dict], terms: list[str]):
+    """Contents of heads are read in one query per store; older versions go through the version cache."""
+    if not hits:
+        return
+
+    result = await db.execute(
+        select(Version.document_id, Version.mongo_id)
+        .join(Document, and_(Document.document_id == Version.document_id, Document.current_version_number == Version.version_number))
+        .where(tuple_(Version.document_id, Version.version_number).in_([(hit["document_id"], hit["version_number"]) for hit in hits]))
+    )
+    head_mongo_ids = dict(result.tuples().all())
+
+    cursor = document_contents.find({"_id": {"$in": [ObjectId(m) for m in head_mongo_ids.values()]}})
+    contents = {str(record["_id"]): decode_record(record).get("content") async for record in cursor}
+
+    for hit in hits:
+        if hit["document_id"] in head_mongo_ids:
+            content = contents.get(head_mongo_ids[hit["document_id"]])
+        else:
+            loaded = await load_version(db, hit["document_id"], hit["version_number"])
+            content = loaded[1] if loaded else None
+        hit["snippet"] = make_snippet(content, terms) if content is not None else None
+
+
+async def rebuild_document_index(db: AsyncSession, document_id: int, head_number: int) -> int:
+    """
+    Rebuild one document's index from its full history, newest version first, and
+    commit. Returns the number of rows written.
+    """
+    rows = []
+    last_seen: dict[str, int | None] = {}  # Term -> last version of its current span (None: in the head)
+    previous_terms: set[str] = set()
+    oldest = head_number
+
+    async for version, content in iter_history(db, document_id, head_number):
+        terms = content_terms(content)
+        oldest = version.version_number
+        for term in previous_terms - terms:
+            rows.append({"term": term, "document_id": document_id, "first_version": oldest + 1, "last_version": last_seen.pop(term)})
+        for term in terms - previous_terms:
+            last_seen[term] = None if oldest == head_number else oldest
+        previous_terms = terms
+
+    rows += [{"term": term, "document_id": document_id, "first_version": oldest, "last_version": last} for term, last in last_seen.items()]
+
+    await db.execute(delete(SearchTerm).where(SearchTerm.document_id == document_id))
+    if rows:
+        await db.execute(insert(SearchTerm), rows)
+    await db.commit()
+    return len(rows)
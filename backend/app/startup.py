@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import time
+
+from sqlalchemy import text
+
+from auth import load_keys
+from config import settings
+from database import engine, mongo_client
+from migrate import upgrade_database
+
+
+logger = logging.getLogger(__name__)
+
+_state = {"ready": False}
+
+
+async def migrate_with_backoff():
+    """
+    Migrate the databases as soon as both accept connections, retrying with exponential
+    backoff (STARTUP_RETRY_INITIAL_SECONDS doubling up to STARTUP_RETRY_MAX_SECONDS).
+    Raises the last error once STARTUP_TIMEOUT_SECONDS have passed.
+    """
+    deadline = time.monotonic() + settings.STARTUP_TIMEOUT_SECONDS
+    delay = settings.STARTUP_RETRY_INITIAL_SECONDS
+    attempt = 1
+
+    while True:
+        try:
+            await upgrade_database()
+            return
+        except Exception as e:
+            if time.monotonic() + delay > deadline:
+                logger.error(f"Databases still unavailable after {attempt} attempts, giving up: {e}")
+                raise
+            logger.warning(f"Databases not ready (attempt {attempt}), retrying in {delay:.2f}s: {e}")
+
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, settings.STARTUP_RETRY_MAX_SECONDS)
+        attempt += 1
+
+
+async def warm_postgres(count: int):
+    """Open count pooled connections at once; closing them returns them to the pool."""
+    connections = [engine.connect() for _ in range(count)]
+    started = await asyncio.gather(*(connection.start() for connection in connections), return_exceptions=True)
+    await asyncio.gather(*(connection.close() for connection, result in zip(connections, started) if not isinstance(result, BaseException)))
+
+    for result in started:
+        if isinstance(result, BaseException):
+            raise result
+
+
+async def warm_mongo(count: int):
+    """Concurrent pings make the driver open up to count connections, which stay pooled."""
+    await asyncio.gather(*(mongo_client.admin.command("ping") for _ in range(count)))
+
+
+async def prepare():
+    """Everything an instance does before it takes traffic: migrate, load keys, warm the pools."""
+    started = time.monotonic()
+    await migrate_with_backoff()
+    load_keys()
+
+    await asyncio.gather(
+        warm_postgres(min(settings.POOL_WARMUP_CONNECTIONS, settings.POSTGRES_POOL_SIZE)),
+        warm_mongo(min(settings.POOL_WARMUP_CONNECTIONS, settings.MONGO_MAX_POOL_SIZE))
+    )
+
+    _state["ready"] = True
+    logger.info(f"Ready in {time.monotonic() - started:.2f}s")
+
+
+def stop_accepting():
+    """Report unready from now on, so the orchestrator stops routing to a stopping instance."""
+    _state["ready"] = False
+
+
+async def check_databases() -> dict[str, str]:
+    """Ping both stores, each within READINESS_TIMEOUT_SECONDS. Maps each store to "ok" or the error."""
+
+    async def ping_postgres():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    async def ping_mongo():
+        await mongo_client.admin.command("ping")
+
+    checks = {"postgres": ping_postgres(), "mongo": ping_mongo()}
+    results = await asyncio.gather(
+        *(asyncio.wait_for(check, settings.READINESS_TIMEOUT_SECONDS) for check in checks.values()),
+        return_exceptions=True
+    )
+    return {
+        store: "ok" if not isinstance(result, BaseException) else (str(result) or type(result).__name__)
+        for store, result in zip(checks, results)
+    }
+
+
+def is_ready() -> bool:
+    return _state["ready"]
@@ -1,6 +1,6 @@
 from database import Base
 from datetime import datetime
-from sqlalchemy import Integer, String, DateTime, ForeignKey, CheckConstraint, func
+from sqlalchemy import DDL, Boolean, Index, Integer, String, DateTime, ForeignKey, CheckConstraint, event, false, func, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 
@@ -18,6 +18,15 @@ class User(Base):
     modified_documents: Mapped[list["Document"]] = relationship("Document", foreign_keys="Document.last_modified_by", back_populates="last_modifier")
     owned_documents: Mapped[list["Document"]] = relationship("Document", secondary="document_owners", back_populates="owners")
     refresh_tokens: Mapped[list["RefreshToken"]] = relationship("RefreshToken", back_populates="user")
+    
+    __table_args__ = (
+        # User search: prefix matches via a pattern-ops B-tree, substring matches via trigrams
+        Index("ix_users_username_prefix", text("lower(username) text_pattern_ops")).ddl_if(dialect="postgresql"),
+        Index("ix_users_username_trgm", "username", postgresql_using="gin", postgresql_ops={"username": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
+
+
+event.listen(User.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
 
 
 class Document(Base):
@@ -36,6 +45,12 @@ class Document(Base):
     last_modifier: Mapped["User"] = relationship("User", foreign_keys=[last_modified_by], back_populates="modified_documents")
     owners: Mapped[list["User"]] = relationship("User", secondary="document_owners", back_populates="owned_documents")
     versions: Mapped[list["Version"]] = relationship("Version", back_populates="document", cascade="all, delete-orphan", passive_deletes=True)
+    
+    __table_args__ = (
+        # Listings walk this backwards, newest first, probing the owners of each document
+        # until a page is full, instead of sorting everything the user owns
+        Index("ix_documents_last_modified_at_id", "last_modified_at", "document_id"),
+    )
 
 
 class DocumentOwner(Base):
@@ -43,6 +58,11 @@ class DocumentOwner(Base):
     
     document_id: Mapped[int] = mapped_column(ForeignKey("documents.document_id", ondelete="CASCADE"), primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
+    
+    __table_args__ = (
+        # The primary key leads with document_id; listings look owners up by user
+        Index("ix_document_owners_user_document", "user_id", "document_id"),
+    )
 
 
 class Version(Base):
@@ -51,11 +71,15 @@ class Version(Base):
     document_id: Mapped[int] = mapped_column(ForeignKey("documents.document_id", ondelete="CASCADE"), primary_key=True)
     version_number: Mapped[int] = mapped_column(Integer, primary_key=True)
     mongo_id: Mapped[str] = mapped_column(String(24), nullable=False)
+    content_hash: Mapped[str | None] = mapped_column(String(64))  # SHA-256 of the canonical JSON content
+    is_keyframe: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False, server_default=false())  # Delta that also keeps its full content
     modified_by: Mapped[int | None] = mapped_column(ForeignKey("users.user_id", ondelete="SET NULL"))
     modified_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     
     __table_args__ = (
         CheckConstraint("version_number >= 0", name="check_version_nonnegative"),
+        Index("ix_versions_document_modified_at", "document_id", "modified_at"),
+        Index("ix_versions_mongo_id", "mongo_id"),
     )
     
     # Relationships
@@ -72,5 +96,29 @@ class RefreshToken(Base):
     expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     
+    __table_args__ = (
+        Index("ix_refresh_tokens_expires_at", "expires_at"),
+        Index("ix_refresh_tokens_user_token", "user_id", "token_id"),
+    )
+    
     # Relationships
     user: Mapped["User"] = relationship("User", back_populates="refresh_tokens")
+
+
+class SearchTerm(Base):
+    """
+    Inverted index over document content. A row says the term occurs in every version
+    from first_version to last_version; last_version is NULL while it is in the head.
+    """
+    __tablename__ = "search_terms"
+    
+    term: Mapped[str] = mapped_column(String(64), primary_key=True)
+    document_id: Mapped[int] = mapped_column(ForeignKey("documents.document_id", ondelete="CASCADE"), primary_key=True)
+    first_version: Mapped[int] = mapped_column(Integer, primary_key=True)
+    last_version: Mapped[int | None] = mapped_column(Integer)
+    
+    __table_args__ = (
+        Index("ix_search_terms_document_open", "document_id", "last_version"),
+        # Head-only searches look terms up among open rows
+        Index("ix_search_terms_open_term", "term", postgresql_where=text("last_version IS NULL")),
+    )
@@ -0,0 +1,61 @@
+"""
+The tests run the app in-process on the benchmark stand-ins, SQLite (aiosqlite) in place of
+PostgreSQL and benchmarks.mongo_stub in place of MongoDB, so no database has to be running:
+
+    cd backend/app && python -m pytest tests
+
+Each test drives its scenario with asyncio.run(...) inside fresh_app(), which starts from
+empty stores and caches.
+"""
+from benchmarks.__main__ import install_standins
+
+install_standins()  # Before anything imports the database handles
+
+import database  # noqa: E402
+import httpx  # noqa: E402
+
+from contextlib import asynccontextmanager  # noqa: E402
+
+from access import acl_cache  # noqa: E402
+from auth import token_cache, user_cache  # noqa: E402
+from main import app  # noqa: E402
+from versioning import version_cache  # noqa: E402
+
+PASSWORD = "test-password"
+
+
+@asynccontextmanager
+async def fresh_app():
+    """A client for the app on empty stores. The in-memory SQLite database goes with the engine's connection."""
+    database.document_contents._records.clear()
+    for ttl_cache in (acl_cache, token_cache, user_cache):
+        ttl_cache._entries.clear()
+    version_cache.__init__(version_cache.max_bytes)
+
+    async with database.engine.begin() as conn:
+        await conn.run_sync(database.Base.metadata.create_all)
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            yield client
+    finally:
+        await database.engine.dispose()
+
+
+async def login(client: httpx.AsyncClient, username: str) -> dict:
+    """Register the user and return their Authorization header."""
+    await client.post("/auth/register", json={"username": username, "email": f"{username}@example.com", "password": PASSWORD})
+    response = await client.post("/auth/login", json={"username": username, "password": PASSWORD})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def create_document(client: httpx.AsyncClient, headers: dict, content: dict, title: str = "doc") -> int:
+    response = await client.post("/documents", json={"title": title, "content": content}, headers=headers)
+    assert response.status_code == 201, response.text
+    return response.json()["document_id"]
+
+
+async def commit(client: httpx.AsyncClient, headers: dict, document_id: int, content: dict) -> int:
+    response = await client.post(f"/documents/{document_id}/commit", json={"content": content}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["version_number"]
@@ -0,0 +1,86 @@
+"""The orphaned content collector must delete old records nothing refers to, and nothing else."""
+import asyncio
+import os
+import time
+
+from bson import ObjectId
+from sqlalchemy import delete
+
+import database
+from conftest import commit, create_document, fresh_app, login
+from config import settings
+from content_gc import collect_orphaned_contents, content_gc_stats
+from tables import Version
+from versioning import version_cache
+
+
+def content(i: int) -> dict:
+    return {"version": i, "text": "v" * i}
+
+
+def object_id_at(seconds_from_now: float) -> ObjectId:
+    """A fresh ObjectId carrying a creation time that far from now."""
+    return ObjectId(int(time.time() + seconds_from_now).to_bytes(4, "big") + os.urandom(8))
+
+
+async def collect():
+    async with fresh_app() as client:
+        headers = await login(client, "collector")
+        document_id = await create_document(client, headers, content(0))
+
+        # Version 2 reverts to version 0 and keeps its content by reference to version 0's record
+        for i in (1, 0, 3):
+            await commit(client, headers, document_id, content(i))
+        async with database.AsyncSessionLocal() as session:
+            result = await session.execute(
+                delete(Version).where(Version.document_id == document_id, Version.version_number == 0).returning(Version.mongo_id)
+            )
+            shared_id = ObjectId(result.scalar_one())
+            await session.commit()
+
+        # Old orphans, spread over several batches, and one within the grace period
+        old = [(await database.document_contents.insert_one({"_id": object_id_at(-7200 - i), "type": "snapshot", "content": content(i)})).inserted_id for i in range(5)]
+        young = (await database.document_contents.insert_one({"_id": object_id_at(3600), "type": "snapshot", "content": content(9)})).inserted_id
+        old_bytes = sum(len(database.document_contents._records[_id]) for _id in old)
+        kept = set(database.document_contents._records) - set(old)
+
+        before = content_gc_stats()
+        deleted, reclaimed = await collect_orphaned_contents()
+        after = content_gc_stats()
+        left = set(database.document_contents._records)
+
+        version_cache.__init__(version_cache.max_bytes)
+        responses = [await client.get(f"/documents/{document_id}/versions/{n}", headers=headers) for n in (1, 2, 3)]
+
+    return deleted, reclaimed, old_bytes, kept, left, shared_id, young, after["scanned"] - before["scanned"], [r.json()["content"] for r in responses]
+
+
+def test_collects_only_old_unreferenced_records(monkeypatch):
+    monkeypatch.setattr(settings, "KEYFRAME_INTERVAL", 1)
+    monkeypatch.setattr(settings, "CONTENT_GC_BATCH_SIZE", 2)
+    monkeypatch.setattr(settings, "CONTENT_GC_GRACE_SECONDS", -60.0)  # Everything but the young orphan is old enough
+    deleted, reclaimed, old_bytes, kept, left, shared_id, young, scanned, contents = asyncio.run(collect())
+
+    assert (deleted, reclaimed) == (5, old_bytes)
+    assert left == kept
+    assert shared_id in left and young in left
+    assert scanned == len(kept) + 5 - 1  # All but the young orphan
+    assert contents == [content(1), content(0), content(3)]
+
+
+async def collect_within_grace():
+    async with fresh_app() as client:
+        headers = await login(client, "patient")
+        await create_document(client, headers, content(0))
+        await database.document_contents.insert_one({"type": "snapshot", "content": content(1)})
+        records = len(database.document_contents._records)
+
+        deleted, reclaimed = await collect_orphaned_contents()
+
+    return deleted, reclaimed, records, len(database.document_contents._records)
+
+
+def test_leaves_records_within_the_grace_period():
+    deleted, reclaimed, before, after = asyncio.run(collect_within_grace())
+    assert (deleted, reclaimed) == (0, 0)
+    assert after == before == 2
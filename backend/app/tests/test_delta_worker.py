@@ -0,0 +1,231 @@
+"""Write-behind deltas must settle once, into versions that read back unchanged, and keyframes share content."""
+import asyncio
+
+from bson import ObjectId
+from sqlalchemy import select
+
+import database
+from conftest import commit, create_document, fresh_app, login
+from config import settings
+from tables import Version
+from versioning import content_hash, resolve_content_refs, shared_keyframes, version_cache
+from workers import claim_pending_delta, settle_pending_deltas
+
+
+def content(i: int) -> dict:
+    return {"version": i, "items": list(range(i)), "text": "v" * i}
+
+
+async def read_versions(client, headers, document_id: int, count: int) -> list[dict]:
+    """Every version from a cold cache, oldest first."""
+    contents = []
+    for n in range(count):
+        version_cache.__init__(version_cache.max_bytes)
+        response = await client.get(f"/documents/{document_id}/versions/{n}", headers=headers)
+        assert response.status_code == 200, response.text
+        contents.append(response.json()["content"])
+    return contents
+
+
+def pending_ids() -> list[ObjectId]:
+    return [record_id for record_id, record in database.document_contents._records.items() if b"pending" in record]
+
+
+async def version_rows(document_id: int) -> list[Version]:
+    async with database.AsyncSessionLocal() as session:
+        result = await session.execute(select(Version).where(Version.document_id == document_id).order_by(Version.version_number))
+        return result.scalars().all()
+
+
+async def settle_then_commit(monkeypatch):
+    async with fresh_app() as client:
+        headers = await login(client, "settler")
+        document_id = await create_document(client, headers, content(0))
+
+        monkeypatch.setattr(settings, "WRITE_BEHIND_DELTAS", True)
+        for i in range(1, 5):
+            await commit(client, headers, document_id, content(i))
+        before = len(pending_ids())
+        unsettled = await read_versions(client, headers, document_id, 5)
+
+        # Oldest first, so each record finds its previous head settled already
+        while await settle_pending_deltas():
+            pass
+        settled = await read_versions(client, headers, document_id, 5)
+
+        # Synchronous commits carry on from the counters the worker left on the head
+        monkeypatch.setattr(settings, "WRITE_BEHIND_DELTAS", False)
+        for i in range(5, 8):
+            await commit(client, headers, document_id, content(i))
+        after = await read_versions(client, headers, document_id, 8)
+        keyframes = [version.is_keyframe for version in await version_rows(document_id)]
+
+    return before, pending_ids(), unsettled, settled, after, keyframes
+
+
+def test_commits_after_settled_deltas(monkeypatch):
+    monkeypatch.setattr(settings, "KEYFRAME_INTERVAL", 2)
+    before, left, unsettled, settled, after, keyframes = asyncio.run(settle_then_commit(monkeypatch))
+
+    assert before == 4
+    assert left == []
+    assert unsettled == settled == [content(i) for i in range(5)]
+    assert after == [content(i) for i in range(8)]
+
+    # Every second version below the head keeps its content
+    below_head = "".join("k" if is_keyframe else "d" for is_keyframe in keyframes[:-1])
+    assert "dd" not in below_head, below_head
+
+
+async def commit_before_settling(monkeypatch):
+    async with fresh_app() as client:
+        headers = await login(client, "overtaker")
+        document_id = await create_document(client, headers, content(0))
+
+        # A synchronous commit lands on the write-behind head before its delta is settled
+        monkeypatch.setattr(settings, "WRITE_BEHIND_DELTAS", True)
+        await commit(client, headers, document_id, content(1))
+        monkeypatch.setattr(settings, "WRITE_BEHIND_DELTAS", False)
+        await commit(client, headers, document_id, content(2))
+
+        while await settle_pending_deltas():
+            pass
+        rows = await version_rows(document_id)
+        records = [await database.document_contents.find_one({"_id": ObjectId(row.mongo_id)}) for row in rows]
+        contents = await read_versions(client, headers, document_id, 3)
+
+    return records, contents
+
+
+def test_commit_before_the_delta_settles(monkeypatch):
+    records, contents = asyncio.run(commit_before_settling(monkeypatch))
+
+    assert contents == [content(i) for i in range(3)]
+    assert [record["type"] for record in records] == ["delta", "delta", "snapshot"]
+    assert not any("pending" in record for record in records)
+    # The counters belong on the head snapshot only
+    assert ["deltas_since_keyframe" in record for record in records] == [False, False, True]
+
+
+async def race_two_workers(monkeypatch):
+    async with fresh_app() as client:
+        headers = await login(client, "racer")
+        document_id = await create_document(client, headers, content(0))
+        monkeypatch.setattr(settings, "WRITE_BEHIND_DELTAS", True)
+        for i in range(1, 4):
+            await commit(client, headers, document_id, content(i))
+        monkeypatch.setattr(settings, "WRITE_BEHIND_DELTAS", False)
+
+        # Only one of two workers gets a record; the other sees the live claim
+        record_id = pending_ids()[0]
+        first, second = await claim_pending_delta(record_id), await claim_pending_delta(record_id)
+
+        # A claim lapses once its worker is presumed dead
+        monkeypatch.setattr(settings, "WRITE_BEHIND_CLAIM_SECONDS", -1.0)
+        await database.document_contents.update_one({"_id": record_id}, {"$unset": {"pending.claimed_until": ""}})
+        lapsed = await claim_pending_delta(record_id)
+        reclaimed = await claim_pending_delta(record_id)
+        monkeypatch.setattr(settings, "WRITE_BEHIND_CLAIM_SECONDS", 60.0)
+        await database.document_contents.update_one({"_id": record_id}, {"$unset": {"pending.claimed_until": ""}})
+
+        # Two workers scanning the same batch at once settle each record once
+        settled = []
+        original = database.document_contents.update_one
+
+        async def recording_update(query, update):
+            if "pending" in update.get("$unset", {}):
+                settled.append(query["_id"])
+            return await original(query, update)
+
+        monkeypatch.setattr(database.document_contents, "update_one", recording_update)
+        await asyncio.gather(settle_pending_deltas(), settle_pending_deltas())
+        while await settle_pending_deltas():
+            pass
+        monkeypatch.undo()
+
+        contents = await read_versions(client, headers, document_id, 4)
+
+    return first, second, lapsed, reclaimed, settled, contents
+
+
+def test_two_workers_claim_a_record_once(monkeypatch):
+    first, second, lapsed, reclaimed, settled, contents = asyncio.run(race_two_workers(monkeypatch))
+
+    assert first is not None and first["pending"]["claimed_until"] > 0
+    assert second is None
+    assert lapsed is not None and reclaimed is not None
+    assert len(settled) == 3 and len(set(settled)) == 3
+    assert contents == [content(i) for i in range(4)]
+
+
+async def leave_uncommitted_snapshot():
+    async with fresh_app() as client:
+        headers = await login(client, "orphaner")
+        document_id = await create_document(client, headers, content(0))
+        head = (await version_rows(document_id))[0]
+
+        # A snapshot whose commit never reached PostgreSQL must not touch the head
+        result = await database.document_contents.insert_one({
+            "type": "snapshot",
+            "content": content(1),
+            "pending": {"previous": head.mongo_id, "document_id": document_id, "version_number": 0}
+        })
+        await settle_pending_deltas()
+        orphan = await database.document_contents.find_one({"_id": result.inserted_id})
+        contents = await read_versions(client, headers, document_id, 1)
+
+    return orphan, contents
+
+
+def test_uncommitted_snapshots_stay_pending():
+    orphan, contents = asyncio.run(leave_uncommitted_snapshot())
+    assert "pending" in orphan
+    assert contents == [content(0)]
+
+
+async def share_keyframes():
+    async with fresh_app() as client:
+        headers = await login(client, "sharer")
+        first = await create_document(client, headers, content(0))
+        second = await create_document(client, headers, content(0))
+
+        # Versions 0 and 2 of the first document hold the same content: 2 refers to 0's
+        for i in (1, 0, 3):
+            await commit(client, headers, first, content(i))
+        response = await client.post("/documents/commits", json={"items": [{"document_id": second, "content": content(1)}]}, headers=headers)
+        assert response.json()[0]["status"] == 200, response.text
+
+        rows, second_rows = await version_rows(first), await version_rows(second)
+        async with database.AsyncSessionLocal() as session:
+            shared = await shared_keyframes(session, [
+                (first, content_hash(content(0))),
+                (first, content_hash(content(1))),
+                (second, content_hash(content(0))),
+                (second, content_hash(content(1))),  # Only the head holds it, and heads are no keyframes
+                (first, "no such content")
+            ])
+
+        revert = await database.document_contents.find_one({"_id": ObjectId(rows[2].mongo_id)})
+        keyframe = await database.document_contents.find_one({"_id": ObjectId(rows[0].mongo_id)})
+        records = [dict(revert), dict(revert)]
+        await resolve_content_refs(records)
+        contents = await read_versions(client, headers, first, 4)
+
+    return rows, second_rows, shared, revert, keyframe, records, contents
+
+
+def test_keyframes_share_identical_content(monkeypatch):
+    monkeypatch.setattr(settings, "KEYFRAME_INTERVAL", 1)
+    rows, second_rows, shared, revert, keyframe, records, contents = asyncio.run(share_keyframes())
+    first, second = rows[0].document_id, second_rows[0].document_id
+
+    # Per document: the batch made the second document's version 0 a keyframe of its own
+    assert shared == {
+        (first, content_hash(content(0))): rows[0].mongo_id,
+        (first, content_hash(content(1))): rows[1].mongo_id,
+        (second, content_hash(content(0))): second_rows[0].mongo_id
+    }
+    assert "content" not in revert and revert["content_ref"] == keyframe["_id"]
+    assert records[0]["content"] == records[1]["content"] == content(0)
+    assert records[0]["content"] is not records[1]["content"]  # Each chain patches its own copy
+    assert contents == [content(0), content(1), content(0), content(3)]
@@ -0,0 +1,79 @@
+"""Streaming the history must survive commits landing after the head was read."""
+import asyncio
+import json
+
+import database
+import routes.documents
+
+from conftest import commit, create_document, fresh_app, login
+from versioning import iter_history
+
+
+def content(i: int) -> dict:
+    return {"version": i, "items": list(range(i)), "text": "v" * i}
+
+
+async def history_after_concurrent_commit():
+    async with fresh_app() as client:
+        headers = await login(client, "historian")
+        document_id = await create_document(client, headers, content(0))
+        for i in range(1, 4):
+            await commit(client, headers, document_id, content(i))
+
+        # Read the head, then let a commit turn it into a delta before the first MongoDB read
+        stale_head = 3
+        await commit(client, headers, document_id, content(4))
+        async with database.AsyncSessionLocal() as session:
+            # Copied: the walk patches each yielded content in place
+            walked = [(version.version_number, json.loads(json.dumps(c))) async for version, c in iter_history(session, document_id, stale_head)]
+
+    return walked
+
+
+async def stream_with_commit_before_first_read():
+    async with fresh_app() as client:
+        headers = await login(client, "streamer")
+        document_id = await create_document(client, headers, content(0))
+        for i in range(1, 3):
+            await commit(client, headers, document_id, content(i))
+
+        # The stream opens its session after the response has started: commit right then
+        open_session = routes.documents.AsyncSessionLocal
+
+        def session_after_commit():
+            routes.documents.AsyncSessionLocal = open_session
+            return _CommitFirst(client, headers, document_id, open_session())
+
+        routes.documents.AsyncSessionLocal = session_after_commit
+        try:
+            response = await client.get(f"/documents/{document_id}/history/stream", headers=headers)
+        finally:
+            routes.documents.AsyncSessionLocal = open_session
+
+    return response
+
+
+class _CommitFirst:
+    """Session context manager that commits a new version before handing the session over."""
+
+    def __init__(self, client, headers, document_id, session):
+        self.client, self.headers, self.document_id, self.session = client, headers, document_id, session
+
+    async def __aenter__(self):
+        await commit(self.client, self.headers, self.document_id, content(3))
+        return await self.session.__aenter__()
+
+    async def __aexit__(self, *exc):
+        return await self.session.__aexit__(*exc)
+
+
+def test_iter_history_from_a_head_that_became_a_delta():
+    walked = asyncio.run(history_after_concurrent_commit())
+    assert walked == [(i, content(i)) for i in (3, 2, 1, 0)]
+
+
+def test_stream_history_with_a_commit_before_the_first_read():
+    response = asyncio.run(stream_with_commit_before_first_read())
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [(line["version_number"], line["content"]) for line in lines] == [(i, content(i)) for i in (3, 2, 1, 0)]
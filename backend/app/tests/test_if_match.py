@@ -0,0 +1,25 @@
+"""Conditional commits take the base version from a strong If-Match entity tag only."""
+import asyncio
+
+from conftest import create_document, fresh_app, login
+
+
+async def commit_with(if_match: list[str | None]) -> list[int]:
+    async with fresh_app() as client:
+        headers = await login(client, "matcher")
+        document_id = await create_document(client, headers, {"n": 0})
+
+        statuses = []
+        for i, value in enumerate(if_match, start=1):
+            conditional = {**headers, "If-Match": value} if value is not None else headers
+            response = await client.post(f"/documents/{document_id}/commit", json={"content": {"n": i}}, headers=conditional)
+            statuses.append(response.status_code)
+
+    return statuses
+
+
+def test_if_match_needs_a_strong_version_tag():
+    statuses = asyncio.run(commit_with(['W/"0"', '"0"', '"0"', "1", 'W/"2"', "undefined", "*", None]))
+
+    # Weak tag, head, stale, bare number, weak tag, not a version, any head, unconditional
+    assert statuses == [412, 200, 409, 200, 412, 400, 200, 200]
@@ -0,0 +1,151 @@
+"""The reverse patch derived from a forward patch must turn the result back into the original."""
+import copy
+import random
+
+import jsonpatch
+import pytest
+
+import conftest  # noqa: F401  (stand-ins first)
+from versioning import apply_with_inverse, build_commit, content_hash
+
+DOCUMENT = {
+    "title": "notes",
+    "tags": ["a", "b", "c"],
+    "meta": {"owner": "ann", "flags": {"draft": True}},
+    "rows": [{"id": 1, "cells": [1, 2]}, {"id": 2, "cells": []}]
+}
+
+CASES = {
+    "add member": [{"op": "add", "path": "/meta/editor", "value": "bob"}],
+    "add over a member": [{"op": "add", "path": "/meta/owner", "value": {"name": "bob"}}],
+    "add at an array index": [{"op": "add", "path": "/tags/1", "value": "x"}],
+    "add at the array end": [{"op": "add", "path": "/tags/-", "value": "z"}],
+    "add into a nested array": [{"op": "add", "path": "/rows/0/cells/0", "value": 0}],
+    "remove member": [{"op": "remove", "path": "/meta/flags"}],
+    "remove array element": [{"op": "remove", "path": "/tags/0"}],
+    "replace": [{"op": "replace", "path": "/title", "value": ["now", "a", "list"]}],
+    "replace array element": [{"op": "replace", "path": "/rows/1", "value": None}],
+    "move member": [{"op": "move", "from": "/meta/owner", "path": "/owner"}],
+    "move over a member": [{"op": "move", "from": "/meta/owner", "path": "/title"}],
+    "move within an array": [{"op": "move", "from": "/tags/0", "path": "/tags/2"}],
+    "move between arrays": [{"op": "move", "from": "/rows/0/cells/1", "path": "/tags/-"}],
+    "move onto its ancestor": [{"op": "move", "from": "/meta/flags", "path": "/meta"}],
+    "copy": [{"op": "copy", "from": "/rows/0", "path": "/rows/-"}],
+    "copy over a member": [{"op": "copy", "from": "/tags", "path": "/title"}],
+    "test": [{"op": "test", "path": "/title", "value": "notes"}],
+    "several operations": [
+        {"op": "remove", "path": "/tags/1"},
+        {"op": "add", "path": "/tags/0", "value": "first"},
+        {"op": "move", "from": "/rows/1", "path": "/rows/0"},
+        {"op": "replace", "path": "/rows/0/id", "value": 20},
+        {"op": "copy", "from": "/meta", "path": "/rows/1/meta"}
+    ],
+    "operations on the same path": [
+        {"op": "add", "path": "/new", "value": 1},
+        {"op": "replace", "path": "/new", "value": 2},
+        {"op": "remove", "path": "/new"}
+    ],
+    "move onto itself": [{"op": "move", "from": "/tags", "path": "/tags"}],
+    "empty patch": []
+}
+
+
+@pytest.mark.parametrize("operations", CASES.values(), ids=CASES.keys())
+def test_inverse_restores_the_original(operations):
+    original = copy.deepcopy(DOCUMENT)
+    patched, inverse = apply_with_inverse(copy.deepcopy(DOCUMENT), operations)
+
+    assert patched == jsonpatch.apply_patch(DOCUMENT, operations)
+    assert jsonpatch.apply_patch(patched, inverse) == original
+    assert DOCUMENT == original
+
+
+@pytest.mark.parametrize("operations", [CASES["test"], CASES["move onto itself"], CASES["empty patch"], CASES["operations on the same path"]])
+def test_no_op_patches_leave_the_document_unchanged(operations):
+    patched, inverse = apply_with_inverse(copy.deepcopy(DOCUMENT), operations)
+    assert patched == DOCUMENT
+    assert jsonpatch.apply_patch(patched, inverse) == DOCUMENT
+
+
+def test_patch_commit_hashes_its_result():
+    operations = CASES["several operations"]
+    new_content, reverse_patch, patched_hash = build_commit(copy.deepcopy(DOCUMENT), None, operations)
+
+    assert patched_hash == content_hash(new_content)
+    assert jsonpatch.apply_patch(new_content, reverse_patch) == DOCUMENT
+
+
+def test_unchanged_patch_commit_hashes_like_the_original():
+    new_content, reverse_patch, patched_hash = build_commit(copy.deepcopy(DOCUMENT), None, CASES["test"])
+    assert patched_hash == content_hash(DOCUMENT)
+    assert reverse_patch == []
+
+
+def test_content_commit_diffs_back_to_the_original():
+    content = {**DOCUMENT, "title": "renamed"}
+    new_content, reverse_patch, patched_hash = build_commit(copy.deepcopy(DOCUMENT), content, None)
+
+    assert new_content == content
+    assert patched_hash is None  # Full content is hashed before the commit is built
+    assert jsonpatch.apply_patch(new_content, reverse_patch) == DOCUMENT
+
+
+@pytest.mark.parametrize("operations", [
+    [{"op": "remove", "path": "/missing"}],
+    [{"op": "replace", "path": "/tags/9", "value": 1}],
+    [{"op": "move", "path": "/x"}],
+    [{"op": "test", "path": "/title", "value": "other"}]
+])
+def test_patches_that_do_not_apply_raise(operations):
+    with pytest.raises((jsonpatch.JsonPatchException, jsonpatch.JsonPointerException)):
+        apply_with_inverse(copy.deepcopy(DOCUMENT), operations)
+
+
+def _random_value(rng: random.Random, depth: int = 0):
+    roll = rng.random()
+    if depth > 2 or roll < 0.4:
+        return rng.choice([1, "s", None, True, 2.5])
+    if roll < 0.7:
+        return {rng.choice("abcd"): _random_value(rng, depth + 1) for _ in range(rng.randint(0, 3))}
+    return [_random_value(rng, depth + 1) for _ in range(rng.randint(0, 3))]
+
+
+def _pointers(value, prefix: str = "") -> list[str]:
+    pointers = [prefix]
+    if isinstance(value, dict):
+        for key, item in value.items():
+            pointers += _pointers(item, f"{prefix}/{key}")
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            pointers += _pointers(item, f"{prefix}/{i}")
+    return pointers
+
+
+def test_random_patches_invert():
+    rng = random.Random(7)
+    for _ in range(2000):
+        document = {"a": _random_value(rng), "b": _random_value(rng), "c": [_random_value(rng), _random_value(rng)]}
+        operations, expected = [], copy.deepcopy(document)
+        for _ in range(rng.randint(1, 4)):
+            pointers = _pointers(expected)
+            if len(pointers) == 1:
+                break  # Everything was removed
+            pointer = rng.choice(pointers[1:])
+            op = rng.choice(["add", "remove", "replace", "move", "copy"])
+            if op == "add":
+                operation = {"op": "add", "path": f"{pointer}/{rng.choice(['-', 'x', '0'])}", "value": _random_value(rng)}
+            elif op in ("move", "copy"):
+                operation = {"op": op, "from": rng.choice(pointers[1:]), "path": rng.choice(pointers[1:] + [f"{pointer}/z"])}
+            elif op == "remove":
+                operation = {"op": "remove", "path": pointer}
+            else:
+                operation = {"op": "replace", "path": pointer, "value": _random_value(rng)}
+            try:
+                expected = jsonpatch.apply_patch(expected, [operation])
+            except (jsonpatch.JsonPatchException, jsonpatch.JsonPointerException):
+                continue
+            operations.append(operation)
+
+        patched, inverse = apply_with_inverse(copy.deepcopy(document), operations)
+        assert patched == expected, operations
+        assert jsonpatch.apply_patch(patched, inverse) == document, operations
@@ -0,0 +1,164 @@
+"""Every version must read back the same whatever the keyframe spacing and the version cache hold."""
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+import database
+from conftest import commit, create_document, fresh_app, login
+from config import settings
+from tables import Version
+from versioning import VersionCache, version_cache
+
+
+def content(i: int) -> dict:
+    return {"version": i, "items": list(range(i)), "nested": {"text": "v" * i}}
+
+
+# Version 0 is created; 3 and 6 are patch commits; 8 reverts to version 2's content
+CONTENTS = [content(0), content(1), content(2), content(3), content(4), content(5), content(6), content(7), content(2), content(9)]
+
+
+async def patch_commit(client, headers, document_id: int, base: int, patch: list) -> int:
+    response = await client.post(f"/documents/{document_id}/commit", json={"patch": patch}, headers={**headers, "If-Match": f'"{base}"'})
+    assert response.status_code == 200, response.text
+    return response.json()["version_number"]
+
+
+async def build_history(client, headers) -> int:
+    document_id = await create_document(client, headers, CONTENTS[0])
+    for i in range(1, len(CONTENTS)):
+        if i in (3, 6):
+            patch = [
+                {"op": "replace", "path": "/version", "value": i},
+                {"op": "add", "path": "/items/-", "value": i - 1},
+                {"op": "replace", "path": "/nested/text", "value": "v" * i}
+            ]
+            assert await patch_commit(client, headers, document_id, i - 1, patch) == i
+        else:
+            assert await commit(client, headers, document_id, CONTENTS[i]) == i
+    return document_id
+
+
+async def read_version(client, headers, document_id: int, version_number: int) -> dict:
+    response = await client.get(f"/documents/{document_id}/versions/{version_number}", headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["content"]
+
+
+async def read_every_version():
+    async with fresh_app() as client:
+        headers = await login(client, "keyframer")
+        document_id = await build_history(client, headers)
+        numbers = range(len(CONTENTS))
+
+        # From a cold cache each time: the whole chain from the nearest keyframe or the head
+        cold = {}
+        for n in numbers:
+            version_cache.__init__(version_cache.max_bytes)
+            cold[n] = await read_version(client, headers, document_id, n)
+
+        # Newest first, each read starting from the cached version above it
+        version_cache.__init__(version_cache.max_bytes)
+        newest_first = {n: await read_version(client, headers, document_id, n) for n in reversed(numbers)}
+        oldest_first = {n: await read_version(client, headers, document_id, n) for n in numbers}
+
+        async with database.AsyncSessionLocal() as session:
+            result = await session.execute(select(Version.version_number, Version.is_keyframe).where(Version.document_id == document_id).order_by(Version.version_number))
+            keyframes = [is_keyframe for _, is_keyframe in result.all()]
+
+    return cold, newest_first, oldest_first, keyframes
+
+
+@pytest.mark.parametrize("interval", [1, 2, 3])
+def test_every_version_materializes_with_any_keyframe_interval(monkeypatch, interval):
+    monkeypatch.setattr(settings, "KEYFRAME_INTERVAL", interval)
+    cold, newest_first, oldest_first, keyframes = asyncio.run(read_every_version())
+
+    expected = dict(enumerate(CONTENTS))
+    assert cold == expected
+    assert newest_first == expected
+    assert oldest_first == expected
+
+    # No run of pure deltas below the head is as long as the interval
+    below_head = "".join("k" if is_keyframe else "d" for is_keyframe in keyframes[:-1])
+    assert "d" * interval not in below_head, below_head
+
+
+async def read_within_budget():
+    async with fresh_app() as client:
+        headers = await login(client, "budgeter")
+        document_id = await build_history(client, headers)
+
+        # Room for about two versions
+        version_cache.__init__(2 * len(str(content(9))))
+        reads, sizes = {}, []
+        for n in reversed(range(len(CONTENTS))):
+            reads[n] = await read_version(client, headers, document_id, n)
+            sizes.append(version_cache.size)
+        stats = version_cache.stats()
+
+    return reads, sizes, stats
+
+
+def test_version_cache_stays_within_its_byte_budget():
+    reads, sizes, stats = asyncio.run(read_within_budget())
+
+    assert reads == dict(enumerate(CONTENTS))
+    assert all(size <= stats["max_bytes"] for size in sizes)
+    assert stats["evictions"] > 0
+    assert stats["bytes"] == sizes[-1]
+
+
+def test_version_cache_evicts_least_recently_used_first():
+    cache = VersionCache(100)
+    cache.put(1, 0, "a", 40)
+    cache.put(1, 1, "b", 40)
+    assert cache.nearest(1, 0) == (0, "a")  # Now the most recently used
+
+    cache.put(1, 2, "c", 40)
+    assert cache.nearest(1, 1) == (2, "c")  # Evicted; only its newer neighbour is left
+    assert cache.nearest(1, 0) == (0, "a")
+    assert (cache.size, cache.evictions) == (80, 1)
+
+    cache.put(2, 0, "too big", 101)
+    assert cache.nearest(2, 0) is None
+    assert cache.size == 80
+
+    cache.invalidate(1, from_version=2)
+    assert cache.nearest(1, 2) is None
+    assert cache.size == 40
+
+
+async def read_after_commit():
+    async with fresh_app() as client:
+        headers = await login(client, "invalidator")
+        document_id = await create_document(client, headers, content(0))
+        head = await read_version(client, headers, document_id, 0)
+
+        # Whatever is cached under the next version number must not outlive the commit that takes it
+        version_cache.put(document_id, 1, (None, {"stale": True}), 10)
+        await commit(client, headers, document_id, content(1))
+        committed = await read_version(client, headers, document_id, 1)
+
+        # Nor under the numbers a batch commit takes
+        version_cache.put(document_id, 2, (None, {"stale": True}), 10)
+        response = await client.post("/documents/commits", json={"items": [{"document_id": document_id, "content": content(2)}]}, headers=headers)
+        assert response.status_code == 200, response.text
+        assert response.json()[0]["status"] == 200, response.text
+        batch_committed = await read_version(client, headers, document_id, 2)
+
+        deleted = await client.delete(f"/documents/{document_id}", headers=headers)
+        assert deleted.status_code == 200, deleted.text
+        left_behind = version_cache.versions.get(document_id)
+
+    return head, committed, batch_committed, left_behind
+
+
+def test_commits_invalidate_the_version_cache():
+    head, committed, batch_committed, left_behind = asyncio.run(read_after_commit())
+
+    assert head == content(0)
+    assert committed == content(1)
+    assert batch_committed == content(2)
+    assert left_behind is None
@@ -0,0 +1,22 @@
+"""Sizing a payload for the offload decision must not serialize it."""
+import json
+
+import conftest  # noqa: F401  (stand-ins first)
+from config import settings
+from offload import payload_size
+
+
+def test_payload_size_is_close_for_small_payloads():
+    content = {"title": "notes", "items": [{"id": i, "text": "x" * 20, "done": False} for i in range(50)], "owner": None}
+    exact = len(json.dumps(content, separators=(",", ":")))
+    assert 0.8 * exact <= payload_size(content) <= 1.5 * exact
+
+
+def test_payload_size_stops_at_the_offload_threshold():
+    huge = {"items": [{"id": i, "text": "x" * 100} for i in range(200_000)]}
+    size = payload_size(huge)
+    assert settings.PATCH_OFFLOAD_MIN_BYTES <= size < settings.PATCH_OFFLOAD_MIN_BYTES + 200
+
+
+def test_payload_size_adds_up_several_values():
+    assert payload_size({"a": "xyz"}, ["xyz"]) == payload_size({"a": "xyz"}) + payload_size(["xyz"])
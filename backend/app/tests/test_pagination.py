@@ -0,0 +1,42 @@
+"""Keyset pagination must reach the last page, whatever the database stores timestamps as."""
+import asyncio
+import httpx
+
+from conftest import commit, create_document, fresh_app, login
+
+MAX_PAGES = 50  # Far more than needed; a cursor that never advances would loop forever
+
+
+async def walk(client: httpx.AsyncClient, url: str, headers: dict, limit: int) -> list[dict]:
+    """Every row of a paginated listing, following X-Next-Cursor until the last page."""
+    rows, cursor = [], None
+    for _ in range(MAX_PAGES):
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = await client.get(url, params=params, headers=headers)
+        assert response.status_code == 200, response.text
+        rows += response.json()
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return rows
+    raise AssertionError(f"{url} did not reach its last page in {MAX_PAGES} pages")
+
+
+async def walk_all_pages():
+    async with fresh_app() as client:
+        headers = await login(client, "pager")
+        created = [await create_document(client, headers, {"n": i}, title=f"doc {i}") for i in range(7)]
+        for i in range(1, 6):
+            await commit(client, headers, created[0], {"n": 100 + i})
+
+        documents = await walk(client, "/documents", headers, limit=2)
+        versions = await walk(client, f"/documents/{created[0]}/versions", headers, limit=2)
+
+    return created, documents, versions
+
+
+def test_pagination_reaches_the_last_page():
+    created, documents, versions = asyncio.run(walk_all_pages())
+
+    # The committed document is the most recently modified; the rest follow newest first
+    assert [d["document_id"] for d in documents] == [created[0], *reversed(created[1:])]
+    assert [v["version_number"] for v in versions] == [5, 4, 3, 2, 1, 0]
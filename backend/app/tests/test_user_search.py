@@ -0,0 +1,25 @@
+"""User search: prefix matches first, shortest first, then substring matches from 3 characters on."""
+import asyncio
+
+from conftest import fresh_app, login
+
+
+async def search(queries: list[str]) -> dict[str, list[str]]:
+    async with fresh_app() as client:
+        headers = await login(client, "alice")
+        for name in ["xbob", "bobby", "bob", "b_o", "robert", "bo%x"]:
+            await login(client, name)
+        found = {}
+        for q in queries:
+            response = await client.get("/auth/users/search", params={"q": q}, headers=headers)
+            assert response.status_code == 200, response.text
+            found[q] = [user["username"] for user in response.json()]
+    return found
+
+
+def test_user_search():
+    found = asyncio.run(search(["bo", "BOB", "b_o", "bo%"]))
+    assert found["bo"] == ["bob", "bo%x", "bobby"]  # Too short for substring matches
+    assert found["BOB"] == ["bob", "bobby", "xbob"]
+    assert found["b_o"] == ["b_o"]  # Wildcards match literally
+    assert found["bo%"] == ["bo%x"]
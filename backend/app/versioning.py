@@ -0,0 +1,581 @@
+import copy
+import hashlib
+import json
+import jsonpatch
+
+from bisect import bisect_left, insort
+from bson import ObjectId
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, exists, func, or_, select, update
+
+from jsonpointer import JsonPointer, JsonPointerException
+
+from codec import decode_record, encode_set
+from config import settings
+from database import document_contents
+from metrics import patch_bytes, reconstruction_depth
+from profiling import current_route
+from offload import payload_size, run_cpu
+from queries import keyframes_with_content, versions_by_number
+from tables import Document, DocumentOwner, Version
+
+
+def json_size(value: Any) -> int:
+    """Approximate serialized size of a JSON value in bytes."""
+    return len(json.dumps(value, separators=(",", ":"), default=str))
+
+
+def content_hash(content: dict) -> str:
+    """SHA-256 of the canonical JSON form of a content: equal documents hash equally whatever their key order."""
+    return hashlib.sha256(json.dumps(content, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()).hexdigest()
+
+
+def keyframe_policy(head_snapshot: dict, patch: list) -> tuple[bool, dict]:
+    """
+    Decide whether the outgoing head snapshot keeps its full content as a keyframe.
+
+    Returns the decision and the counters to store on the new head snapshot, which
+    track how many pure deltas (and how many bytes of them) sit between the head and
+    the newest keyframe. Every reverse patch a commit stores passes through here, so this
+    is also where its size is recorded.
+    """
+    size = json_size(patch)
+    patch_bytes.observe(size, current_route())
+
+    if "pending" in head_snapshot:
+        # A write-behind delta for the version before it still needs this content
+        return True, {"deltas_since_keyframe": 0, "delta_bytes_since_keyframe": 0}
+
+    deltas = head_snapshot.get("deltas_since_keyframe", 0) + 1
+    delta_bytes = head_snapshot.get("delta_bytes_since_keyframe", 0) + size
+
+    keyframe = (
+        (settings.KEYFRAME_INTERVAL > 0 and deltas >= settings.KEYFRAME_INTERVAL)
+        or (settings.KEYFRAME_MAX_DELTA_BYTES > 0 and delta_bytes >= settings.KEYFRAME_MAX_DELTA_BYTES)
+    )
+
+    if keyframe:
+        return True, {"deltas_since_keyframe": 0, "delta_bytes_since_keyframe": 0}
+    return False, {"deltas_since_keyframe": deltas, "delta_bytes_since_keyframe": delta_bytes}
+
+
+def _resolve(content: Any, parts: list[str]) -> tuple[bool, Any]:
+    try:
+        return True, JsonPointer.from_parts(parts).resolve(content)
+    except JsonPointerException:
+        return False, None
+
+
+def _overwrites(content: Any, parts: list[str]) -> tuple[bool, Any]:
+    """Whether adding at parts replaces an existing object member, and the value it replaces."""
+    if not parts:
+        return True, content
+    found, parent = _resolve(content, parts[:-1])
+    if found and isinstance(parent, dict) and parts[-1] in parent:
+        return True, parent[parts[-1]]
+    return False, None
+
+
+def _concrete(content: Any, parts: list[str]) -> str:
+    """Pointer to where an add just landed, with the array append marker "-" resolved."""
+    if parts and parts[-1] == "-":
+        _, parent = _resolve(content, parts[:-1])
+        if isinstance(parent, list):
+            parts = parts[:-1] + [str(len(parent) - 1)]
+    return JsonPointer.from_parts(parts).path
+
+
+def _apply_step(content: Any, operation: dict) -> tuple[Any, list[dict]]:
+    """Apply one patch operation in place and return the operations that undo it."""
+    op, path = operation["op"], operation["path"]
+    parts = JsonPointer(path).parts
+
+    if op in ("remove", "replace"):
+        old_value = JsonPointer(path).resolve(content)
+        content = jsonpatch.JsonPatch([operation]).apply(content, in_place=True)
+        return content, [{"op": "add" if op == "remove" else "replace", "path": path, "value": old_value}]
+
+    if op in ("add", "copy"):
+        overwritten, old_value = _overwrites(content, parts)
+        content = jsonpatch.JsonPatch([operation]).apply(content, in_place=True)
+        landed = _concrete(content, parts)
+        if overwritten:
+            return content, [{"op": "replace", "path": landed, "value": old_value}]
+        return content, [{"op": "remove", "path": landed}]
+
+    # "test" changes nothing
+    content = jsonpatch.JsonPatch([operation]).apply(content, in_place=True)
+    return content, []
+
+
+def apply_with_inverse(content: Any, operations: list[dict]) -> tuple[Any, list[dict]]:
+    """
+    Apply a forward JSON patch in place and derive its reverse patch from the values each
+    operation overwrites, so no structural diff of the whole document is needed.
+
+    Raises jsonpatch.JsonPatchException or JsonPointerException if the patch does not apply.
+    """
+    jsonpatch.JsonPatch(operations)  # Validate the operations up front
+
+    inverses = []
+    for operation in operations:
+        if operation["op"] == "move" and "from" not in operation:
+            raise jsonpatch.InvalidJsonPatch("The operation does not contain a 'from' member")
+
+        if operation["op"] == "move" and operation["from"] == operation["path"]:
+            JsonPointer(operation["from"]).resolve(content)  # Moving a value onto itself changes nothing
+        elif operation["op"] == "move":
+            # Split into remove + add so array index shifts and moves onto an ancestor stay invertible;
+            # the undo keeps its own copy because the moved value stays live in the document
+            value = JsonPointer(operation["from"]).resolve(content)
+            content, undo_remove = _apply_step(content, {"op": "remove", "path": operation["from"]})
+            undo_remove[0]["value"] = copy.deepcopy(value)
+            content, undo_add = _apply_step(content, {"op": "add", "path": operation["path"], "value": value})
+            inverses += [undo_remove, undo_add]
+        else:
+            content, undo = _apply_step(content, operation)
+            inverses.append(undo)
+
+    # Undo the operations last to first
+    return content, [undo_op for undo in reversed(inverses) for undo_op in undo]
+
+
+def make_reverse_patch(new_content: dict, old_content: dict) -> list[dict]:
+    """Full structural diff that turns new_content back into old_content."""
+    return jsonpatch.make_patch(new_content, old_content).patch
+
+
+def build_commit(old_content: dict, content: dict | None, patch: list[dict] | None) -> tuple[dict, list[dict], str | None]:
+    """
+    Work out the new content and the reverse patch (new → old) of a commit that sends
+    either full content or a forward patch, plus the content hash of a patched result
+    (full content is hashed up front instead). old_content may be patched in place.
+
+    Raises jsonpatch.JsonPatchException or JsonPointerException if the patch does not apply.
+    """
+    if patch is None:
+        return content, make_reverse_patch(content, old_content), None
+
+    # The reverse patch falls out of the values the forward patch overwrites
+    new_content, reverse_patch = apply_with_inverse(old_content, patch)
+    if not isinstance(new_content, dict):
+        raise jsonpatch.JsonPatchException("the result is not a JSON object")
+    return new_content, reverse_patch, content_hash(new_content)
+
+
+def pending_delta(previous_mongo_id: str, document_id: int, previous_version_number: int) -> dict:
+    """
+    Marker a write-behind commit leaves on its new snapshot. The markers are the delta
+    worker's durable queue: the previous head still has to become a reverse delta.
+    """
+    return {"previous": previous_mongo_id, "document_id": document_id, "version_number": previous_version_number}
+
+
+def delta_update(reverse_patch: list[dict], keyframe: bool, content_ref: str | None = None) -> dict:
+    """
+    MongoDB update that turns an old head snapshot into a reverse delta. A keyframe whose
+    content is already stored by another keyframe (content_ref) only points at it.
+    """
+    # Reverse patch: can reconstruct old from new
+    patch_set, patch_unset = encode_set("patch", reverse_patch)
+    update = {
+        "$set": {"type": "delta", **patch_set},
+        "$unset": {"deltas_since_keyframe": "", "delta_bytes_since_keyframe": "", **patch_unset}
+    }
+    if not keyframe or content_ref:
+        update["$unset"].update({"content": "", "codec.content": ""})  # Keyframes keep their full content too
+    if keyframe and content_ref:
+        update["$set"]["content_ref"] = ObjectId(content_ref)
+    return update
+
+
+async def shared_keyframes(db: AsyncSession, contents: list[tuple[int, str]]) -> dict[tuple[int, str], str]:
+    """
+    Map each (document_id, content_hash) to the mongo_id of a keyframe of the document
+    that stores this content itself, so a new keyframe with the same content (e.g. after
+    a revert) can share it by reference. One query per store however many; pairs with no
+    such keyframe are left out.
+    """
+    if not contents:
+        return {}
+
+    result = await db.execute(keyframes_with_content(contents))
+    candidates = {row.mongo_id: (row.document_id, row.content_hash) for row in result}
+    if not candidates:
+        return {}
+
+    cursor = document_contents.find({"_id": {"$in": [ObjectId(m) for m in candidates]}, "content": {"$exists": True}}, {"_id": 1})
+    return {candidates[str(record["_id"])]: str(record["_id"]) async for record in cursor}
+
+
+async def shared_keyframe(db: AsyncSession, document_id: int, content_hash: str | None) -> str | None:
+    """shared_keyframes for one document."""
+    if content_hash is None:
+        return None
+    return (await shared_keyframes(db, [(document_id, content_hash)])).get((document_id, content_hash))
+
+
+async def resolve_content_refs(records: list[dict]):
+    """Fill in the content of keyframes that share another keyframe's content, in one query."""
+    refs = {record["content_ref"] for record in records if "content_ref" in record and "content" not in record}
+    if not refs:
+        return
+
+    cursor = document_contents.find({"_id": {"$in": list(refs)}}, {"content": 1, "codec.content": 1})
+    contents = {record["_id"]: decode_record(record)["content"] async for record in cursor}
+    for record in records:
+        if "content_ref" in record and "content" not in record:
+            record["content"] = copy.deepcopy(contents[record["content_ref"]])  # Chains patch content in place
+
+
+async def claim_next_version(db: AsyncSession, document_id: int, user_id: int, base_version: int | None = None, unless_hash: str | None = None) -> tuple[int, str, str | None] | None:
+    """
+    Check ownership, look up the head and bump current_version_number in one conditional
+    UPDATE. With base_version it is a compare-and-swap on the head; either way the row
+    stays locked until the transaction ends, which serializes writers on the document.
+    With unless_hash nothing is claimed if the head already has that content hash.
+
+    Returns the new version number and the old head's mongo_id and content hash, or None
+    if the caller does not own the document, it has no versions, base_version is stale
+    or the head's content hash is unless_hash.
+    """
+    conditions = [
+        Document.document_id == document_id,
+        Document.current_version_number.is_not(None),
+        exists().where(DocumentOwner.document_id == Document.document_id, DocumentOwner.user_id == user_id)
+    ]
+    if base_version is not None:
+        conditions.append(Document.current_version_number == base_version)
+    if unless_hash is not None:
+        conditions.append(~exists().where(
+            Version.document_id == Document.document_id,
+            Version.version_number == Document.current_version_number,
+            Version.content_hash == unless_hash
+        ))
+
+    # RETURNING sees the bumped row, so the old head is one below it. document_id is
+    # bound rather than correlated: SQLite renders RETURNING columns unqualified, which
+    # would turn the correlation into versions.document_id = versions.document_id.
+    head = (
+        select(Version.mongo_id, Version.content_hash)
+        .where(Version.document_id == document_id, Version.version_number == Document.current_version_number - 1)
+        .correlate(Document)
+    )
+    result = await db.execute(
+        update(Document)
+        .where(*conditions)
+        .values(
+            current_version_number=Document.current_version_number + 1,
+            last_modified_by=user_id,
+            last_modified_at=datetime.now(timezone.utc)
+        )
+        .returning(
+            Document.current_version_number,
+            head.with_only_columns(Version.mongo_id).scalar_subquery(),
+            head.with_only_columns(Version.content_hash).scalar_subquery()
+        )
+        .execution_options(synchronize_session=False)
+    )
+    row = result.one_or_none()
+    if row is None:
+        return None
+
+    new_version_number, mongo_id, head_hash = row
+    if mongo_id is None:
+        # We waited on another writer's row lock; its head row is newer than this statement's snapshot
+        result = await db.execute(
+            select(Version.mongo_id, Version.content_hash).where(Version.document_id == document_id, Version.version_number == new_version_number - 1)
+        )
+        mongo_id, head_hash = result.one()
+    return new_version_number, mongo_id, head_hash
+
+
+async def lock_heads(db: AsyncSession, document_ids: list[int], user_id: int) -> dict[int, tuple[int | None, str | None, str | None]]:
+    """
+    Check ownership and load the head version number, mongo_id and content hash of many
+    documents in one query. The document rows stay locked until the transaction ends; they are locked
+    in document_id order so concurrent batches can't deadlock.
+
+    Documents the caller does not own are left out of the result.
+    """
+    result = await db.execute(
+        select(Document.document_id, Document.current_version_number, Version.mongo_id, Version.content_hash)
+        .join(DocumentOwner, and_(DocumentOwner.document_id == Document.document_id, DocumentOwner.user_id == user_id))
+        .outerjoin(Version, and_(Version.document_id == Document.document_id, Version.version_number == Document.current_version_number))
+        .where(Document.document_id.in_(document_ids))
+        .order_by(Document.document_id)
+        .with_for_update(of=Document)
+    )
+    heads = {row.document_id: (row.current_version_number, row.mongo_id, row.content_hash) for row in result}
+
+    # Heads committed while we waited on a row lock are newer than this statement's snapshot
+    missing = [(document_id, number) for document_id, (number, mongo_id, _) in heads.items() if number is not None and mongo_id is None]
+    if missing:
+        result = await db.execute(versions_by_number(missing))
+        for row in result:
+            heads[row.document_id] = (row.version_number, row.mongo_id, row.content_hash)
+    return heads
+
+
+class VersionCache:
+    """
+    In-process LRU cache of materialized versions keyed by (document_id, version_number),
+    bounded by an approximate byte budget.
+
+    Historical versions never change once written, so entries only need dropping when
+    a document is deleted or a version number is reused.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[tuple[int, int], tuple[int, Any]] = OrderedDict()
+        self.versions: dict[int, list[int]] = {}  # document_id -> sorted cached version numbers
+        self.size = 0
+        self.hits = 0
+        self.partial_hits = 0  # Reconstruction started from a cached newer version
+        self.misses = 0
+        self.evictions = 0
+
+    def nearest(self, document_id: int, version_number: int) -> tuple[int, Any] | None:
+        """Return the closest cached (version_number, value) at or after version_number."""
+        numbers = self.versions.get(document_id)
+        if numbers:
+            i = bisect_left(numbers, version_number)
+            if i < len(numbers):
+                key = (document_id, numbers[i])
+                self.entries.move_to_end(key)
+                if numbers[i] == version_number:
+                    self.hits += 1
+                else:
+                    self.partial_hits += 1
+                return numbers[i], self.entries[key][1]
+
+        self.misses += 1
+        return None
+
+    def put(self, document_id: int, version_number: int, value: Any, size: int):
+        if size > self.max_bytes:
+            return
+
+        key = (document_id, version_number)
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (size, value)
+        insort(self.versions.setdefault(document_id, []), version_number)
+        self.size += size
+
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def invalidate(self, document_id: int, from_version: int = 0):
+        """Drop cached versions of a document at or after from_version."""
+        numbers = self.versions.get(document_id, [])
+        for number in numbers[bisect_left(numbers, from_version):]:
+            self._remove((document_id, number))
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "partial_hits": self.partial_hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def _remove(self, key: tuple[int, int]):
+        size, _ = self.entries.pop(key)
+        self.size -= size
+
+        numbers = self.versions[key[0]]
+        numbers.remove(key[1])
+        if not numbers:
+            del self.versions[key[0]]
+
+
+version_cache = VersionCache(settings.VERSION_CACHE_MAX_BYTES)
+
+
+async def load_delta_chain(db: AsyncSession, document_id: int, version_number: int, upper_bound: int | None = None, through: int | None = None) -> list[tuple[Version, dict]]:
+    """
+    Load the versions from the nearest keyframe (or the head) down to version_number,
+    newest first, together with their MongoDB records. upper_bound stops the chain
+    early, e.g. at a version that is already cached; through makes the chain start at
+    a keyframe no older than that version, so both ends can be materialized.
+
+    Costs one range query against PostgreSQL and one $in query against MongoDB,
+    however long the chain is.
+    """
+    keyframe_number = (
+        select(func.min(Version.version_number))
+        .join(Document, Document.document_id == Version.document_id)
+        .where(
+            Version.document_id == document_id,
+            Version.version_number >= (version_number if through is None else max(version_number, through)),
+            or_(Version.is_keyframe, Version.version_number == Document.current_version_number)
+        )
+        .scalar_subquery()
+    )
+    query = select(Version).where(
+        Version.document_id == document_id,
+        Version.version_number >= version_number,
+        Version.version_number <= keyframe_number
+    )
+    if upper_bound is not None:
+        query = query.where(Version.version_number <= upper_bound)
+
+    result = await db.execute(query.order_by(Version.version_number.desc()))
+    versions = result.scalars().all()
+    if not versions:
+        return []
+
+    cursor = document_contents.find({"_id": {"$in": [ObjectId(v.mongo_id) for v in versions]}})
+    records = {str(record["_id"]): decode_record(record) async for record in cursor}
+    await resolve_content_refs(list(records.values()))
+    return [(v, records[v.mongo_id]) for v in versions]
+
+
+def apply_delta_chain(records: list[dict], base_content: dict | None = None) -> dict:
+    """
+    Rebuild the oldest version of a newest-first chain of records in memory. base_content
+    is the known content of the newest version in the chain, for when its record has none.
+    """
+    # Start from the record closest to the target that still carries full content
+    start = max((i for i, record in enumerate(records) if "content" in record), default=None)
+    if start is None:
+        start = 0
+        content = copy.deepcopy(base_content)  # Never patch shared cached content in place
+    else:
+        content = records[start]["content"]
+
+    for record in records[start + 1:]:
+        # Records are freshly loaded, so patching in place is safe
+        content = jsonpatch.JsonPatch(record["patch"]).apply(content, in_place=True)
+    return content
+
+
+def materialize_sized(records: list[dict], base_content: dict | None = None) -> tuple[dict, int]:
+    """apply_delta_chain, plus the size of the result for the version cache, measured in the same job."""
+    content = apply_delta_chain(records, base_content)
+    return content, json_size(content)
+
+
+async def load_version(db: AsyncSession, document_id: int, version_number: int) -> tuple[datetime, dict] | None:
+    """
+    Content and modified_at of one version, from the version cache or reconstructed from
+    the nearest keyframe or cached newer version (one query per store). None if missing.
+    """
+    cached = version_cache.nearest(document_id, version_number)
+    if cached and cached[0] == version_number:
+        reconstruction_depth.observe(0, current_route())
+        return cached[1]
+
+    chain = await load_delta_chain(db, document_id, version_number, upper_bound=cached[0] if cached else None)
+    if not chain or chain[-1][0].version_number != version_number:
+        return None
+
+    # Apply reverse patches from the keyframe (or cached version) down to requested version
+    base_content = cached[1][1] if cached and chain[0][0].version_number == cached[0] else None
+    records = [record for _, record in chain]
+    content, size = await run_cpu(materialize_sized, records, base_content, size=payload_size(records, base_content))
+    start = max((i for i, record in enumerate(records) if "content" in record), default=0)
+    reconstruction_depth.observe(len(records) - 1 - start, current_route())
+    modified_at = chain[-1][0].modified_at
+    version_cache.put(document_id, version_number, (modified_at, content), size)
+    return modified_at, content
+
+
+def materialize_pair(records: list[dict], newer_index: int) -> tuple[dict, dict]:
+    """Rebuild both the oldest version of a newest-first chain of records and the one at newer_index."""
+    newer = apply_delta_chain(records[:newer_index + 1])
+
+    older = copy.deepcopy(newer)  # Keep newer intact while patching further down
+    for record in records[newer_index + 1:]:
+        if "content" in record:
+            older = record["content"]
+        else:
+            older = jsonpatch.JsonPatch(record["patch"]).apply(older, in_place=True)
+    return newer, older
+
+
+def diff_in_chain(records: list[dict], newer_index: int, forward: bool) -> list[dict]:
+    """Patch between the oldest version of a chain and the one at newer_index, in either direction."""
+    newer, older = materialize_pair(records, newer_index)
+    if forward:
+        return jsonpatch.make_patch(older, newer).patch
+    return jsonpatch.make_patch(newer, older).patch
+
+
+async def load_reverse_patches(db: AsyncSession, document_id: int, older_number: int, newer_number: int) -> list | None:
+    """
+    Compose the stored reverse patches into one patch that turns newer_number back into
+    older_number, without materializing either version. Returns None if a version in
+    the range is missing or its reverse delta has not been written yet.
+    """
+    result = await db.execute(
+        select(Version)
+        .where(
+            Version.document_id == document_id,
+            Version.version_number >= older_number,
+            Version.version_number <= newer_number
+        )
+        .order_by(Version.version_number.desc())
+    )
+    versions = result.scalars().all()
+    if len(versions) != newer_number - older_number + 1:
+        return None
+
+    # The newer end's own record is not needed: each record holds the patch into its version
+    deltas = versions[1:]
+    cursor = document_contents.find({"_id": {"$in": [ObjectId(v.mongo_id) for v in deltas]}}, {"patch": 1, "codec.patch": 1})
+    patches = {str(record["_id"]): decode_record(record).get("patch") async for record in cursor}
+
+    if any(patches.get(v.mongo_id) is None for v in deltas):
+        return None  # A write-behind delta is still pending
+    return [operation for v in deltas for operation in patches[v.mongo_id]]
+
+
+async def iter_history(db: AsyncSession, document_id: int, head_number: int) -> AsyncIterator[tuple[Version, dict]]:
+    """
+    Walk a document's history backward from the head snapshot, yielding every version
+    with its reconstructed content.
+
+    Each reverse patch is applied once, in place, so the caller must finish with a
+    yielded content before asking for the next one. Versions and their MongoDB records
+    are fetched HISTORY_STREAM_BATCH_SIZE at a time, keeping memory constant.
+
+    A commit landing after head_number was read turns that head into a delta; its
+    content is then reconstructed from the newer versions before anything is yielded.
+    """
+    result = await db.stream(
+        select(Version)
+        .where(Version.document_id == document_id, Version.version_number <= head_number)
+        .order_by(Version.version_number.desc())
+        .execution_options(yield_per=settings.HISTORY_STREAM_BATCH_SIZE)
+    )
+
+    content = None
+    async for versions in result.scalars().partitions():
+        cursor = document_contents.find({"_id": {"$in": [ObjectId(v.mongo_id) for v in versions]}})
+        records = {str(record["_id"]): decode_record(record) async for record in cursor}
+        await resolve_content_refs(list(records.values()))
+
+        for version in versions:
+            record = records[version.mongo_id]
+            if "content" in record:
+                # Snapshot or keyframe - no patching needed
+                content = record["content"]
+            elif content is None:
+                # No longer the head; copied, as the version cache keeps what load_version returns
+                loaded = await load_version(db, document_id, version.version_number)
+                if loaded is None:
+                    return
+                content = copy.deepcopy(loaded[1])
+            else:
+                content = jsonpatch.JsonPatch(record["patch"]).apply(content, in_place=True)
+            yield version, content
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from sqlalchemy import select, update
+
+from codec import decode_record
+from config import settings
+from database import AsyncSessionLocal, document_contents
+from offload import payload_size, run_cpu
+from queries import pending_deltas, versions_pointing_at
+from tables import Version
+from versioning import delta_update, keyframe_policy, make_reverse_patch, shared_keyframe
+
+
+logger = logging.getLogger(__name__)
+_delta_work = asyncio.Event()
+
+
+def wake_delta_worker():
+    """Tell the delta worker a write-behind commit is waiting, instead of letting it poll."""
+    _delta_work.set()
+
+
+async def settle_pending_delta(record: dict) -> bool:
+    """
+    Turn the head a write-behind commit left behind into a reverse delta, using the
+    content of the newer snapshot that carries the pending marker.
+
+    Returns False if the previous head still waits on its own pending delta, whose
+    computation needs the content this one would remove.
+    """
+    pending = record["pending"]
+    previous = decode_record(await document_contents.find_one({"_id": ObjectId(pending["previous"])}))
+
+    if previous is not None and "pending" in previous:
+        return False
+
+    keyframe_counters = {}
+    if previous is not None and previous.get("type") == "snapshot":
+        # Calculate REVERSE patch (new → old) for reconstruction
+        reverse_patch = await run_cpu(
+            make_reverse_patch, record["content"], previous["content"],
+            size=payload_size(record["content"], previous["content"])
+        )
+        keyframe, keyframe_counters = keyframe_policy(previous, reverse_patch)
+
+        if not keyframe:
+            await document_contents.update_one({"_id": previous["_id"]}, delta_update(reverse_patch, keyframe))
+        else:
+            async with AsyncSessionLocal() as session:
+                # Share the content of an identical keyframe instead of keeping another copy
+                result = await session.execute(
+                    select(Version.content_hash)
+                    .where(Version.document_id == pending["document_id"], Version.version_number == pending["version_number"])
+                )
+                content_ref = await shared_keyframe(session, pending["document_id"], result.scalar_one_or_none())
+
+                await document_contents.update_one({"_id": previous["_id"]}, delta_update(reverse_patch, keyframe, content_ref))
+                await session.execute(
+                    update(Version)
+                    .where(Version.document_id == pending["document_id"], Version.version_number == pending["version_number"])
+                    .values(is_keyframe=True)
+                )
+                await session.commit()
+
+    # The counters belong on the head snapshot; a synchronous commit on top of this one
+    # may have turned it into a keyframe delta meanwhile, which must not carry them
+    if keyframe_counters:
+        result = await document_contents.update_one({"_id": record["_id"], "type": "snapshot"}, {"$set": keyframe_counters, "$unset": {"pending": ""}})
+        if result.matched_count:
+            return True
+    await document_contents.update_one({"_id": record["_id"]}, {"$unset": {"pending": ""}})
+    return True
+
+
+async def claim_pending_delta(mongo_id: ObjectId) -> dict | None:
+    """
+    Claim a pending record for this worker for WRITE_BEHIND_CLAIM_SECONDS, so the workers
+    of other API processes leave it alone. Returns the record as claimed, or None if it
+    is settled already or another worker holds it.
+    """
+    now = time.time()
+    return decode_record(await document_contents.find_one_and_update(
+        {"_id": mongo_id, **pending_deltas(now)},
+        {"$set": {"pending.claimed_until": now + settings.WRITE_BEHIND_CLAIM_SECONDS}},
+        return_document=ReturnDocument.AFTER
+    ))
+
+
+async def settle_pending_deltas() -> int:
+    """Settle one batch of unclaimed write-behind commits, oldest first. Returns how many records were scanned."""
+    cursor = document_contents.find(pending_deltas(time.time())).sort("_id", 1).limit(settings.WRITE_BEHIND_BATCH_SIZE)
+    records = [decode_record(record) async for record in cursor]
+    if not records:
+        return 0
+
+    # Only snapshots whose commit reached PostgreSQL may touch the head before them; the
+    # others are still in flight, or orphans that content_gc will delete
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(versions_pointing_at([str(record["_id"]) for record in records]))
+        committed = set(result.scalars().all())
+
+    for record in records:
+        if str(record["_id"]) not in committed:
+            continue
+        claimed = await claim_pending_delta(record["_id"])
+        if claimed is not None and not await settle_pending_delta(claimed):
+            # Waits on the previous head; let whichever worker gets there first retry it
+            await document_contents.update_one({"_id": claimed["_id"], "pending": {"$exists": True}}, {"$unset": {"pending.claimed_until": ""}})
+    return len(records)
+
+
+async def run_delta_worker():
+    """
+    Background task for write-behind commits. The queue is the pending markers in
+    MongoDB, so work left over from a restart is picked up on the first scan. Every API
+    process runs one; they claim each record before settling it.
+    """
+    logger.info("Write-behind delta worker started")
+
+    while True:
+        _delta_work.clear()
+
+        try:
+            scanned = await settle_pending_deltas()
+        except Exception as e:
+            logger.error(f"Write-behind delta worker failed: {e}")
+            scanned = 0
+
+        if scanned == settings.WRITE_BEHIND_BATCH_SIZE:
+            continue  # Probably more waiting
+
+        try:
+            await asyncio.wait_for(_delta_work.wait(), timeout=settings.WRITE_BEHIND_POLL_SECONDS)
+        except TimeoutError:
+            pass
@@ -291,6 +291,28 @@ curl -X 'GET' \
 echo ""
 echo ""
 
+echo "=== QUERY PLAN CHECK ==="
+echo ""
+
+# Fails the suite if a hot query regressed to a sequential scan
+echo "Test 25: Hot queries are served from indexes"
+docker exec izanagi_backend python check_query_plans.py
+echo ""
+
+echo "=== HEALTH AND METRICS ==="
+echo ""
+
+echo "Test 26: Liveness and readiness"
+curl -s 'http://localhost:8000/healthz'
+echo ""
+curl -s 'http://localhost:8000/readyz'
+echo ""
+
+# The requests above should show up per route
+echo "Test 27: Request latency by route"
+curl -s 'http://localhost:8000/metrics' | grep '^izanagi_http_request_duration_seconds_count'
+echo ""
+
 echo "=== TEST SUITE COMPLETE ==="
 echo ""
 echo "All tests executed successfully!"